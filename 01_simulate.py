@@ -11,9 +11,9 @@ import shelve
 import copy
 import numpy as np
 import os
-from pydentate import neuron_tools
-from phase_to_rate import grid_model
-from phase_to_rate import pydentate_integrate
+from phase_to_rate import connectivity
+from phase_to_rate import parallel_simulate
+from phase_to_rate.result_cache import ResultCache
 import sys
 
 """Setup"""
@@ -21,8 +21,8 @@ dirname = os.path.dirname(__file__)
 results_dir = os.path.join(dirname, 'data')
 if not os.path.isdir(results_dir):
     os.mkdir(results_dir)
-
-neuron_tools.load_compiled_mechanisms()
+# Every finished trial is cached here, reruns skip them
+cache_dir = os.path.join(results_dir, 'cache')
 
 """Seeding and trajectories"""
 grid_seeds = np.arange(1, 2, 1)
@@ -65,6 +65,9 @@ parameters = {
     "n_grid": 200,
     "rate_scale": 5,
     "poisson_seeds": poisson_seeds,
+    # e.g. 1000 to simulate the trials of a network in one run with
+    # silent gaps, see utility/validate_trial_batching.py
+    "batch_gap_ms": None,
 }
 
 """IMPORTANT NOTE ON GC RATE ADJUSTMENT
@@ -73,44 +76,58 @@ TODO
 
 verbose = True
 
-"""Start simulating each grid seed"""
-for grid_seed in grid_seeds:
-    file_name = ("grid-seed_trajectory_poisson-seeds_duration_shuffling_tuning_pp-weight_" +
-        f"{grid_seed}_{trajectories}_{poisson_seeds[0]}-{poisson_seeds[-1]}_{parameters['dur_ms']}_{shuffling}_{network_type}_{parameters['pp_weight']}")
-    file_path = os.path.join(results_dir, file_name)
-
-    if verbose: print(f"Start simulating {file_name}")
-
-    grid_spikes, _ = grid_model.grid_simulate(
-        trajs=trajectories,
-        dur_ms=parameters['dur_ms'],
-        grid_seed=grid_seed,
-        poiss_seeds=poisson_seeds,
-        shuffle=shuffling,
-        n_grid=parameters['n_grid'],
-        speed_cm=parameters['speed'],
-        rate_scale=parameters['rate_scale'],
-    )
-
-    granule_spikes = {}
-    for traj in trajectories:
-        granule_spikes[traj] = {}
-        for poisson_seed in poisson_seeds:
-            granule_spikes[traj][poisson_seed] = {}
-            granule_spikes_poiss = pydentate_integrate.granule_simulate(
-                grid_spikes[traj][poisson_seed],
-                dur_ms=parameters['dur_ms'],
-                network_type=network_type,
-                grid_seed=grid_seed,
-                pp_weight=parameters['pp_weight'],
-            )
-            granule_spikes[traj][poisson_seed] = granule_spikes_poiss
-
-    storage = shelve.open(file_path)
-    storage["grid_spikes"] = copy.deepcopy(grid_spikes)
-    storage["granule_spikes"] = copy.deepcopy(granule_spikes)
-    storage["parameters"] = parameters
-    storage.close()
-    print(f"Done simulating {file_name}")
+# None uses as many worker processes as cores and free memory allow
+n_processes = None
 
 
+def file_path_of(grid_seed):
+    file_name = ("grid-seed_trajectory_poisson-seeds_duration_shuffling_tuning_pp-weight_" +
+        f"{grid_seed}_{trajectories}_{poisson_seeds[0]}-{poisson_seeds[-1]}_{parameters['dur_ms']}_{shuffling}_{network_type}_{parameters['pp_weight']}")
+    return os.path.join(results_dir, file_name)
+
+
+if __name__ == '__main__':
+    """Simulate all grid seeds in parallel"""
+    units = [(int(grid_seed), traj, int(poisson_seed), shuffling, network_type)
+             for grid_seed in grid_seeds
+             for traj in trajectories
+             for poisson_seed in poisson_seeds]
+    n_units = len(trajectories) * len(poisson_seeds)
+    grid_spikes = {grid_seed: {} for grid_seed in grid_seeds}
+    granule_spikes = {grid_seed: {} for grid_seed in grid_seeds}
+    n_done = {grid_seed: 0 for grid_seed in grid_seeds}
+
+    def save_result(unit, grid_spikes_poiss, granule_spikes_poiss):
+        """Store a trial and write the shelve once its grid seed is done."""
+        grid_seed = unit.grid_seed
+        grid_spikes[grid_seed].setdefault(unit.trajectory, {})[
+            unit.poisson_seed] = grid_spikes_poiss
+        granule_spikes[grid_seed].setdefault(unit.trajectory, {})[
+            unit.poisson_seed] = granule_spikes_poiss
+        n_done[grid_seed] += 1
+        if n_done[grid_seed] < n_units:
+            return
+        # Same order as a serial run, independent of completion order
+        ordered_grid = {traj: {poisson_seed: grid_spikes[grid_seed][traj][poisson_seed]
+                               for poisson_seed in poisson_seeds}
+                        for traj in trajectories}
+        ordered_granule = {traj: {poisson_seed: granule_spikes[grid_seed][traj][poisson_seed]
+                                  for poisson_seed in poisson_seeds}
+                           for traj in trajectories}
+        file_path = file_path_of(grid_seed)
+        storage = shelve.open(file_path)
+        storage["grid_spikes"] = copy.deepcopy(ordered_grid)
+        storage["granule_spikes"] = copy.deepcopy(ordered_granule)
+        storage["parameters"] = parameters
+        storage.close()
+        # PP connectivity of the network as CSR, for analyses without NEURON
+        PP_to_GCs, PP_to_BCs, _ = connectivity.pp_connectivity(grid_seed)
+        connectivity.save_connectivity(file_path + "_pp-connectivity.npz",
+                                       PP_to_GCs, PP_to_BCs)
+        print(f"Done simulating {os.path.basename(file_path)}")
+
+    if verbose: print(f"Start simulating {len(units)} trials")
+    parallel_simulate.simulate_units(units, parameters,
+                                     n_processes=n_processes,
+                                     on_result=save_result,
+                                     cache=ResultCache(cache_dir))
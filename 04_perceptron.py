@@ -1,6 +1,6 @@
 
-from neural_coding import load_spikes, rate_n_phase
-from perceptron_new import run_perceptron
+from phase_to_rate.neural_coding import load_spikes, rate_n_phase
+from phase_to_rate.perceptron import run_perceptron_batch
 import numpy as np
 import matplotlib.pyplot as plt
 import pandas as pd
@@ -114,43 +114,46 @@ for grid_seed in grid_seeds:
 rate_learning_rate = 1e-4
 polar_learning_rate = 1e-4
 phase_learning_rate = 1e-4
-n_iter = 2000
-optimizer='Adam'
+optimizer = 'Adam'
 
 data = []
 for grid_seed in all_codes:
     for shuffling in all_codes[grid_seed]:
         for cell in all_codes[grid_seed][shuffling]:
             for code in all_codes[grid_seed][shuffling][cell]:
-                for traj_idx in range(len(trajectories)-1):
-                    if code == 'phase':
-                        learning_rate = phase_learning_rate
-                    elif code == 'rate':
-                        learning_rate = rate_learning_rate
-                        if cell == 'granule':
-                            n_iter = 10000
-                    elif code == 'rate':
-                        learning_rate = polar_learning_rate
-                        if cell == 'granule':
-                            n_iter = 10000
-                    input_code = all_codes[grid_seed][shuffling][cell][code]
-                    perceptron_input = np.hstack((input_code[:, :, 0], input_code[:, :, traj_idx + 1]))
-                    th_cross, train_loss = run_perceptron(
-                        perceptron_input,
-                        grid_seed,
-                        optimizer=optimizer,
-                        learning_rate=learning_rate,
-                        n_iter=n_iter)
+                n_iter = 2000
+                if code == 'phase':
+                    learning_rate = phase_learning_rate
+                elif code == 'rate':
+                    learning_rate = rate_learning_rate
+                    if cell == 'granule':
+                        n_iter = 10000
+                elif code == 'polar':
+                    learning_rate = polar_learning_rate
+                    if cell == 'granule':
+                        n_iter = 10000
+                input_code = all_codes[grid_seed][shuffling][cell][code]
+                # All pairs of 75 with another trajectory train at once
+                perceptron_inputs = np.array(
+                    [np.hstack((input_code[:, :, 0],
+                                input_code[:, :, traj_idx + 1]))
+                     for traj_idx in range(len(trajectories)-1)])
+                th_crosses, train_losses = run_perceptron_batch(
+                    perceptron_inputs,
+                    grid_seed,
+                    learning_rates=learning_rate,
+                    n_iter=n_iter,
+                    optimizer=optimizer)
+                for traj_idx, th_cross in enumerate(th_crosses):
                     traj = trajectories[traj_idx+1]
                     idx = 75 - traj
                     comp_trajectories = str(75)+'_'+str(traj)
                     data_sing = [idx, 1/th_cross, th_cross, comp_trajectories, grid_seed, shuffling, cell, code, learning_rate]
                     data.append(copy.deepcopy(data_sing))
-                    print(traj)
-                    print(grid_seed)
-                    print(shuffling)
-                    print(cell)
-                    print(code)
+                print(grid_seed)
+                print(shuffling)
+                print(cell)
+                print(code)
 
 
 
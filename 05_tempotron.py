@@ -6,7 +6,6 @@ Created on Mon Jan 17 10:09:58 2022
 
 import shelve
 import os
-from tempotron.main import Tempotron
 import numpy as np
 import matplotlib.pyplot as plt
 import sqlite3
@@ -27,10 +26,16 @@ pr.add_argument('-shuffling',
                 help='Process shuffled or shuffled',
                 default='non-shuffled',
                 dest='shuffling')
+pr.add_argument('-engine',
+                type=str,
+                help='Tempotron implementation, package or phase_to_rate',
+                default='package',
+                dest='engine')
 
 args = pr.parse_args()
 grid_seed = args.grid_seed
 shuffling = args.shuffling
+engine = args.engine
 
 """Parameters"""
 seed = 91
@@ -64,22 +69,52 @@ all_spikes = np.array(spike_times1 + spike_times2, dtype=object)
 # Initialize synaptic efficiencies
 efficacies = np.random.rand(n_cells)
 print('synaptic efficacies:', efficacies, '\n')
-tempotron = Tempotron(V_rest, tau, tau_s, efficacies,total_time, threshold, jit_mode=True, verbose=True)
-
-"""Find the threshold"""
-tmax = [tempotron.compute_tmax(sts[0]) for sts in all_spikes]
-vmax = [tempotron.compute_membrane_potential(tmax[idx], sts[0]) for idx, sts in enumerate(all_spikes)]
-thr = np.array(vmax).mean()
-tempotron.threshold = thr
-
-pre_accuracy = tempotron.accuracy(all_spikes)
-tempotron.plot_membrane_potential(0, 2000, all_spikes[0][0])
-
-training_result = tempotron.train(all_spikes, epochs, learning_rate=learning_rate)
+if engine == 'package':
+    from tempotron.main import Tempotron
+    tempotron = Tempotron(V_rest, tau, tau_s, efficacies,total_time, threshold, jit_mode=True, verbose=True)
+
+    """Find the threshold"""
+    tmax = [tempotron.compute_tmax(sts[0]) for sts in all_spikes]
+    vmax = [tempotron.compute_membrane_potential(tmax[idx], sts[0]) for idx, sts in enumerate(all_spikes)]
+    thr = np.array(vmax).mean()
+    tempotron.threshold = thr
+
+    io_pairs = all_spikes
+    plot_membrane_potential = tempotron.plot_membrane_potential
+elif engine == 'phase_to_rate':
+    # Event driven, the kernel terms of the samples are computed once
+    from phase_to_rate.tempotron import (Tempotron, calibrate_threshold,
+                                         kernel_responses,
+                                         membrane_potentials)
+    tempotron = Tempotron(V_rest, tau, tau_s, efficacies, threshold)
+    samples, labels = tempotron.prepare(all_spikes)
+    io_pairs = list(zip(samples, labels))
+
+    """Find the threshold"""
+    thr = calibrate_threshold(samples, efficacies, tau=tau, tau_s=tau_s,
+                              V_rest=V_rest)
+    tempotron.threshold = thr
+
+    def plot_membrane_potential(t_start, t_end, sample):
+        time_grid = np.arange(t_start, t_end, 0.1)
+        responses = kernel_responses([sample], n_cells, time_grid, tau, tau_s)
+        plt.figure()
+        plt.plot(time_grid, membrane_potentials(
+            responses, tempotron.efficacies, V_rest)[0])
+        plt.axhline(tempotron.threshold, color='k', linestyle='--')
+        plt.xlabel('Time (ms)')
+        plt.ylabel('V(t)')
+else:
+    raise ValueError("engine must be 'package' or 'phase_to_rate'")
+
+pre_accuracy = tempotron.accuracy(io_pairs)
+plot_membrane_potential(0, 2000, io_pairs[0][0])
+
+training_result = tempotron.train(io_pairs, epochs, learning_rate=learning_rate)
 pre_loss = training_result[1][0]
 trained_loss = training_result[1][-1]
-trained_accuracy = tempotron.accuracy(all_spikes)
-tempotron.plot_membrane_potential(0, total_time, all_spikes[0][0])
+trained_accuracy = tempotron.accuracy(io_pairs)
+plot_membrane_potential(0, total_time, io_pairs[0][0])
 
 """Save results to database"""
 """
@@ -20,6 +20,7 @@ from statsmodels.stats.anova import AnovaRM
 import scikit_posthocs as sp
 import shelve
 from tempotron.main import Tempotron
+from phase_to_rate.tempotron_sweep import load_learning_curve
 
 """Load data"""
 dirname = os.path.dirname(__file__)
@@ -71,9 +72,13 @@ taus = []
 for idx in df.index:
     fid = df.loc[idx]['file_id']
     key = f"{fid}_{df.loc[idx]['shuffling']}_{df.loc[idx]['network']}"
-    file_path = db_path = os.path.join(
-        dirname, 'data', 'arrays', fid+'.npy')
-    curr_data = np.load(file_path)
+    try:
+        # Learning curves of tempotron_sweep are in the database
+        curr_data = load_learning_curve(con, fid)
+    except KeyError:
+        # Runs of the older scripts saved them to data/arrays
+        file_path = os.path.join(dirname, 'data', 'arrays', fid+'.npy')
+        curr_data = np.load(file_path)
     popt, pcov = scipy.optimize.curve_fit(exp_decay, np.arange(200), curr_data[1,:], p0=[100, 300])
     fit_tau, fit_init = popt
     files[key] = curr_data
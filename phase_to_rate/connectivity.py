@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Perforant path connectivity from grid cells to the dentate gyrus.
+
+Each grid cell projects to 100 granule cells and one basket cell drawn
+without replacement from a Gaussian around a random start index. The
+Gaussians scale with the population sizes. The connectivity only depends
+on the grid seed and the population sizes, so it is cached per process and
+can be saved as sparse CSR matrices next to the simulation results.
+"""
+
+import functools
+import numpy as np
+import scipy.sparse
+import scipy.stats as stats
+
+
+def _pdfs(input_scale, n_granule, n_basket):
+    # Centered on the middle of the rolled populations
+    gauss_gc = stats.norm(loc=n_granule // 2, scale=input_scale)
+    gauss_bc = stats.norm(loc=n_basket / 2,
+                          scale=(input_scale / float(n_granule)) * n_basket)
+    pdf_gc = gauss_gc.pdf(np.arange(n_granule))
+    pdf_gc = pdf_gc / pdf_gc.sum()
+    pdf_bc = gauss_bc.pdf(np.arange(n_basket))
+    pdf_bc = pdf_bc / pdf_bc.sum()
+    return pdf_gc, pdf_bc
+
+
+def _cdf(pdf):
+    cdf = np.cumsum(pdf)
+    cdf /= cdf[-1]
+    return cdf
+
+
+def _choice_compat(pdf, cdf, size):
+    """Indices drawn like np.random.choice(..., replace=False, p=pdf)."""
+    # Same rejection sampling and random numbers as numpy's legacy
+    # choice, without its per call validation and cdf of the full pdf.
+    found = np.empty(size, dtype=np.int64)
+    n_uniq = 0
+    p = None
+    while n_uniq < size:
+        x = np.random.rand(size - n_uniq)
+        if n_uniq > 0:
+            if p is None:
+                p = pdf.copy()
+            p[found[:n_uniq]] = 0
+            cdf = _cdf(p)
+        new = cdf.searchsorted(x, side='right')
+        _, unique_indices = np.unique(new, return_index=True)
+        unique_indices.sort()
+        new = new.take(unique_indices)
+        found[n_uniq:n_uniq + new.size] = new
+        n_uniq += new.size
+    return found
+
+
+def _choice_vectorized(pdf, size, n_rows):
+    """Weighted sampling without replacement for all rows at once."""
+    # Efraimidis-Spirakis: the size largest keys log(u) / p are a
+    # weighted sample without replacement, in order of drawing.
+    keys = np.log(np.random.rand(n_rows, pdf.size)) / pdf[None, :]
+    top = np.argpartition(-keys, size - 1, axis=1)[:, :size]
+    order = np.argsort(-np.take_along_axis(keys, top, axis=1), axis=1)
+    return np.take_along_axis(top, order, axis=1)
+
+
+def _draw(grid_seed, input_scale, n_grid, n_granule, n_basket, n_gc_targets,
+          n_lec, n_lec_synapses, compat):
+    np.random.seed(grid_seed)
+    pdf_gc, pdf_bc = _pdfs(input_scale, n_granule, n_basket)
+    start_idc = np.random.randint(0, n_granule - 1, size=n_grid)
+
+    # The pdf is defined on indices rolled to start at start_idc
+    if compat:
+        cdf_gc = _cdf(pdf_gc)
+        choices = np.array([_choice_compat(pdf_gc, cdf_gc, n_gc_targets)
+                            for _ in range(n_grid)])
+    else:
+        choices = _choice_vectorized(pdf_gc, n_gc_targets, n_grid)
+    PP_to_GCs = (start_idc[:, None] + choices) % n_granule
+
+    LEC_to_GCs = None
+    if n_lec:
+        # Each LEC cell chooses n_lec_synapses random GCs
+        LEC_to_GCs = np.array(
+            [np.random.choice(range(n_granule), size=n_lec_synapses,
+                              replace=False) for _ in range(n_lec)])
+
+    start_idc = np.array(((start_idc / float(n_granule)) * n_basket),
+                         dtype=int)
+    # One draw per grid cell, the same random numbers as np.random.choice
+    choices = _cdf(pdf_bc).searchsorted(np.random.rand(n_grid), side='right')
+    PP_to_BCs = ((start_idc + choices) % n_basket)[:, None]
+
+    return PP_to_GCs, PP_to_BCs, LEC_to_GCs
+
+
+@functools.lru_cache(maxsize=8)
+def _cached_draw(*args):
+    result = _draw(*args)
+    return result, np.random.get_state()
+
+
+def pp_connectivity(grid_seed, input_scale=1000, n_grid=200, n_granule=2000,
+                    n_basket=24, n_gc_targets=100, n_lec=0, n_lec_synapses=100,
+                    compat=True):
+    """
+    Targets of the perforant path in the dentate gyrus.
+
+    Seeds numpy with grid_seed and leaves its global random state where the
+    draws leave it, also when the result comes from the cache, so the
+    network that is built afterwards does not depend on the cache.
+
+    Parameters
+    ----------
+    grid_seed : int
+        Seed for the grid cell population
+        also seeds the dentate gyrus model.
+    input_scale : int
+        Scale of the input. The default is 1000.
+    n_grid : int
+        Number of grid cells. The default is 200.
+    n_granule : int
+        Number granule cells. The default is 2000.
+    n_basket : int
+        Number of basket cells. The default is 24.
+    n_gc_targets : int
+        Number of granule cells each grid cell targets. The default is 100.
+    n_lec : int
+        Number of LEC noise inputs. The default is 0.
+    n_lec_synapses : int
+        Number of granule cells each LEC input targets. The default is 100.
+    compat : bool
+        Draw the same targets and random numbers as the original per grid
+        cell np.random.choice loop. Otherwise all granule cell targets
+        are drawn at once. The default is True.
+
+    Returns
+    -------
+    PP_to_GCs : numpy array
+        Granule cell targets of each grid cell. [n_grid, n_gc_targets]
+    PP_to_BCs : numpy array
+        Basket cell target of each grid cell. [n_grid, 1]
+    LEC_to_GCs : numpy array
+        Granule cell targets of each LEC input, None if n_lec is 0.
+        [n_lec, n_lec_synapses]
+    """
+    result, state = _cached_draw(grid_seed, input_scale, n_grid, n_granule,
+                                 n_basket, n_gc_targets, n_lec,
+                                 n_lec_synapses, compat)
+    np.random.set_state(state)
+    return tuple(None if x is None else x.copy() for x in result)
+
+
+def to_csr(targets, n_target):
+    """
+    Sparse connectivity matrix of a target array.
+
+    Parameters
+    ----------
+    targets : numpy array
+        Target indices of each source. [n_source, n_synapses]
+    n_target : int
+        Size of the target population.
+
+    Returns
+    -------
+    scipy.sparse.csr_matrix
+        Number of synapses from each source to each target.
+        [n_source, n_target]
+    """
+    n_source, n_synapses = targets.shape
+    return scipy.sparse.csr_matrix(
+        (np.ones(targets.size), targets.ravel(),
+         np.arange(0, targets.size + 1, n_synapses)),
+        shape=(n_source, n_target))
+
+
+def save_connectivity(file_path, PP_to_GCs, PP_to_BCs, n_granule=2000,
+                      n_basket=24):
+    """
+    Save perforant path targets as CSR matrices in a .npz file.
+
+    The column indices keep the order of the target arrays, so
+    load_connectivity returns exactly what was saved.
+    """
+    arrays = {}
+    for name, targets, n_target in (('gc', PP_to_GCs, n_granule),
+                                    ('bc', PP_to_BCs, n_basket)):
+        matrix = to_csr(np.asarray(targets), n_target)
+        arrays[name + '_indices'] = matrix.indices
+        arrays[name + '_indptr'] = matrix.indptr
+        arrays[name + '_shape'] = np.array(matrix.shape)
+    np.savez_compressed(file_path, **arrays)
+
+
+def load_connectivity(file_path):
+    """
+    Load perforant path connectivity saved by save_connectivity.
+
+    Returns
+    -------
+    PP_to_GCs : scipy.sparse.csr_matrix
+        Grid to granule cell synapses. [n_grid, n_granule]
+    PP_to_BCs : scipy.sparse.csr_matrix
+        Grid to basket cell synapses. [n_grid, n_basket]
+    """
+    with np.load(file_path) as f:
+        return tuple(
+            scipy.sparse.csr_matrix(
+                (np.ones(f[name + '_indices'].size), f[name + '_indices'],
+                 f[name + '_indptr']), shape=tuple(f[name + '_shape']))
+            for name in ('gc', 'bc'))
@@ -7,6 +7,7 @@ Created on Wed Feb 23 13:27:14 2022
 """
 
 from phase_to_rate import grid_model
+from phase_to_rate.spike_index import SpikeTrains
 from neo.core import AnalogSignal
 import quantities as pq
 from elephant import spike_train_generation as stg
@@ -30,7 +31,7 @@ def _make_cmap(color_list, N=100):
 # function to produce samples with phase precession from overall firing
 def _precession_spikes(overall, dur_s=5, n_sim=1000, T=0.1,
                        dt_s=0.002, bins_size_deg=7.2, shuffle=False,
-                       poisson_seed_start=100):
+                       poisson_seed_start=100, theta=None):
     dur_ms = dur_s*1000
     asig = AnalogSignal(overall,
                         units=1*pq.Hz,
@@ -39,12 +40,9 @@ def _precession_spikes(overall, dur_s=5, n_sim=1000, T=0.1,
                         sampling_period=dt_s*pq.s,
                         sampling_interval=dt_s*pq.s)
 
-    times = np.arange(0, dur_s+T, T)
     n_time_bins = int(dur_s/T)
     phase_norm_fact = 360/bins_size_deg
     n_phase_bins = int(720/bins_size_deg)
-    phases = [[] for _ in range(n_time_bins)]
-    phases_doubled = [[] for _ in range(n_time_bins)]
     trains = []
     np.random.seed(poisson_seed_start)
     for i in range(n_sim):
@@ -58,21 +56,29 @@ def _precession_spikes(overall, dur_s=5, n_sim=1000, T=0.1,
         else:
             train = train/1000
         trains.append(train)
-        for j, time in enumerate(times):
-            if j == times.shape[0]-1:
-                break
-            curr_train = train[np.logical_and(train > time,
-                                              train < times[j+1])]
-            if curr_train.size > 0:
-                phases[j] += list(curr_train % (T)/(T)*360)
-                phases_doubled[j] += list(curr_train % (T)/(T)*360)
-                phases_doubled[j] += list(curr_train % (T)/(T)*360+360)
-    counts = np.empty((n_phase_bins, n_time_bins))
-    for i in range(n_phase_bins):
-        for j, phases_in_time in enumerate(phases_doubled):
-            phases_in_time = np.array(phases_in_time)
-            counts[i][j] = ((bins_size_deg*(i) < phases_in_time) &
-                            (phases_in_time < bins_size_deg*(i+1))).sum()
+    spikes = SpikeTrains(trains)
+    # phases refer to the time bins unless a theta reference is given
+    if theta is None:
+        theta = T
+    time_bin = spikes.cycle(T)
+    theta_fraction = spikes.cycle_fraction(theta)
+    in_bin = ((~spikes.on_edge(T)) & (time_bin >= 0) &
+              (time_bin < n_time_bins) & np.isfinite(theta_fraction))
+    time_bin = time_bin[in_bin]
+    spike_phases = theta_fraction[in_bin]*360
+    # stable sort keeps the spikes of each time bin in train order
+    order = np.argsort(time_bin, kind='stable')
+    splits = np.cumsum(np.bincount(time_bin, minlength=n_time_bins))[:-1]
+    phases = [list(x) for x in np.split(spike_phases[order], splits)]
+    doubled = np.concatenate((spike_phases, spike_phases+360))
+    doubled_time_bin = np.concatenate((time_bin, time_bin))
+    phase_bin = np.floor(doubled/bins_size_deg).astype(int)
+    in_phase_bin = ((doubled % bins_size_deg != 0) &
+                    (phase_bin < n_phase_bins))
+    counts = np.bincount(
+        (phase_bin*n_time_bins + doubled_time_bin)[in_phase_bin],
+        minlength=n_phase_bins*n_time_bins)
+    counts = counts.reshape(n_phase_bins, n_time_bins).astype(float)
     f = int(1/T)
     phase_loc = counts*phase_norm_fact*f/n_sim
     phase_loc = ndimage.gaussian_filter(phase_loc, sigma=[1, 1])
@@ -5,7 +5,10 @@ Created on Wed Dec  1 11:46:36 2021
 """
 
 from phase_to_rate.neural_coding import load_spikes, rate_n_phase
-from phase_to_rate.perceptron import run_perceptron
+from phase_to_rate.spike_index import spike_index
+from phase_to_rate.surrogates import surrogate_test
+from phase_to_rate.theta import theta_reference
+from functools import partial
 import numpy as np
 import matplotlib.pyplot as plt
 import pandas as pd
@@ -32,75 +35,144 @@ tunes = ['full', 'no-feedforward', 'no-feedback', 'disinhibited']
 # skaggs info for rate-phase, mean of cells, mean of spatial bins, aggregated
 # =============================================================================
 
+def _skaggs(time_bin, time_fraction, theta_fraction, cells, n_cell,
+            n_time_bins, phase_bin_size=360):
+    """Skaggs information [n_batch, n_cell] from per spike time bin ids and
+    positions within time bin and theta cycle, each [n_batch, n_spikes].
+    Spikes on bin edges are excluded."""
+    n_batch = time_bin.shape[0]
+    n_phase_bins = int(360/phase_bin_size)
+    valid = (time_fraction != 0) & (time_bin >= 0) & (time_bin < n_time_bins)
+    if phase_bin_size == 360:
+        phase_bin = np.zeros(time_bin.shape, dtype=int)
+    else:
+        in_cycle = np.isfinite(theta_fraction)
+        phases = np.where(in_cycle, theta_fraction, 0)*360
+        phase_bin = np.floor(phases/phase_bin_size).astype(int)
+        valid &= in_cycle & (phases % phase_bin_size != 0)
+    batch = np.broadcast_to(np.arange(n_batch)[:, None], time_bin.shape)
+    cells = np.broadcast_to(cells, time_bin.shape)
+    flat_idx = (((batch*n_cell + cells)*n_phase_bins + phase_bin)
+                * n_time_bins + time_bin)
+    counts = np.bincount(flat_idx[valid],
+                         minlength=n_batch*n_cell*n_phase_bins*n_time_bins)
+    counts = counts.reshape(n_batch, n_cell, n_phase_bins, n_time_bins)
+    # rates are compared to the mean over time bins for the pure rate code
+    # and to the mean over phase bins within each time bin otherwise
+    mean_axis = 3 if phase_bin_size == 360 else 2
+    mean_counts = counts.mean(axis=mean_axis, keepdims=True)
+    ratio = np.divide(counts, mean_counts, out=np.zeros(counts.shape),
+                      where=mean_counts > 0)
+    info = ratio*np.log2(np.where(ratio > 0, ratio, 1))
+    return info.sum(axis=(2, 3))/(n_phase_bins*n_time_bins)
+
+
+def _skaggs_batch(times, cells, n_cell, dur_ms, time_bin_size,
+                  phase_bin_size=360, theta_bin_size=100):
+    """Skaggs information of each cell for a batch of flat spike buffers.
+
+    times is [n_batch, n_spikes], cells the cell index of each spike.
+    Returns [n_batch, n_cell].
+    """
+    times = np.atleast_2d(times)
+    return _skaggs(np.floor(times/time_bin_size).astype(int),
+                   times % time_bin_size / time_bin_size,
+                   theta_reference(theta_bin_size).assign(times)[1],
+                   cells, n_cell, int(dur_ms/time_bin_size),
+                   phase_bin_size=phase_bin_size)
+
+
 def skaggs_information(spike_times, dur_ms, time_bin_size,
                         phase_bin_size=360, theta_bin_size=100, agg=True):
+    """
+    Skaggs information of spike trains binned in time and theta phase.
 
-    n_cell = len(spike_times)
-    dur_s = int(dur_ms/1000)
-    time_bin_s = time_bin_size/1000
-    n_time_bins = int(dur_ms/time_bin_size)
-    theta_bin_size_s = theta_bin_size/1000
-    skaggs_all = np.zeros(n_cell)
-    if phase_bin_size == 360:
-        rates = np.zeros((n_cell, n_time_bins))
-        for cell in range(n_cell):
-            spikes = np.array(spike_times[cell])
-            phases = [[] for _ in range(n_time_bins)]
-            skaggs = np.zeros((n_time_bins))
-            times = np.arange(0, dur_ms+time_bin_size, time_bin_size)
-            for j, time in enumerate(times):
-                if j == times.shape[0]-1:
-                    break
-                count = np.logical_and(spikes > time, spikes < times[j+1]).sum()
-                rates[cell, j] = count/time_bin_s
-            mean_rate = np.mean(rates[cell, :])
-    
-            for j, time in enumerate(times):
-                if j == times.shape[0]-1:
-                    break
-                rate = rates[cell, j]
-                info = (rate/mean_rate)*(np.log2(rate/mean_rate))
-                if info == info: 
-                    skaggs[j] = info
-            skaggs_all[cell] = (1/(n_time_bins))*np.sum(skaggs)
-        skaggs_info = np.mean(skaggs_all)
-    else:
-        n_phase_bins = int(360/phase_bin_size)
-        rates = np.zeros((n_cell, n_phase_bins, n_time_bins))
-        for cell in range(n_cell):
-            spikes = np.array(spike_times[cell])
-            phases = [[] for _ in range(n_time_bins)]
-            skaggs = np.zeros((n_phase_bins, n_time_bins))
-            times = np.arange(0, dur_ms+time_bin_size, time_bin_size)
-            for j, time in enumerate(times):
-                if j == times.shape[0]-1:
-                    break
-                curr_train = spikes[np.logical_and(spikes > time,
-                                                  spikes < times[j+1])]
-                if curr_train.size > 0:
-                    phases[j] = list(curr_train % (theta_bin_size) / (theta_bin_size)*360)
-            for i in range(n_phase_bins):
-                for j, phases_in_time in enumerate(phases):
-                    phases_in_time = np.array(phases_in_time)
-                    count = ((phase_bin_size*(i) < phases_in_time) &
-                                    (phases_in_time < phase_bin_size*(i+1))).sum()
-                    rate = count*((1/theta_bin_size_s)*n_phase_bins)
-                    rates[cell, i, j] = rate
-            for j, phases_in_time in enumerate(phases):
-                mean_rate = np.mean(rates[cell, :, j])
-                for i in range(n_phase_bins):
-                    rate = rates[cell, i, j]
-                    info = (rate/mean_rate)*(np.log2(rate/mean_rate))
-                    if info == info: 
-                        skaggs[i, j] = info
-            skaggs_all[cell] = (1/(n_phase_bins*n_time_bins))*np.sum(skaggs)
-        # skaggs_info = np.sum(skaggs_all)
-        skaggs_info = np.mean(skaggs_all)
+    Parameters
+    ----------
+    spike_times : list
+        Spike times of each cell in ms.
+    dur_ms : int
+        Duration of the spike trains.
+    time_bin_size : int
+        Time bin size in ms.
+    phase_bin_size : int
+        Phase bin size in degrees, 360 for a pure rate code.
+        The default is 360.
+    theta_bin_size : int or ThetaReference
+        Theta period in ms or theta reference. The default is 100.
+    agg : bool
+        Return the population mean instead of each cell.
+        The default is True.
+
+    Returns
+    -------
+    Mean Skaggs information or Skaggs information of each cell.
+    """
+    spikes = spike_index(spike_times)
+    skaggs_all = _skaggs(spikes.cycle(time_bin_size)[None, :],
+                         spikes.cycle_fraction(time_bin_size)[None, :],
+                         spikes.cycle_fraction(theta_bin_size)[None, :],
+                         spikes.cells, len(spikes), int(dur_ms/time_bin_size),
+                         phase_bin_size=phase_bin_size)[0]
     if agg:
-        return skaggs_info
+        return np.mean(skaggs_all)
     else:
         return skaggs_all
 
+
+def skaggs_significance(spike_times, dur_ms, time_bin_size,
+                        phase_bin_size=360, theta_bin_size=100,
+                        method='shift', n_surrogates=1000, chunk_size=50,
+                        n_processes=1, seed=0):
+    """
+    Per-cell significance of Skaggs information against surrogates.
+
+    Parameters
+    ----------
+    spike_times : list
+        Spike times of each cell in ms.
+    dur_ms : int
+        Duration of the spike trains.
+    time_bin_size : int
+        Time bin size in ms.
+    phase_bin_size : int
+        Phase bin size in degrees. The default is 360.
+    theta_bin_size : int or ThetaReference
+        Theta period in ms or theta reference. The default is 100.
+    method : str
+        'shift' circularly shifts each spike train,
+        'phase' shuffles spike phases within theta cycles.
+        The default is 'shift'.
+    n_surrogates : int
+        Number of surrogates per cell. The default is 1000.
+    chunk_size : int
+        Number of surrogates evaluated at once. The default is 50.
+    n_processes : int
+        Number of worker processes. The default is 1.
+    seed : int
+        Surrogate seed. The default is 0.
+
+    Returns
+    -------
+    skaggs : numpy array
+        Skaggs information of each cell.
+    p_values : numpy array
+        Surrogate p-value of each cell.
+    z_scores : numpy array
+        Surrogate z-score of each cell.
+    """
+    spikes = spike_index(spike_times)
+    times, cells, n_cell = spikes.times, spikes.cells, len(spikes)
+    metric = partial(_skaggs_batch, cells=cells, n_cell=n_cell,
+                     dur_ms=dur_ms, time_bin_size=time_bin_size,
+                     phase_bin_size=phase_bin_size,
+                     theta_bin_size=theta_bin_size)
+    period = dur_ms if method == 'shift' else theta_bin_size
+    return surrogate_test(metric, times, cells, n_cell, method=method,
+                          period=period, n_surrogates=n_surrogates,
+                          chunk_size=chunk_size, n_processes=n_processes,
+                          seed=seed)
+
 # =============================================================================
 # aggraegate spikes from poisson seeds
 # =============================================================================
@@ -7,6 +7,7 @@ Created on Mon Sep  6 13:52:52 2021
 """
 
 
+from phase_to_rate.spike_index import SpikeTrains, spike_index
 import numpy as np
 import copy
 import shelve
@@ -15,32 +16,40 @@ import glob
 import pdb
 
 
-def _spike_counter(spike_times, bin_size_ms=100, dur_ms=2000):
-    n_bins = int(dur_ms / bin_size_ms)
-    n_cells = len(spike_times)
-    counts = np.zeros((n_cells, n_bins))
-    for i in range(n_bins):
-        for idx, value in enumerate(spike_times):
-            curr_ct = (
-                (bin_size_ms * (i) < value) & (value < bin_size_ms * (i + 1))
-            ).sum()
-            counts[idx, i] = curr_ct
-    return counts
-
-
-def _phase_definer(spike_times, nan_fill=False, bin_size_ms=100, dur_ms=2000):
+def _binned_spikes(spike_times, bin_size_ms, dur_ms):
+    """Time bin id of each spike within dur_ms, spikes on bin edges excluded."""
+    spikes = spike_index(spike_times)
     n_bins = int(dur_ms / bin_size_ms)
-    n_cells = len(spike_times)
-    phases = np.zeros((n_cells, n_bins))
-    for i in range(n_bins):
-        for idx, val in enumerate(spike_times):
-            curr_train = val[
-                ((bin_size_ms * (i) < val) & (val < bin_size_ms * (i + 1)))
-            ]
-            if curr_train.size != 0:
-                phases[idx, i] = np.mean(
-                    curr_train % (bin_size_ms) / (bin_size_ms) * 2 * np.pi
-                )
+    time_bin = spikes.cycle(bin_size_ms)
+    valid = ((~spikes.on_edge(bin_size_ms)) & (time_bin >= 0) &
+             (time_bin < n_bins))
+    flat_idx = spikes.cells[valid] * n_bins + time_bin[valid]
+    return spikes, valid, flat_idx, n_bins
+
+
+def _spike_counter(spike_times, bin_size_ms=100, dur_ms=2000):
+    spikes, _, flat_idx, n_bins = _binned_spikes(spike_times, bin_size_ms,
+                                                 dur_ms)
+    n_cells = len(spikes)
+    counts = np.bincount(flat_idx, minlength=n_cells * n_bins)
+    return counts.reshape(n_cells, n_bins).astype(float)
+
+
+def _phase_definer(spike_times, nan_fill=False, bin_size_ms=100, dur_ms=2000,
+                   theta=None):
+    spikes, valid, flat_idx, n_bins = _binned_spikes(spike_times,
+                                                     bin_size_ms, dur_ms)
+    n_cells = len(spikes)
+    if theta is None:
+        theta = bin_size_ms
+    spike_phases = spikes.phase(theta)[valid]
+    in_cycle = np.isfinite(spike_phases)
+    flat_idx = flat_idx[in_cycle]
+    counts = np.bincount(flat_idx, minlength=n_cells * n_bins)
+    phase_sums = np.bincount(flat_idx, weights=spike_phases[in_cycle],
+                             minlength=n_cells * n_bins)
+    phases = np.divide(phase_sums, counts, out=np.zeros(n_cells * n_bins),
+                       where=counts != 0).reshape(n_cells, n_bins)
     if nan_fill is True:
         mean_phases = np.mean(phases[phases != 0])
         phases[phases == 0] = mean_phases
@@ -80,7 +89,8 @@ def rate_n_phase(spike_times,
                  trajectories,
                  n_samples,
                  bin_size_ms=100,
-                 dur_ms=2000):
+                 dur_ms=2000,
+                 theta=None):
     """
 
     Generate spike counts and phases as well as different coding schemes.
@@ -97,6 +107,9 @@ def rate_n_phase(spike_times,
         Time bin size in milliseconds. The default is 100.
     dur_ms : int, optional
         Duration of the simulation. The default is 2000.
+    theta : float or ThetaReference, optional
+        Theta period in ms or reference the phases refer to.
+        The default is None, the time bin size.
 
     Returns
     -------
@@ -129,12 +142,13 @@ def rate_n_phase(spike_times,
     for traj_idx, traj in enumerate(trajectories):
         spike_times_traj = spike_times[traj]
         for sample_idx in range(n_samples):
-            spike_times_sample = spike_times_traj[sample_idx]
+            spike_times_sample = spike_index(spike_times_traj[sample_idx])
             single_count = _spike_counter(
                 spike_times_sample, bin_size_ms=bin_size_ms, dur_ms=dur_ms
             )
             single_phase = _phase_definer(
-                spike_times_sample, bin_size_ms=bin_size_ms, dur_ms=dur_ms
+                spike_times_sample, bin_size_ms=bin_size_ms, dur_ms=dur_ms,
+                theta=theta
             )
             counts[:, :, sample_idx, traj_idx] = single_count
             phases[:, :, sample_idx, traj_idx] = single_phase
@@ -172,6 +186,7 @@ def load_spikes(path, cell_type, trajectories, n_samples):
     -------
     spikes : dict
         returns loaded spikes from different trajectories.
+        Each sample is a SpikeTrains list of per cell spike times.
 
     """
     if not os.path.exists(path+'.dir'):
@@ -198,7 +213,7 @@ def load_spikes(path, cell_type, trajectories, n_samples):
         else:
             raise Exception("Cell type does not exist!")
         for poisson in poisson_seeds:
-            requested_spikes.append(all_spikes[poisson])
+            requested_spikes.append(SpikeTrains(all_spikes[poisson]))
         spikes[traj] = requested_spikes
     storage.close()
     return spikes
@@ -227,6 +242,7 @@ def load_spikes_DMK(path, cell_type, trajectories, n_samples):
     -------
     spikes : dict
         returns loaded spikes from different trajectories.
+        Each sample is a SpikeTrains list of per cell spike times.
 
     """
     if not os.path.exists(path+'.dir'):
@@ -255,7 +271,7 @@ def load_spikes_DMK(path, cell_type, trajectories, n_samples):
             all_spikes = storage["lec_spikes"][traj_key]
 
         for poisson in poisson_seeds:
-            requested_spikes.append(all_spikes[poisson])
+            requested_spikes.append(SpikeTrains(all_spikes[poisson]))
         spikes[traj] = requested_spikes
     storage.close()
     return spikes
@@ -284,6 +300,7 @@ def load_spikes_DMK_plus_lec(path, cell_type, trajectories, n_samples):
     -------
     spikes : dict
         returns loaded spikes from different trajectories.
+        Each sample is a SpikeTrains list of per cell spike times.
 
     """
     if not os.path.exists(path+'.dir'):
@@ -315,7 +332,7 @@ def load_spikes_DMK_plus_lec(path, cell_type, trajectories, n_samples):
             all_spikes = storage["lec_spikes"][traj_key]
 
         for poisson in poisson_seeds:
-            requested_spikes.append(all_spikes[poisson])
+            requested_spikes.append(SpikeTrains(all_spikes[poisson]))
         spikes[traj] = requested_spikes
     storage.close()
     return spikes
@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Parallel simulation of granule cell spikes on a process pool.
+
+A work unit is one trial, (grid_seed, trajectory, poisson_seed, shuffling,
+network_type). Units are grouped into tasks that share grid seed, trajectory
+and tuning. Every worker is a fresh process with its own NEURON instance
+and mechanisms loaded once. It keeps the DentateSession of its last task, so
+consecutive tasks of one network reuse it. With a ResultCache, finished
+trials are stored as they complete and skipped when the sweep is rerun.
+If parameters has a 'batch_gap_ms', the trials of a task are simulated in
+one run separated by silent gaps of that length.
+"""
+
+from collections import namedtuple
+from phase_to_rate import grid_model
+import multiprocessing
+import os
+
+
+SimulationUnit = namedtuple(
+    'SimulationUnit',
+    ['grid_seed', 'trajectory', 'poisson_seed', 'shuffling', 'network_type'])
+
+_PARAMETER_KEYS = ('dur_ms', 'pp_weight', 'speed', 'n_grid', 'rate_scale')
+
+
+def default_processes(memory_gb_per_process=2.0):
+    """
+    Number of worker processes that fit into the cores and free memory.
+
+    Parameters
+    ----------
+    memory_gb_per_process : float
+        Memory needed by one worker. The default is 2.0.
+
+    Returns
+    -------
+    int
+        At least one process, at most the number of cores.
+    """
+    n_cores = os.cpu_count() or 1
+    try:
+        free_bytes = (os.sysconf('SC_AVPHYS_PAGES') *
+                      os.sysconf('SC_PAGE_SIZE'))
+    except (ValueError, OSError, AttributeError):
+        return n_cores
+    n_memory = int(free_bytes / (memory_gb_per_process * 1024 ** 3))
+    return max(1, min(n_cores, n_memory))
+
+
+def unit_inputs(unit, parameters):
+    """Everything the result of a unit depends on, the key of its cache."""
+    inputs = dict(unit._asdict(), simulator='granule_simulate')
+    for key in _PARAMETER_KEYS:
+        inputs[key] = parameters[key]
+    # Batched trials are close to, not identical with isolated ones
+    if parameters.get('batch_gap_ms') is not None:
+        inputs['batch_gap_ms'] = parameters['batch_gap_ms']
+    return inputs
+
+
+def _tasks(units, chunk_size):
+    """Group units that share a network and trajectory into chunks."""
+    groups = {}
+    for unit in units:
+        key = (unit.grid_seed, unit.trajectory, unit.shuffling,
+               unit.network_type)
+        groups.setdefault(key, []).append(unit)
+    return [group[idx:idx + chunk_size] for group in groups.values()
+            for idx in range(0, len(group), chunk_size)]
+
+
+_worker = {}
+
+
+def _init_worker(parameters, nthread):
+    # Imported here so that only the workers load NEURON
+    from pydentate import neuron_tools
+    if not _worker.get('mechanisms_loaded'):
+        neuron_tools.load_compiled_mechanisms()
+    _worker.update(parameters=parameters, nthread=nthread,
+                   mechanisms_loaded=True, session=None, session_key=None)
+
+
+def _session(grid_seed, network_type):
+    from phase_to_rate.pydentate_integrate import DentateSession
+    key = (grid_seed, network_type)
+    if _worker['session_key'] != key:
+        # Free the old network first, NEURON would simulate both
+        _worker['session'] = None
+        _worker['session'] = DentateSession(
+            grid_seed=grid_seed,
+            network_type=network_type,
+            pp_weight=_worker['parameters']['pp_weight'],
+            nthread=_worker['nthread'],
+        )
+        _worker['session_key'] = key
+    return _worker['session']
+
+
+def _run_task(units):
+    parameters = _worker['parameters']
+    first = units[0]
+    grid_spikes, _ = grid_model.grid_simulate(
+        trajs=[first.trajectory],
+        dur_ms=parameters['dur_ms'],
+        grid_seed=first.grid_seed,
+        poiss_seeds=[unit.poisson_seed for unit in units],
+        shuffle=first.shuffling,
+        n_grid=parameters['n_grid'],
+        speed_cm=parameters['speed'],
+        rate_scale=parameters['rate_scale'],
+    )
+    grid_spikes = grid_spikes[first.trajectory]
+    session = _session(first.grid_seed, first.network_type)
+    trials = [grid_spikes[unit.poisson_seed] for unit in units]
+    if parameters.get('batch_gap_ms') is None:
+        granule_spikes = [session.simulate(trial, dur_ms=parameters['dur_ms'])
+                          for trial in trials]
+    else:
+        granule_spikes = session.simulate_batch(
+            trials, dur_ms=parameters['dur_ms'],
+            gap_ms=parameters['batch_gap_ms'])
+    return list(zip(units, trials, granule_spikes))
+
+
+def simulate_units(units, parameters, n_processes=None, chunk_size=10,
+                   on_result=None, cache=None, nthread=1):
+    """
+    Simulate grid and granule cell spikes of many trials in parallel.
+
+    Parameters
+    ----------
+    units : list
+        SimulationUnit or tuples (grid_seed, trajectory, poisson_seed,
+        shuffling, network_type).
+    parameters : dict
+        Simulation parameters as in 01_simulate.py, needs 'dur_ms',
+        'pp_weight', 'speed', 'n_grid' and 'rate_scale'. An optional
+        'batch_gap_ms' batches the trials of each task.
+    n_processes : int
+        Number of worker processes. The default is None, as many as
+        default_processes allows.
+    chunk_size : int
+        Maximum number of trials of one network per task and of one
+        batch. Larger chunks build fewer networks, smaller ones balance
+        the load better. The default is 10.
+    on_result : callable
+        Called in the main process as on_result(unit, grid_spikes,
+        granule_spikes) as soon as a trial completes, in order of
+        completion. The default is None.
+    cache : ResultCache
+        Cache of (grid_spikes, granule_spikes) keyed by unit_inputs. Cached
+        units are not simulated again, new ones are saved by the main
+        process as they complete. The default is None.
+    nthread : int
+        NEURON threads per worker, for hosts where memory limits the
+        number of processes. The default is 1.
+
+    Returns
+    -------
+    dict
+        (grid_spikes, granule_spikes) of each SimulationUnit, in the order
+        of units.
+    """
+    units = [SimulationUnit(*unit) for unit in units]
+
+    results = {}
+    missing = []
+    for unit in dict.fromkeys(units):
+        if cache is not None:
+            try:
+                results[unit] = cache.load(unit_inputs(unit, parameters))
+            except KeyError:
+                missing.append(unit)
+                continue
+            if on_result is not None:
+                on_result(unit, *results[unit])
+        else:
+            missing.append(unit)
+
+    tasks = _tasks(missing, chunk_size)
+    if n_processes is None:
+        n_processes = default_processes()
+    n_processes = max(1, min(n_processes, len(tasks)))
+
+    if tasks:
+        # spawn instead of fork so that every worker has a clean NEURON
+        context = multiprocessing.get_context('spawn')
+        with context.Pool(n_processes, initializer=_init_worker,
+                          initargs=(parameters, nthread)) as pool:
+            for task_results in pool.imap_unordered(_run_task, tasks):
+                for unit, grid_spikes, granule_spikes in task_results:
+                    results[unit] = (grid_spikes, granule_spikes)
+                    if cache is not None:
+                        cache.save(unit_inputs(unit, parameters),
+                                   results[unit])
+                    if on_result is not None:
+                        on_result(unit, grid_spikes, granule_spikes)
+    return {unit: results[unit] for unit in units}
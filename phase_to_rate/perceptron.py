@@ -10,6 +10,7 @@ import torch
 import torch.nn as nn
 from torch import optim
 import numpy as np
+import scipy.sparse
 
 
 # labels maker
@@ -38,12 +39,80 @@ class _Net(nn.Module):
         return y
 
 
+class _SparseLinear(torch.autograd.Function):
+    """x @ weight + bias for a CSR x, with its transpose for backward."""
+
+    @staticmethod
+    def forward(ctx, x, x_t, weight, bias):
+        ctx.x_t = x_t
+        return x @ weight + bias
+
+    @staticmethod
+    def backward(ctx, grad):
+        return None, None, ctx.x_t @ grad, grad.sum(0)
+
+
+class _SparseNet(nn.Module):
+    """A _Net restricted to the features that are nonzero in any sample."""
+
+    def __init__(self, net, features):
+        super(_SparseNet, self).__init__()
+        # The weights of all other features get no gradient and never
+        # contribute to the output
+        weight = net.fc1.weight.detach()[:, features].t().contiguous()
+        self.weight = nn.Parameter(weight)
+        self.bias = nn.Parameter(net.fc1.bias.detach().clone())
+
+    def forward(self, x):
+        y = torch.sigmoid(_SparseLinear.apply(*x, self.weight, self.bias))
+        return y
+
+
+def _sparse_code(neural_code):
+    """Sparse code as a scipy CSR matrix [n_sample, n_features], or None."""
+    if scipy.sparse.issparse(neural_code):
+        return scipy.sparse.csr_matrix(neural_code.T, dtype=np.float32)
+    if isinstance(neural_code, torch.Tensor) and neural_code.layout in (
+            torch.sparse_coo, torch.sparse_csr):
+        coo = neural_code.to_sparse_coo().coalesce()
+        row, col = coo.indices().numpy()
+        return scipy.sparse.csr_matrix(
+            (coo.values().numpy(), (col, row)), shape=coo.shape[::-1],
+            dtype=np.float32)
+    return None
+
+
+def _csr_tensor(matrix):
+    return torch.sparse_csr_tensor(
+        torch.from_numpy(matrix.indptr.astype(np.int64)),
+        torch.from_numpy(matrix.indices.astype(np.int64)),
+        torch.from_numpy(matrix.data), matrix.shape)
+
+
 # TRAIN THE NETWORK
 
 
-def _train_net(net, train_data, labels, n_iter=1000, lr=1e-4):
-    optimizer = optim.SGD(net.parameters(), lr=lr)
-    track_loss = []
+# Epochs between checks of the early stopping condition, each check
+# synchronizes with the device
+_STOP_CHECK = 10
+
+
+# Optimizers of the perceptrons
+_OPTIMIZERS = {'SGD': optim.SGD, 'Adam': optim.Adam}
+
+
+def _check_optimizer(optimizer):
+    if optimizer not in _OPTIMIZERS:
+        raise ValueError(f"Unknown optimizer {optimizer!r}, expected one "
+                         f"of {sorted(_OPTIMIZERS)}")
+
+
+def _train_net(net, train_data, labels, n_iter=1000, lr=1e-4,
+               threshold=0.2, patience=None, optimizer='SGD'):
+    _check_optimizer(optimizer)
+    optimizer = _OPTIMIZERS[optimizer](net.parameters(), lr=lr)
+    track_loss = torch.empty(n_iter)
+    n_below = torch.zeros((), dtype=torch.long)
     loss_fn = nn.MSELoss()
     # loss_fn = nn.L1Loss()
     for i in range(n_iter):
@@ -57,26 +126,34 @@ def _train_net(net, train_data, labels, n_iter=1000, lr=1e-4):
         # Update weights
         optimizer.step()
 
-        # Store current value of loss
-        # .item() needed to transform the tensor output of loss_fn to a scalar
-        track_loss.append(loss.item())
+        # Store current value of loss without a scalar extraction
+        track_loss[i] = loss.detach()
         # Track progress
         if (i + 1) % (n_iter // 5) == 0:
             print(f"iteration {i + 1}/{n_iter} | loss: {loss.item():.3f}")
+        # Stop once the loss stayed below threshold for patience epochs
+        if patience is not None:
+            n_below = (n_below + 1) * (loss.detach() < threshold)
+            if (i + 1) % _STOP_CHECK == 0 and n_below.item() >= patience:
+                break
 
-    return track_loss, out
+    return track_loss[:i + 1].tolist(), out
 
 
 def run_perceptron(neural_code, grid_seed, learning_rate=1e-4,
-                   n_iter=10000, threshold=0.2):
+                   n_iter=10000, threshold=0.2, patience=None, loss_every=1,
+                   optimizer='SGD'):
     """
 
     Generate and run the perceptron network.
 
     Parameters
     ----------
-    neural_code : numpy array
-        Neural code generated from a cell population.
+    neural_code : numpy array, scipy.sparse matrix or torch sparse tensor
+        Neural code generated from a cell population. [n_features,
+        n_samples] Sparse codes train only the weights of features that
+        are nonzero in a sample, with sparse-dense products, so an epoch
+        takes time in proportion to the active cell-bins.
     grid_seed : TYPE
         Grid cell population generation seed,
         modified and used to seed perceptron network as well.
@@ -87,22 +164,379 @@ def run_perceptron(neural_code, grid_seed, learning_rate=1e-4,
     threshold : float
         Threshold considered sufficient for learning,
         which the loss function reaches. The default is 0.2.
+    patience : int
+        Stop training once the loss stayed below threshold for patience
+        epochs, checked every 10 epochs. The threshold crossing point is
+        the same as with all n_iter epochs. The default is None, no early
+        stopping.
+    loss_every : int
+        Keep the loss of every loss_every-th epoch. The default is 1.
+    optimizer : str
+        'SGD' or 'Adam' with the torch defaults. The default is 'SGD'.
 
     Returns
     -------
     Threshold crossing points and loss value in each epoch.
     """
-    neural_code = np.transpose(neural_code, (1, 0))
-    n_sample, inp_len = neural_code.shape
+    sparse_code = _sparse_code(neural_code)
+    if sparse_code is None:
+        # Convert into tensor
+        neural_code = torch.FloatTensor(np.transpose(neural_code, (1, 0)))
+        n_sample, inp_len = neural_code.shape
+    else:
+        n_sample, inp_len = sparse_code.shape
     n_poiss = int(n_sample / 2)
     perc_seed = grid_seed + 100
     labels, out_len = _label(n_poiss)
-    # Convert into tensor
-    neural_code = torch.FloatTensor(neural_code)
     torch.manual_seed(perc_seed)
     net_neural = _Net(inp_len, out_len)
+    if sparse_code is not None:
+        features = np.unique(sparse_code.indices)
+        net_neural = _SparseNet(net_neural, features)
+        sparse_code = sparse_code[:, features]
+        neural_code = (_csr_tensor(sparse_code),
+                       _csr_tensor(sparse_code.T.tocsr()))
     train_loss, _ = _train_net(net_neural, neural_code,
-                               labels, n_iter=n_iter, lr=learning_rate)
+                               labels, n_iter=n_iter, lr=learning_rate,
+                               threshold=threshold, patience=patience,
+                               optimizer=optimizer)
     # threshold crossing points
     th_cross = np.argmax(np.array(train_loss) < threshold)
-    return th_cross, train_loss
+    return th_cross, train_loss[::loss_every]
+
+
+# BATCHED TRAINING OF INDEPENDENT NETWORKS
+
+
+def _init_params(perc_seeds, inp_len, out_len):
+    """Initial weights of one _Net per seed, stacked for torch.bmm."""
+    weights, biases = [], []
+    for perc_seed in perc_seeds:
+        torch.manual_seed(perc_seed)
+        net = _Net(inp_len, out_len)
+        weights.append(net.fc1.weight.detach().t())
+        biases.append(net.fc1.bias.detach()[None, :])
+    weight = torch.stack(weights).contiguous().requires_grad_()
+    bias = torch.stack(biases).contiguous().requires_grad_()
+    return weight, bias
+
+
+# Defaults of torch.optim.Adam
+_ADAM_BETAS = (0.9, 0.999)
+_ADAM_EPS = 1e-8
+
+
+def _train_batch(train_data, labels, weight, bias, lr, n_iter, threshold,
+                 patience=None, optimizer='SGD'):
+    """
+    SGD or Adam on many single layer networks, the tasks do not interact.
+
+    Adam keeps moments per parameter, so each task has its own and takes
+    the steps of torch.optim.Adam on its network alone.
+    """
+    _check_optimizer(optimizer)
+    params = [weight, bias]
+    if optimizer == 'Adam':
+        moments = [[torch.zeros_like(param), torch.zeros_like(param)]
+                   for param in params]
+        beta1, beta2 = _ADAM_BETAS
+    n_tasks = train_data.shape[0]
+    track_loss = torch.full((n_tasks, n_iter), float('nan'))
+    th_cross = torch.full((n_tasks,), -1, dtype=torch.long)
+    n_below = torch.zeros(n_tasks, dtype=torch.long)
+    active = torch.arange(n_tasks)
+    lr = lr[:, None, None]
+    for i in range(n_iter):
+        out = torch.sigmoid(torch.baddbmm(bias, train_data, weight))
+        # Same loss as _train_net for every task, summed so that each
+        # task gets its own gradient
+        loss = torch.sqrt(((out - labels) ** 2).mean(dim=(1, 2)))
+        weight.grad, bias.grad = None, None
+        loss.sum().backward()
+        with torch.no_grad():
+            if optimizer == 'SGD':
+                weight -= lr * weight.grad
+                bias -= lr * bias.grad
+            else:
+                # All tasks of the batch took i + 1 steps
+                correction1 = 1 - beta1 ** (i + 1)
+                correction2 = (1 - beta2 ** (i + 1)) ** 0.5
+                for param, (mean, var) in zip(params, moments):
+                    mean.mul_(beta1).add_(param.grad, alpha=1 - beta1)
+                    var.mul_(beta2).addcmul_(param.grad, param.grad,
+                                             value=1 - beta2)
+                    denom = var.sqrt() / correction2 + _ADAM_EPS
+                    param -= lr / correction1 * mean / denom
+            track_loss[active, i] = loss
+            # Epoch of the first threshold crossing, without a sync
+            below = loss < threshold
+            crossed = below & (th_cross[active] < 0)
+            th_cross[active[crossed]] = i
+            if patience is not None:
+                n_below[active] = (n_below[active] + 1) * below
+        if (i + 1) % (n_iter // 5) == 0:
+            print(f"iteration {i + 1}/{n_iter} | "
+                  f"mean loss: {loss.mean().item():.3f}")
+        if patience is not None and (i + 1) % _STOP_CHECK == 0:
+            # Drop the tasks that are done from the batch
+            keep = n_below[active] < patience
+            if not keep.any():
+                break
+            if not keep.all():
+                active = active[keep]
+                train_data = train_data[keep]
+                lr = lr[keep]
+                weight = weight.detach()[keep].requires_grad_()
+                bias = bias.detach()[keep].requires_grad_()
+                params = [weight, bias]
+                if optimizer == 'Adam':
+                    moments = [[moment[keep] for moment in pair]
+                               for pair in moments]
+    # argmax of a loss that never crossed is 0, as in run_perceptron
+    th_cross[th_cross < 0] = 0
+    return th_cross, track_loss
+
+
+def run_perceptron_batch(neural_codes, grid_seeds, learning_rates=1e-4,
+                         n_iter=10000, threshold=0.2, max_tasks=None,
+                         patience=None, loss_every=1, optimizer='SGD'):
+    """
+
+    Train one perceptron per task simultaneously.
+
+    Every task is the run_perceptron problem of its neural code and grid
+    seed. The networks are initialized with the same seeds and trained as
+    one batched model, so each task gives the results of run_perceptron.
+
+    Parameters
+    ----------
+    neural_codes : numpy array
+        Neural code of each task, all of the same shape.
+        [n_tasks, n_features, n_samples]
+    grid_seeds : int or list
+        Grid seed of each task, the perceptron of a task is seeded with
+        its grid seed + 100 as in run_perceptron.
+    learning_rates : float or list
+        Learning rate of each task. The default is 1e-4.
+    n_iter : int
+        Number of epochs for perceptron learning. The default is 10000.
+    threshold : float
+        Threshold considered sufficient for learning,
+        which the loss function reaches. The default is 0.2.
+    max_tasks : int
+        Largest number of tasks trained at once, limits the memory.
+        The default is None, all tasks.
+    patience : int
+        Remove a task from the batch once its loss stayed below threshold
+        for patience epochs, checked every 10 epochs, and stop when all
+        tasks are done. The threshold crossing points are the same as
+        with all n_iter epochs. The default is None, no early stopping.
+    loss_every : int
+        Keep the loss of every loss_every-th epoch. The default is 1.
+    optimizer : str
+        'SGD' or 'Adam' with the torch defaults, each task has its own
+        Adam moments as in run_perceptron. The default is 'SGD'.
+
+    Returns
+    -------
+    th_cross : numpy array
+        Threshold crossing point of each task. [n_tasks]
+    train_loss : numpy array
+        Loss value of each task in each kept epoch, NaN after a task
+        stopped. [n_tasks, ceil(n_iter / loss_every)]
+    """
+    neural_codes = np.asarray(neural_codes)
+    n_tasks, inp_len, n_sample = neural_codes.shape
+    perc_seeds = np.broadcast_to(grid_seeds, n_tasks) + 100
+    learning_rates = np.broadcast_to(learning_rates, n_tasks)
+    labels, out_len = _label(int(n_sample / 2))
+    if max_tasks is None:
+        max_tasks = n_tasks
+
+    th_cross, train_loss = [], []
+    for start in range(0, n_tasks, max_tasks):
+        stop = min(start + max_tasks, n_tasks)
+        train_data = torch.FloatTensor(
+            np.transpose(neural_codes[start:stop], (0, 2, 1)).copy())
+        weight, bias = _init_params(perc_seeds[start:stop].tolist(),
+                                    inp_len, out_len)
+        lr = torch.tensor(learning_rates[start:stop], dtype=torch.float32)
+        chunk_cross, chunk_loss = _train_batch(
+            train_data, labels, weight, bias, lr, n_iter, threshold,
+            patience=patience, optimizer=optimizer)
+        th_cross.append(chunk_cross.numpy())
+        train_loss.append(chunk_loss[:, ::loss_every].numpy())
+    return np.concatenate(th_cross), np.concatenate(train_loss)
+
+
+# CROSS-VALIDATION WITH ALL FOLDS TRAINED AT ONCE
+
+
+def run_perceptron_cv(neural_code, grid_seed, learning_rate=1e-4,
+                      n_iter=10000, n_folds=None):
+    """
+
+    Cross-validate the perceptron with all folds trained simultaneously.
+
+    Every fold is a network initialized like run_perceptron. All folds
+    share one input matrix and are trained as one model, the loss of
+    each fold is masked to its training samples.
+
+    Parameters
+    ----------
+    neural_code : numpy array
+        Neural code generated from a cell population, the first half of
+        the samples is one trajectory, the second half the other.
+        [n_features, n_samples]
+    grid_seed : int
+        Grid cell population generation seed,
+        modified and used to seed perceptron network as well.
+    learning_rate : float
+        Learning rate in the perceptron network. The default is 1e-4.
+    n_iter : int
+        Number of epochs for perceptron learning. The default is 10000.
+    n_folds : int
+        Number of folds, sample i of each trajectory is held out in fold
+        i % n_folds. The default is None, leave one out.
+
+    Returns
+    -------
+    test_accuracy : numpy array
+        Fraction of correctly classified held out samples of each fold
+        in each epoch. [n_folds, n_iter]
+    test_loss : numpy array
+        Loss of the held out samples. [n_folds, n_iter]
+    train_loss : numpy array
+        Loss of the training samples. [n_folds, n_iter]
+    """
+    neural_code = np.transpose(neural_code, (1, 0))
+    n_sample, inp_len = neural_code.shape
+    n_poiss = int(n_sample / 2)
+    labels, out_len = _label(n_poiss)
+    if n_folds is None:
+        folds = np.arange(n_sample)
+        n_folds = n_sample
+    else:
+        folds = (np.arange(n_sample) % n_poiss) % n_folds
+    test_mask = torch.FloatTensor(folds[None, :] ==
+                                  np.arange(n_folds)[:, None])[..., None]
+    train_mask = 1 - test_mask
+    n_train = train_mask.sum(dim=(1, 2)) * out_len
+    n_test = test_mask.sum(dim=(1, 2)) * out_len
+    target = labels.argmax(dim=1)
+
+    train_data = torch.FloatTensor(neural_code)
+    weight, bias = _init_params([grid_seed + 100] * n_folds, inp_len,
+                                out_len)
+    # [inp_len, n_folds, out_len], one matrix product for all folds
+    weight = weight.detach().permute(1, 0, 2).contiguous().requires_grad_()
+
+    train_loss = torch.empty((n_folds, n_iter))
+    test_loss = torch.empty((n_folds, n_iter))
+    test_accuracy = torch.empty((n_folds, n_iter))
+    for i in range(n_iter):
+        out = (train_data @ weight.reshape(inp_len, -1)).reshape(
+            n_sample, n_folds, out_len).transpose(0, 1)
+        out = torch.sigmoid(out + bias)
+        squared_error = (out - labels) ** 2
+        loss = torch.sqrt((squared_error * train_mask).sum(dim=(1, 2)) /
+                          n_train)
+        weight.grad, bias.grad = None, None
+        loss.sum().backward()
+        with torch.no_grad():
+            weight -= learning_rate * weight.grad
+            bias -= learning_rate * bias.grad
+            train_loss[:, i] = loss
+            test_loss[:, i] = torch.sqrt(
+                (squared_error * test_mask).sum(dim=(1, 2)) / n_test)
+            correct = (out.argmax(dim=2) == target).float()
+            test_accuracy[:, i] = ((correct * test_mask[..., 0]).sum(dim=1) /
+                                   test_mask[..., 0].sum(dim=1))
+        if (i + 1) % (n_iter // 5) == 0:
+            print(f"iteration {i + 1}/{n_iter} | "
+                  f"mean held out accuracy: {test_accuracy[:, i].mean():.3f}")
+    return test_accuracy.numpy(), test_loss.numpy(), train_loss.numpy()
+
+
+# MULTI-CLASS DECODER OVER ALL TRAJECTORIES
+
+
+def run_decoder(neural_code, grid_seed, learning_rate=1e-4, n_iter=10000,
+                threshold=0.2):
+    """
+
+    Train one softmax layer to decode the trajectory of every sample.
+
+    Replaces the pairwise perceptrons with one network over all
+    trajectories. The learning speed of a pair (a, b) is read from the
+    softmax outputs restricted to the two trajectories,
+    sigmoid(z_a - z_b), with the loss of run_perceptron on the samples of
+    both: sqrt(mean((1 - p_correct) ** 2)).
+
+    Parameters
+    ----------
+    neural_code : numpy array
+        Neural code of each sample and trajectory, as returned by
+        rate_n_phase. [n_features, n_samples, n_traj]
+    grid_seed : int
+        Grid cell population generation seed,
+        modified and used to seed the decoder as well.
+    learning_rate : float
+        Learning rate of the decoder. The default is 1e-4.
+    n_iter : int
+        Number of epochs. The default is 10000.
+    threshold : float
+        Pair loss considered sufficient for learning. The default is 0.2.
+
+    Returns
+    -------
+    th_cross : numpy array
+        First epoch the loss of each pair is below threshold, 0 if it
+        never is and on the diagonal. [n_traj, n_traj]
+    pair_loss : numpy array
+        Loss of each pair in each epoch, NaN on the diagonal.
+        [n_iter, n_traj, n_traj]
+    confusion : numpy array
+        Fraction of the samples of trajectory a (rows) decoded as
+        trajectory b (columns) in each epoch. [n_iter, n_traj, n_traj]
+    train_loss : numpy array
+        Cross entropy in each epoch. [n_iter]
+    """
+    n_features, n_samples, n_traj = neural_code.shape
+    # samples of the first trajectory, then of the second, ...
+    train_data = torch.FloatTensor(
+        np.transpose(neural_code, (2, 1, 0)).reshape(-1, n_features))
+    target = torch.arange(n_traj).repeat_interleave(n_samples)
+    torch.manual_seed(grid_seed + 100)
+    net = nn.Linear(n_features, n_traj)
+    optimizer = optim.SGD(net.parameters(), lr=learning_rate)
+    loss_fn = nn.CrossEntropyLoss()
+
+    train_loss = torch.empty(n_iter)
+    pair_loss = torch.empty((n_iter, n_traj, n_traj))
+    confusion = torch.empty((n_iter, n_traj, n_traj))
+    for i in range(n_iter):
+        out = net(train_data)
+        loss = loss_fn(out, target)
+        optimizer.zero_grad()
+        loss.backward()
+        optimizer.step()
+        with torch.no_grad():
+            train_loss[i] = loss
+            # Error of every sample against every other trajectory
+            logit = out.gather(1, target[:, None])
+            error = (1 - torch.sigmoid(logit - out)) ** 2
+            error = error.reshape(n_traj, n_samples, n_traj).sum(dim=1)
+            pair_loss[i] = torch.sqrt((error + error.t()) / (2 * n_samples))
+            predicted = nn.functional.one_hot(out.argmax(dim=1), n_traj)
+            confusion[i] = predicted.reshape(
+                n_traj, n_samples, n_traj).float().mean(dim=1)
+        if (i + 1) % (n_iter // 5) == 0:
+            print(f"iteration {i + 1}/{n_iter} | loss: {loss.item():.3f}")
+
+    pair_loss = pair_loss.numpy()
+    diagonal = np.arange(n_traj)
+    pair_loss[:, diagonal, diagonal] = np.nan
+    th_cross = np.argmax(pair_loss < threshold, axis=0)
+    th_cross[np.diag_indices(n_traj)] = 0
+    return th_cross, pair_loss, confusion.numpy(), train_loss.numpy()
@@ -0,0 +1,376 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Positional information analysis according to Tingley & Buzsaki, 2018.
+
+Vectorized implementation of the analysis in supplemental/pos_information.py.
+Spikes of all cells and Poisson seeds are binned in one pass, boxcar
+smoothing for any number of widths is computed from a single set of prefix
+sums and the discretized probabilities are counted with np.bincount over
+(cell, position, value).
+"""
+
+from phase_to_rate.spike_index import spike_index
+from phase_to_rate.surrogates import surrogate_test
+from functools import partial
+import numpy as np
+
+
+def _flatten_spikes(spike_times):
+    """Flatten list(Poisson seed) of lists(cell) into flat spike arrays."""
+    n_samples = len(spike_times)
+    n_cell = len(spike_times[0])
+    samples = [spike_index(sample) for sample in spike_times]
+    times = np.concatenate([np.empty(0)] + [x.times for x in samples])
+    cells = np.concatenate([np.empty(0, dtype=int)] +
+                           [x.cells for x in samples])
+    sample_ids = np.repeat(np.arange(n_samples),
+                           [x.times.size for x in samples])
+    return times, cells, sample_ids, n_cell, n_samples
+
+
+def phase_n_rate(spike_times, bin_size_ms=100, dur_ms=2000):
+    """
+    Bin spike counts and circular mean phases of all cells and samples.
+
+    Parameters
+    ----------
+    spike_times : list
+        List (Poisson seed) of lists (cell) of spike times in ms.
+    bin_size_ms : int
+        Time bin size in milliseconds, also the theta period.
+        The default is 100.
+    dur_ms : int
+        Duration of the simulation. The default is 2000.
+
+    Returns
+    -------
+    counts : numpy array
+        Spike count in each time bin. [n_cell, n_bins, n_samples]
+    phases : numpy array
+        Circular mean spike phase in each time bin, 0 where a cell is
+        silent. [n_cell, n_bins, n_samples]
+    """
+    times, cells, samples, n_cell, n_samples = _flatten_spikes(spike_times)
+    counts, phases = _bin_spikes(times, cells, samples, n_cell, n_samples,
+                                 bin_size_ms, dur_ms)
+    return counts[0], phases[0]
+
+
+def _bin_spikes(times, cells, samples, n_cell, n_samples, bin_size_ms,
+                dur_ms):
+    """Counts and phases [n_batch, n_cell, n_bins, n_samples] of a batch of
+    flat spike buffers with times [n_batch, n_spikes]."""
+    times = np.atleast_2d(times)
+    n_batch = times.shape[0]
+    n_bins = int(dur_ms / bin_size_ms)
+    # spikes exactly on a bin edge are excluded as in the loop version
+    time_bin = np.floor(times / bin_size_ms).astype(int)
+    valid = ((times % bin_size_ms != 0) & (time_bin >= 0) &
+             (time_bin < n_bins))
+    batch = np.broadcast_to(np.arange(n_batch)[:, None], times.shape)
+    flat_idx = (((batch * n_cell + cells) * n_bins + time_bin) * n_samples +
+                samples)[valid]
+    times = times[valid]
+
+    size = n_batch * n_cell * n_bins * n_samples
+    counts = np.bincount(flat_idx, minlength=size).astype(float)
+    spike_phases = times % bin_size_ms / bin_size_ms * 2 * np.pi
+    sin_sum = np.bincount(flat_idx, weights=np.sin(spike_phases),
+                          minlength=size)
+    cos_sum = np.bincount(flat_idx, weights=np.cos(spike_phases),
+                          minlength=size)
+    phases = np.arctan2(sin_sum, cos_sum) % (2 * np.pi)
+    phases[counts == 0] = 0
+
+    shape = (n_batch, n_cell, n_bins, n_samples)
+    return counts.reshape(shape), phases.reshape(shape)
+
+
+def filter_cells(counts, phases, threshold=8):
+    """
+    Delete cells that fire less than threshold spikes in total.
+
+    Parameters
+    ----------
+    counts : numpy array
+        Spike counts. [n_cell, n_bins, n_samples]
+    phases : numpy array
+        Spike phases. [n_cell, n_bins, n_samples]
+    threshold : int
+        Minimum number of spikes over all bins and samples.
+        The default is 8.
+
+    Returns
+    -------
+    counts, phases : numpy array
+        Input arrays without the insufficiently active cells.
+    """
+    active = counts.sum(axis=(1, 2)) >= threshold
+    return counts[active], phases[active]
+
+
+def smooth_cells(counts, phases, smoothings):
+    """
+    Boxcar filter counts and phases over time bins for many widths.
+
+    Counts are averaged and phases are circularly averaged over
+    `smoothing` neighbouring bins. Prefix sums are computed once and
+    shared between all widths.
+
+    Parameters
+    ----------
+    counts : numpy array
+        Spike counts. [n_cell, n_bins, n_samples]
+    phases : numpy array
+        Spike phases. [n_cell, n_bins, n_samples]
+    smoothings : int or list
+        Number of bins of the boxcar, or a list of them.
+
+    Returns
+    -------
+    smoothed : tuple or list
+        (counts, phases) with [n_cell, n_bins-smoothing+1, n_samples] for
+        an int, a list of such tuples for a list of widths.
+    """
+    single = np.isscalar(smoothings)
+    if single:
+        smoothings = [smoothings]
+
+    def prefix(x):
+        zeros = np.zeros((x.shape[0], 1, x.shape[2]))
+        return np.concatenate((zeros, np.cumsum(x, axis=1)), axis=1)
+
+    count_prefix = prefix(counts)
+    sin_prefix = prefix(np.sin(phases))
+    cos_prefix = prefix(np.cos(phases))
+
+    smoothed = []
+    for smoothing in smoothings:
+        if smoothing == 1:
+            smoothed.append((counts, phases))
+            continue
+        count_box = ((count_prefix[:, smoothing:] -
+                      count_prefix[:, :-smoothing]) / smoothing)
+        sin_box = sin_prefix[:, smoothing:] - sin_prefix[:, :-smoothing]
+        cos_box = cos_prefix[:, smoothing:] - cos_prefix[:, :-smoothing]
+        phase_box = np.arctan2(sin_box, cos_box) % (2 * np.pi)
+        smoothed.append((count_box, phase_box))
+
+    if single:
+        return smoothed[0]
+    return smoothed
+
+
+def _discretize(values, max_values, discretization):
+    """Assign each value to one of `discretization` bins up to max_values."""
+    scale = np.where(max_values > 0, max_values, 1)
+    normed = values / scale[:, None, None]
+    edges = np.linspace(0, 1, discretization + 1)[1:-1]
+    return np.digitize(normed, edges)
+
+
+def _info_per_bin(discrete, discretization):
+    """Positional information of discretized values for each [cell, pos]."""
+    n_cell, n_pos, n_samples = discrete.shape
+    flat_idx = ((np.arange(n_cell)[:, None, None] * n_pos +
+                 np.arange(n_pos)[None, :, None]) * discretization + discrete)
+    p_k_pos = np.bincount(flat_idx.ravel(),
+                          minlength=n_cell * n_pos * discretization)
+    p_k_pos = p_k_pos.reshape(n_cell, n_pos, discretization) / n_samples
+    p_k = p_k_pos.mean(axis=1, keepdims=True)
+    ratio = np.divide(p_k_pos, p_k, out=np.ones_like(p_k_pos),
+                      where=p_k_pos > 0)
+    return (p_k_pos * np.log(ratio)).sum(axis=2)
+
+
+def _pos_information(counts, phases, discretization):
+    """Per spike positional information of smoothed counts and phases."""
+    max_rates = counts.max(axis=(1, 2))
+    max_phases = np.full(counts.shape[0], 2 * np.pi)
+    rate_results = _info_per_bin(
+        _discretize(counts, max_rates, discretization), discretization)
+    phase_results = _info_per_bin(
+        _discretize(phases, max_phases, discretization), discretization)
+    mean_count = np.mean(counts)
+    return (np.nanmean(rate_results) / mean_count,
+            np.nanmean(phase_results) / mean_count)
+
+
+def _pos_information_batch(times, cells, samples, n_cell, n_samples,
+                           code='rate', discretization=7, bin_size_ms=100,
+                           dur_ms=2000, smoothing=1):
+    """Per spike positional information of each cell for a batch of flat
+    spike buffers with times [n_batch, n_spikes]. Returns [n_batch, n_cell].
+    """
+    counts, phases = _bin_spikes(times, cells, samples, n_cell, n_samples,
+                                 bin_size_ms, dur_ms)
+    n_batch = counts.shape[0]
+    counts = counts.reshape((n_batch * n_cell,) + counts.shape[2:])
+    phases = phases.reshape((n_batch * n_cell,) + phases.shape[2:])
+    counts, phases = smooth_cells(counts, phases, smoothing)
+    if code == 'rate':
+        discrete = _discretize(counts, counts.max(axis=(1, 2)),
+                               discretization)
+    elif code == 'phase':
+        discrete = _discretize(phases, np.full(counts.shape[0], 2 * np.pi),
+                               discretization)
+    else:
+        raise ValueError("code must be 'rate' or 'phase'")
+    info = np.nanmean(_info_per_bin(discrete, discretization), axis=1)
+    mean_counts = counts.mean(axis=(1, 2))
+    info = np.divide(info, mean_counts, out=np.zeros_like(info),
+                     where=mean_counts > 0)
+    return info.reshape(n_batch, n_cell)
+
+
+def pos_information_significance(spike_times, code='rate', discretization=7,
+                                 bin_size_ms=100, dur_ms=2000, smoothing=1,
+                                 threshold=8, method='shift',
+                                 n_surrogates=1000, chunk_size=20,
+                                 n_processes=1, seed=0):
+    """
+    Per-cell significance of positional information against surrogates.
+
+    Every trial of every cell is surrogated independently.
+
+    Parameters
+    ----------
+    spike_times : list
+        List (Poisson seed) of lists (cell) of spike times in ms.
+    code : str
+        'rate' or 'phase'. The default is 'rate'.
+    discretization : int
+        Number of value bins. The default is 7.
+    bin_size_ms : int
+        Time bin size in milliseconds, also the theta period.
+        The default is 100.
+    dur_ms : int
+        Duration of the simulation. The default is 2000.
+    smoothing : int
+        Number of bins of the boxcar filter. The default is 1.
+    threshold : int
+        Cells firing less spikes in total are not tested.
+        The default is 8.
+    method : str
+        'shift' circularly shifts each trial,
+        'phase' shuffles spike phases within theta cycles.
+        The default is 'shift'.
+    n_surrogates : int
+        Number of surrogates per cell. The default is 1000.
+    chunk_size : int
+        Number of surrogates evaluated at once. The default is 20.
+    n_processes : int
+        Number of worker processes. The default is 1.
+    seed : int
+        Surrogate seed. The default is 0.
+
+    Returns
+    -------
+    cells : numpy array
+        Indices of the tested cells.
+    pos_info : numpy array
+        Positional information per spike of each tested cell.
+    p_values : numpy array
+        Surrogate p-value of each tested cell.
+    z_scores : numpy array
+        Surrogate z-score of each tested cell.
+    """
+    times, cells, samples, n_cell, n_samples = _flatten_spikes(spike_times)
+    counts, _ = phase_n_rate(spike_times, bin_size_ms=bin_size_ms,
+                             dur_ms=dur_ms)
+    active = np.flatnonzero(counts.sum(axis=(1, 2)) >= threshold)
+    keep = np.isin(cells, active)
+    times, samples = times[keep], samples[keep]
+    cells = np.searchsorted(active, cells[keep])
+    n_active = active.size
+    metric = partial(_pos_information_batch, cells=cells, samples=samples,
+                     n_cell=n_active, n_samples=n_samples, code=code,
+                     discretization=discretization, bin_size_ms=bin_size_ms,
+                     dur_ms=dur_ms, smoothing=smoothing)
+    trains = cells * n_samples + samples
+    period = dur_ms if method == 'shift' else bin_size_ms
+    pos_info, p_values, z_scores = surrogate_test(
+        metric, times, trains, n_active * n_samples, method=method,
+        period=period, n_surrogates=n_surrogates, chunk_size=chunk_size,
+        n_processes=n_processes, seed=seed)
+    return active, pos_info, p_values, z_scores
+
+
+def pos_information(spike_times, discretization=7, bin_size_ms=100,
+                    dur_ms=2000, smoothing=1, threshold=8):
+    """
+    Positional information of rate and phase codes (Tingley & Buzsaki).
+
+    Parameters
+    ----------
+    spike_times : list
+        List (Poisson seed) of lists (cell) of spike times in ms.
+    discretization : int
+        Number of value bins for rates and phases. The default is 7.
+    bin_size_ms : int
+        Time bin size in milliseconds. The default is 100.
+    dur_ms : int
+        Duration of the simulation. The default is 2000.
+    smoothing : int
+        Number of bins of the boxcar filter. The default is 1.
+    threshold : int
+        Cells firing less spikes in total are filtered out.
+        The default is 8.
+
+    Returns
+    -------
+    rate_info : float
+        Mean positional information per spike of the rate code.
+    phase_info : float
+        Mean positional information per spike of the phase code.
+    """
+    rate_info, phase_info = pos_information_sweep(
+        spike_times, smoothings=[smoothing], discretizations=[discretization],
+        bin_size_ms=bin_size_ms, dur_ms=dur_ms, threshold=threshold)
+    return rate_info[0, 0], phase_info[0, 0]
+
+
+def pos_information_sweep(spike_times, smoothings=range(1, 20),
+                          discretizations=(7,), bin_size_ms=100,
+                          dur_ms=2000, threshold=8):
+    """
+    Positional information for all combinations of smoothing and
+    discretization, binning and filtering the spikes only once.
+
+    Parameters
+    ----------
+    spike_times : list
+        List (Poisson seed) of lists (cell) of spike times in ms.
+    smoothings : list
+        Boxcar widths in bins. The default is range(1, 20).
+    discretizations : list
+        Numbers of value bins. The default is (7,).
+    bin_size_ms : int
+        Time bin size in milliseconds. The default is 100.
+    dur_ms : int
+        Duration of the simulation. The default is 2000.
+    threshold : int
+        Cells firing less spikes in total are filtered out.
+        The default is 8.
+
+    Returns
+    -------
+    rate_info : numpy array
+        Rate code positional information. [n_smoothings, n_discretizations]
+    phase_info : numpy array
+        Phase code positional information. [n_smoothings, n_discretizations]
+    """
+    counts, phases = phase_n_rate(spike_times, bin_size_ms=bin_size_ms,
+                                  dur_ms=dur_ms)
+    counts, phases = filter_cells(counts, phases, threshold=threshold)
+    smoothings = list(smoothings)
+    discretizations = list(discretizations)
+    rate_info = np.empty((len(smoothings), len(discretizations)))
+    phase_info = np.empty((len(smoothings), len(discretizations)))
+    smoothed = smooth_cells(counts, phases, smoothings)
+    for s_idx, (s_counts, s_phases) in enumerate(smoothed):
+        for d_idx, discretization in enumerate(discretizations):
+            rate_info[s_idx, d_idx], phase_info[s_idx, d_idx] = (
+                _pos_information(s_counts, s_phases, discretization))
+    return rate_info, phase_info
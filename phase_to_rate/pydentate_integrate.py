@@ -6,13 +6,201 @@ Created on Fri Sep  3 13:28:49 2021
 @author: baris
 """
 
+from phase_to_rate.connectivity import pp_connectivity
 from pydentate import net_tunedrev, neuron_tools
 import numpy as np
-import scipy.stats as stats
-import pdb
+import weakref
 from neuron import h, gui
 
 
+# pydentate's TunedNetwork builds populations of these sizes whatever sizes
+# the connectivity was drawn for. Larger networks need a builder that
+# distributes the cells over MPI ranks by gid, which pydentate lacks.
+NETWORK_SIZES = {'n_granule': 2000, 'n_mossy': 60, 'n_basket': 24,
+                 'n_hipp': 24}
+
+
+def _check_sizes(**sizes):
+    wrong = {name: size for name, size in sizes.items()
+             if size != NETWORK_SIZES[name]}
+    if wrong:
+        raise ValueError(
+            f"pydentate builds networks of {NETWORK_SIZES} only, got "
+            f"{wrong}")
+
+
+def configure_threads(nthread=1):
+    """
+    Distribute the cells of all networks over nthread NEURON threads.
+
+    Uses ParallelContext threads with the cache efficient memory layout.
+    Mechanisms that are not thread safe are simulated in the first thread.
+
+    Parameters
+    ----------
+    nthread : int
+        Number of threads. The default is 1.
+    """
+    h.ParallelContext().nthread(nthread)
+    h.cvode.cache_efficient(1)
+
+
+def _spike_detector(cell, counter):
+    """NetCon that detects the same spikes as a pydentate AP counter."""
+    detector = counter[1]
+    if detector.hname().startswith('NetCon'):
+        return detector
+    # APCount counters, threshold crossings of the somatic voltage
+    detector = h.NetCon(cell.soma(0.5)._ref_v, None, sec=cell.soma)
+    detector.threshold = counter[1].thresh
+    return detector
+
+
+# ParallelContext gids are global to the process. Every SpikeRecorder takes
+# the next free gids, they are cleared once no recorder uses them any more.
+# Each MPI rank allocates from its own block, so gids never clash between
+# ranks.
+_GIDS_PER_RANK = 2 ** 24
+_gids = {'next': 0, 'live': 0}
+
+
+def _allocate_gids(n_cells):
+    """First gid of n_cells new gids."""
+    pc = h.ParallelContext()
+    if _gids['live'] == 0 and _gids['next']:
+        pc.gid_clear()
+        _gids['next'] = 0
+    if _gids['next'] + n_cells > _GIDS_PER_RANK:
+        raise RuntimeError("Live SpikeRecorders use all gids of this rank")
+    first = int(pc.id()) * _GIDS_PER_RANK + _gids['next']
+    _gids['next'] += n_cells
+    _gids['live'] += 1
+    return first
+
+
+def _release_gids():
+    _gids['live'] -= 1
+
+
+class SpikeRecorder:
+    """
+    Spikes of whole populations in two flat NEURON vectors.
+
+    Every cell gets a gid, consecutive over the populations in the given
+    order, and one ParallelContext.spike_record call records the spikes of
+    these gids into a times and a gids vector, in order of time. No per
+    cell vectors are converted after the run. The gids follow the ones of
+    the other live recorders, so recorders of different networks do not
+    interfere. They are released when the recorder is closed or garbage
+    collected together with its network.
+
+    Parameters
+    ----------
+    populations : list
+        pydentate populations, e.g. network.populations.
+    """
+
+    def __init__(self, populations):
+        pc = h.ParallelContext()
+        rank = int(pc.id())
+        n_cells = sum(len(population.ap_counters)
+                      for population in populations)
+        first = _allocate_gids(n_cells)
+        self._finalizer = weakref.finalize(self, _release_gids)
+        self._detectors = []
+        self.offsets = [first]
+        gid = first
+        for population in populations:
+            for cell, counter in zip(population, population.ap_counters):
+                pc.set_gid2node(gid, rank)
+                detector = _spike_detector(cell, counter)
+                pc.cell(gid, detector)
+                self._detectors.append(detector)
+                gid += 1
+            self.offsets.append(gid)
+        self._times = h.Vector()
+        self._gids = h.Vector()
+        pc.spike_record(h.Vector(np.arange(first, gid)), self._times,
+                        self._gids)
+
+    def close(self):
+        """Stop recording and release the gids."""
+        self._detectors = []
+        self._finalizer()
+
+    def clear(self):
+        """Drop the spikes of the previous run."""
+        self._times.resize(0)
+        self._gids.resize(0)
+
+    def spikes(self):
+        """
+        Spike times and gids of all cells.
+
+        Views of the NEURON vectors without copies, valid until the next
+        run or clear.
+
+        Returns
+        -------
+        times : numpy array
+            Spike times in ms, in order of time.
+        gids : numpy array
+            Float gid of each spike, population p has the gids
+            offsets[p] to offsets[p + 1] - 1. The gids of the first
+            recorder of rank r start at r * 2 ** 24.
+        """
+        return self._times.as_numpy(), self._gids.as_numpy()
+
+    def csr(self, population=None):
+        """
+        Spikes sorted by cell as CSR arrays, copies.
+
+        Parameters
+        ----------
+        population : int
+            Index of a population. The default is None, all cells.
+
+        Returns
+        -------
+        times : numpy array
+            Spike times of cell 0, then cell 1, ..., each in order of time.
+        indptr : numpy array
+            Spikes of cell i are times[indptr[i]:indptr[i + 1]].
+            [n_cells + 1]
+        """
+        times, gids = self.spikes()
+        if population is None:
+            start, stop = self.offsets[0], self.offsets[-1]
+        else:
+            start, stop = self.offsets[population:population + 2]
+        gids = gids.astype(np.int64)
+        keep = (gids >= start) & (gids < stop)
+        cells = gids[keep] - start
+        # stable, so every cell keeps its spikes in order of time
+        order = np.argsort(cells, kind='stable')
+        indptr = np.zeros(stop - start + 1, dtype=np.int64)
+        np.cumsum(np.bincount(cells, minlength=stop - start),
+                  out=indptr[1:])
+        return times[keep][order], indptr
+
+    def population_spikes(self, population):
+        """
+        Spike times of each cell of a population.
+
+        Parameters
+        ----------
+        population : int
+            Index of the population.
+
+        Returns
+        -------
+        list
+            Spike times of each cell, like get_timestamps.
+        """
+        times, indptr = self.csr(population)
+        return np.split(times, indptr[1:-1])
+
+
 def granule_simulate(
     grid_spikes,
     dur_ms=2000,
@@ -24,8 +212,8 @@ def granule_simulate(
     n_granule=2000,
     n_mossy=60,
     n_basket=24,
-    n_hipp=24
-
+    n_hipp=24,
+    nthread=1
 ):
     """
     Simulate biophysically realistic model of the dentate gyrus (pydentate).
@@ -56,11 +244,15 @@ def granule_simulate(
         Number of basket cells. The default is 24.
     n_hipp : int
         Number of Hillar perforant path cells. The default is 24.
+    nthread : int
+        Number of threads NEURON distributes the cells over. Spikes do
+        not depend on it. The default is 1.
 
     Raises
     ------
     ValueError
-        If tuning of network is invalid.
+        If tuning of network is invalid or the population sizes are not
+        the ones of NETWORK_SIZES.
 
     Returns
     -------
@@ -68,50 +260,297 @@ def granule_simulate(
         Granule cell spike times in a list.
 
     """
-    np.random.seed(grid_seed)
-    # Randomly choose target cells for the PP lines
-    gauss_gc = stats.norm(loc=1000, scale=input_scale)
-    gauss_bc = stats.norm(loc=12, scale=(input_scale / float(n_granule)) * 24)
-    pdf_gc = gauss_gc.pdf(np.arange(n_granule))
-    pdf_gc = pdf_gc / pdf_gc.sum()
-    pdf_bc = gauss_bc.pdf(np.arange(n_basket))
-    pdf_bc = pdf_bc / pdf_bc.sum()
-    GC_indices = np.arange(n_granule)
-    start_idc = np.random.randint(0, n_granule - 1, size=n_grid)
-
-    PP_to_GCs = []
-    for x in start_idc:
-        curr_idc = np.concatenate((GC_indices[x:n_granule], GC_indices[0:x]))
-        PP_to_GCs.append(np.random.choice(curr_idc,
-                                          size=100, replace=False, p=pdf_gc))
-
-    PP_to_GCs = np.array(PP_to_GCs)
-
-    BC_indices = np.arange(n_basket)
-    start_idc = np.array(((start_idc / float(n_granule)) * 24), dtype=int)
-
-    PP_to_BCs = []
-    for x in start_idc:
-        curr_idc = np.concatenate((BC_indices[x:n_basket], BC_indices[0:x]))
-        PP_to_BCs.append(np.random.choice(curr_idc,
-                                          size=1, replace=False, p=pdf_bc))
-
-    PP_to_BCs = np.array(PP_to_BCs)
-
-    nw = net_tunedrev.TunedNetwork(
-        None,
-        np.array(grid_spikes, dtype=object),
-        np.array(PP_to_GCs),
-        np.array(PP_to_BCs),
+    session = DentateSession(
+        grid_seed=grid_seed,
         network_type=network_type,
         pp_weight=pp_weight,
+        input_scale=input_scale,
+        n_grid=n_grid,
+        n_granule=n_granule,
+        n_mossy=n_mossy,
+        n_basket=n_basket,
+        n_hipp=n_hipp,
+        nthread=nthread,
     )
-    neuron_tools.run_neuron_simulator(t_stop=dur_ms)
+    return session.simulate(grid_spikes, dur_ms=dur_ms)
 
-    # granule_spikes = nw.populations[0].get_timestamps()
-    granule_spikes = [x[0].as_numpy() for x in nw.populations[0].ap_counters]
 
-    return granule_spikes
+class DentateSession:
+    """
+    Dentate gyrus network that is built once and simulated many times.
+
+    The network only depends on the grid seed, so trials with different
+    grid cell spikes (trajectories, poisson seeds) share it. The network is
+    built on the first trial. Later trials replace the spike times played
+    by the perforant path VecStims and reinitialize the network, which gives
+    the same spikes as building a new network with granule_simulate.
+    NEURON simulates every network that exists, so keep one session alive
+    at a time. Population sizes other than NETWORK_SIZES raise a
+    ValueError, pydentate cannot build them.
+
+    Parameters
+    ----------
+    grid_seed : int
+        Seed for the grid cell population
+        also seeds the dentate gyrus model.
+    network_type : str
+        Tuning of the network.
+    pp_weight : int
+        Connection weight from perforant path
+        from grid cell to dentate gyrus cells.
+    input_scale : int
+        Scale of the input. The default is 1000.
+    n_grid : int
+        Number of grid cells. The default is 200.
+    n_granule : int
+        Number granule cells. The default is 2000.
+    n_mossy : int
+        Number of mossy cells. The default is 60.
+    n_basket : int
+        Number of basket cells. The default is 24.
+    n_hipp : int
+        Number of Hillar perforant path cells. The default is 24.
+    compat_connectivity : bool
+        Draw the PP targets like the original np.random.choice loop, which
+        keeps networks of existing grid seeds. The default is True.
+    nthread : int
+        Number of threads NEURON distributes the cells over. Spikes do
+        not depend on it. The default is 1.
+    """
+
+    def __init__(
+        self,
+        grid_seed=1,
+        network_type='full',
+        pp_weight=9e-4,
+        input_scale=1000,
+        n_grid=200,
+        n_granule=2000,
+        n_mossy=60,
+        n_basket=24,
+        n_hipp=24,
+        compat_connectivity=True,
+        nthread=1
+    ):
+        _check_sizes(n_granule=n_granule, n_mossy=n_mossy, n_basket=n_basket,
+                     n_hipp=n_hipp)
+        self.grid_seed = grid_seed
+        self.network_type = network_type
+        self.pp_weight = pp_weight
+        self.input_scale = input_scale
+        self.n_grid = n_grid
+        self.n_granule = n_granule
+        self.n_mossy = n_mossy
+        self.n_basket = n_basket
+        self.n_hipp = n_hipp
+        self.compat_connectivity = compat_connectivity
+        self.nthread = nthread
+        self.network = None
+        self._stims = None
+        self._input_vectors = None
+        self.recorder = None
+
+    def _build(self, grid_spikes):
+        # Randomly choose target cells for the PP lines
+        PP_to_GCs, PP_to_BCs, _ = pp_connectivity(
+            self.grid_seed, input_scale=self.input_scale, n_grid=self.n_grid,
+            n_granule=self.n_granule, n_basket=self.n_basket,
+            compat=self.compat_connectivity)
+        n_stims = int(h.List('VecStim').count())
+        self.network = net_tunedrev.TunedNetwork(
+            None,
+            np.array(grid_spikes, dtype=object),
+            np.array(PP_to_GCs),
+            np.array(PP_to_BCs),
+            network_type=self.network_type,
+            pp_weight=self.pp_weight,
+        )
+        # The PP VecStims are the ones created by the network, in order of
+        # the grid cells.
+        stims = h.List('VecStim')
+        self._stims = [stims.o(idx) for idx in range(n_stims, stims.count())]
+        if len(self._stims) != len(grid_spikes):
+            raise ValueError(
+                f"Expected {len(grid_spikes)} perforant path VecStims, "
+                f"the network created {len(self._stims)}")
+        self.recorder = SpikeRecorder(self.network.populations)
+
+    def _set_inputs(self, grid_spikes):
+        if len(grid_spikes) != len(self._stims):
+            raise ValueError(f"grid_spikes needs {len(self._stims)} trains")
+        self._input_vectors = []
+        for stim, spikes in zip(self._stims, grid_spikes):
+            vec = h.Vector(np.asarray(spikes, dtype=float))
+            stim.play(vec)
+            self._input_vectors.append(vec)
+
+    def simulate(self, grid_spikes, dur_ms=2000):
+        """
+        Simulate one trial with the given grid cell spikes.
+
+        Parameters
+        ----------
+        grid_spikes : list
+            Spike times of grid cell population.
+        dur_ms : int
+            Duration of the simulation.
+
+        Returns
+        -------
+        granule_spikes : list
+            Granule cell spike times in a list.
+        """
+        self.run(grid_spikes, dur_ms=dur_ms)
+        # copies, the recording vectors are reused by the next trial
+        return self.recorder.population_spikes(0)
+
+    def run(self, grid_spikes, dur_ms=2000):
+        """
+        Simulate one trial and return the spikes of all populations.
+
+        Parameters
+        ----------
+        grid_spikes : list
+            Spike times of grid cell population.
+        dur_ms : int
+            Duration of the simulation.
+
+        Returns
+        -------
+        times : numpy array
+            Spike times of all cells in order of time, a view of the
+            recording.
+        gids : numpy array
+            Cell index of each spike within the network. Granule, mossy,
+            basket and HIPP cells follow each other starting at 0.
+        """
+        if self.network is None:
+            self._build(grid_spikes)
+        else:
+            self._set_inputs(grid_spikes)
+        self.recorder.clear()
+        configure_threads(self.nthread)
+        neuron_tools.run_neuron_simulator(t_stop=dur_ms)
+        times, gids = self.recorder.spikes()
+        return times, gids - self.recorder.offsets[0]
+
+    def simulate_batch(self, grid_spikes_trials, dur_ms=2000, gap_ms=1000):
+        """
+        Simulate several trials in one run separated by silent gaps.
+
+        The trials are concatenated into one input timeline, simulated once
+        and the granule spikes are split back into trials. The gaps let the
+        network return to rest, so each trial approximates an isolated
+        simulate call, see raster_mismatch to validate a gap length.
+
+        Parameters
+        ----------
+        grid_spikes_trials : list
+            Grid cell spike times of each trial.
+        dur_ms : int
+            Duration of each trial.
+        gap_ms : float
+            Silent time between trials. The default is 1000.
+
+        Returns
+        -------
+        list
+            Granule cell spike times of each trial, starting at 0.
+        """
+        grid_spikes = concatenate_trials(grid_spikes_trials, dur_ms, gap_ms)
+        n_trials = len(grid_spikes_trials)
+        t_stop = n_trials * dur_ms + (n_trials - 1) * gap_ms
+        granule_spikes = self.simulate(grid_spikes, dur_ms=t_stop)
+        return split_trials(granule_spikes, n_trials, dur_ms, gap_ms)
+
+
+def concatenate_trials(spikes_trials, dur_ms, gap_ms):
+    """
+    Concatenate the spike trains of several trials into one timeline.
+
+    Trial k is shifted by k * (dur_ms + gap_ms).
+
+    Parameters
+    ----------
+    spikes_trials : list
+        Spike times per cell of each trial. [n_trials][n_cells]
+    dur_ms : float
+        Duration of each trial.
+    gap_ms : float
+        Silent time between trials.
+
+    Returns
+    -------
+    list
+        Spike times of each cell over all trials.
+    """
+    period = dur_ms + gap_ms
+    return [np.concatenate([np.asarray(trial[cell], dtype=float) + k * period
+                            for k, trial in enumerate(spikes_trials)])
+            for cell in range(len(spikes_trials[0]))]
+
+
+def split_trials(spikes, n_trials, dur_ms, gap_ms):
+    """
+    Split spike trains of concatenated trials back into trials.
+
+    Spikes in the gaps are dropped and times are relative to the start of
+    their trial.
+
+    Parameters
+    ----------
+    spikes : list
+        Spike times of each cell over all trials.
+    n_trials : int
+        Number of trials.
+    dur_ms : float
+        Duration of each trial.
+    gap_ms : float
+        Silent time between trials.
+
+    Returns
+    -------
+    list
+        Spike times per cell of each trial. [n_trials][n_cells]
+    """
+    period = dur_ms + gap_ms
+    trials = [[] for _ in range(n_trials)]
+    for cell_spikes in spikes:
+        cell_spikes = np.asarray(cell_spikes, dtype=float)
+        trial = np.floor(cell_spikes / period).astype(int)
+        offset = cell_spikes - trial * period
+        keep = (offset <= dur_ms) & (trial < n_trials)
+        for k in range(n_trials):
+            trials[k].append(offset[keep & (trial == k)])
+    return trials
+
+
+def raster_mismatch(spikes, reference, tolerance_ms=1.0):
+    """
+    Fraction of cells whose spikes differ from a reference raster.
+
+    A cell matches if it has the same number of spikes and every spike is
+    within tolerance_ms of the reference spike with the same index.
+
+    Parameters
+    ----------
+    spikes : list
+        Spike times of each cell.
+    reference : list
+        Reference spike times of each cell, e.g. of an isolated trial.
+    tolerance_ms : float
+        Largest allowed difference of spike times. The default is 1.0.
+
+    Returns
+    -------
+    float
+        Fraction of mismatching cells.
+    """
+    mismatch = [len(x) != len(y) or
+                np.any(np.abs(np.asarray(x) - np.asarray(y)) > tolerance_ms)
+                for x, y in zip(spikes, reference)]
+    return float(np.mean(mismatch))
+
 
 def granule_simulate_all_cell_types(
     grid_spikes,
@@ -124,7 +563,8 @@ def granule_simulate_all_cell_types(
     n_granule=2000,
     n_mossy=60,
     n_basket=24,
-    n_hipp=24
+    n_hipp=24,
+    nthread=1
 ):
     """
     Simulate biophysically realistic model of the dentate gyrus (pydentate).
@@ -155,47 +595,34 @@ def granule_simulate_all_cell_types(
         Number of basket cells. The default is 24.
     n_hipp : int
         Number of Hillar perforant path cells. The default is 24.
+    nthread : int
+        Number of threads NEURON distributes the cells over. Spikes do
+        not depend on it. The default is 1.
 
     Raises
     ------
     ValueError
-        If tuning of network is invalid.
+        If tuning of network is invalid or the population sizes are not
+        the ones of NETWORK_SIZES.
 
     Returns
     -------
     granule_spikes : list
         Granule cell spike times in a list.
+    mossy_spikes : list
+        Mossy cell spike times in a list.
+    basket_spikes : list
+        Basket cell spike times in a list.
+    hipp_spikes : list
+        HIPP cell spike times in a list.
 
     """
-    np.random.seed(grid_seed)
+    _check_sizes(n_granule=n_granule, n_mossy=n_mossy, n_basket=n_basket,
+                 n_hipp=n_hipp)
     # Randomly choose target cells for the PP lines
-    gauss_gc = stats.norm(loc=1000, scale=input_scale)
-    gauss_bc = stats.norm(loc=12, scale=(input_scale / float(n_granule)) * 24)
-    pdf_gc = gauss_gc.pdf(np.arange(n_granule))
-    pdf_gc = pdf_gc / pdf_gc.sum()
-    pdf_bc = gauss_bc.pdf(np.arange(n_basket))
-    pdf_bc = pdf_bc / pdf_bc.sum()
-    GC_indices = np.arange(n_granule)
-    start_idc = np.random.randint(0, n_granule - 1, size=n_grid)
-
-    PP_to_GCs = []
-    for x in start_idc:
-        curr_idc = np.concatenate((GC_indices[x:n_granule], GC_indices[0:x]))
-        PP_to_GCs.append(np.random.choice(curr_idc,
-                                          size=100, replace=False, p=pdf_gc))
-
-    PP_to_GCs = np.array(PP_to_GCs)
-
-    BC_indices = np.arange(n_basket)
-    start_idc = np.array(((start_idc / float(n_granule)) * 24), dtype=int)
-
-    PP_to_BCs = []
-    for x in start_idc:
-        curr_idc = np.concatenate((BC_indices[x:n_basket], BC_indices[0:x]))
-        PP_to_BCs.append(np.random.choice(curr_idc,
-                                          size=1, replace=False, p=pdf_bc))
-
-    PP_to_BCs = np.array(PP_to_BCs)
+    PP_to_GCs, PP_to_BCs, _ = pp_connectivity(
+        grid_seed, input_scale=input_scale, n_grid=n_grid,
+        n_granule=n_granule, n_basket=n_basket)
 
     nw = net_tunedrev.TunedNetwork(
         None,
@@ -205,15 +632,12 @@ def granule_simulate_all_cell_types(
         network_type=network_type,
         pp_weight=pp_weight,
     )
+    # All populations in one spike record, as cheap as granule cells only
+    recorder = SpikeRecorder(nw.populations[:4])
+    configure_threads(nthread)
     neuron_tools.run_neuron_simulator(t_stop=dur_ms)
 
-    granule_spikes = nw.populations[0].get_timestamps()
-    mossy_spikes = nw.populations[1].get_timestamps()
-    basket_spikes = nw.populations[2].get_timestamps()
-    hipp_spikes = nw.populations[3].get_timestamps()
-
-    return granule_spikes, mossy_spikes, basket_spikes, hipp_spikes
-
+    return tuple(recorder.population_spikes(idx) for idx in range(4))
 
 
 def granule_simulate_noisy(
@@ -228,7 +652,11 @@ def granule_simulate_noisy(
     n_mossy=60,
     n_basket=24,
     n_hipp=24,
-    noise_scale=0.05
+    noise_scale=0.05,
+    nthread=1,
+    noise_mode='neuron',
+    record_voltage=None,
+    voltage_dt=None
 ):
     """
     Simulate biophysically realistic model of the dentate gyrus (pyDentate).
@@ -259,47 +687,48 @@ def granule_simulate_noisy(
         Number of basket cells. The default is 24.
     n_hipp : int
         Number of Hillar perforant path cells. The default is 24.
+    noise_scale : float
+        Standard deviation of the noise current into each granule cell
+        soma in nA, drawn every time step. The default is 0.05.
+    nthread : int
+        Number of threads NEURON distributes the cells over. Spikes do
+        not depend on it. The default is 1.
+    noise_mode : str
+        'neuron' draws the noise inside NEURON from a Random123 stream per
+        cell seeded by grid_seed and the cell index, without storing it,
+        so memory stays close to that of the network. 'numpy' plays noise
+        drawn from numpy seeded by grid_seed, the noise of old results.
+        Its n_granule played vectors of dur_ms / 0.1 doubles stay in
+        NEURON for the whole run, about 320 MB for 2000 cells and 2 s.
+        The default is 'neuron'.
+    record_voltage : list
+        Indices of granule cells to record the somatic voltage of.
+        The default is None, no recording.
+    voltage_dt : float
+        Sampling interval of the voltage recording in ms. The default is
+        None, every time step.
 
     Raises
     ------
     ValueError
-        If tuning of network is invalid.
+        If tuning of network is invalid or the population sizes are not
+        the ones of NETWORK_SIZES.
 
     Returns
     -------
     granule_spikes : list
         Granule cell spike times in a list.
+    voltages : numpy array
+        Somatic voltages of the record_voltage cells, only returned if
+        record_voltage is not None. [n_recorded, n_samples]
     """
 
-    np.random.seed(grid_seed)
+    _check_sizes(n_granule=n_granule, n_mossy=n_mossy, n_basket=n_basket,
+                 n_hipp=n_hipp)
     # Randomly choose target cells for the PP lines
-    gauss_gc = stats.norm(loc=1000, scale=input_scale)
-    gauss_bc = stats.norm(loc=12, scale=(input_scale / float(n_granule)) * 24)
-    pdf_gc = gauss_gc.pdf(np.arange(n_granule))
-    pdf_gc = pdf_gc / pdf_gc.sum()
-    pdf_bc = gauss_bc.pdf(np.arange(n_basket))
-    pdf_bc = pdf_bc / pdf_bc.sum()
-    GC_indices = np.arange(n_granule)
-    start_idc = np.random.randint(0, n_granule - 1, size=n_grid)
-
-    PP_to_GCs = []
-    for x in start_idc:
-        curr_idc = np.concatenate((GC_indices[x:n_granule], GC_indices[0:x]))
-        PP_to_GCs.append(np.random.choice(curr_idc,
-                                          size=100, replace=False, p=pdf_gc))
-
-    PP_to_GCs = np.array(PP_to_GCs)
-    pdb.set_trace()
-    BC_indices = np.arange(n_basket)
-    start_idc = np.array(((start_idc / float(n_granule)) * 24), dtype=int)
-
-    PP_to_BCs = []
-    for x in start_idc:
-        curr_idc = np.concatenate((BC_indices[x:n_basket], BC_indices[0:x]))
-        PP_to_BCs.append(np.random.choice(curr_idc,
-                                          size=1, replace=False, p=pdf_bc))
-
-    PP_to_BCs = np.array(PP_to_BCs)
+    PP_to_GCs, PP_to_BCs, _ = pp_connectivity(
+        grid_seed, input_scale=input_scale, n_grid=n_grid,
+        n_granule=n_granule, n_basket=n_basket)
 
     nw = net_tunedrev.TunedNetwork(
         None,
@@ -313,29 +742,49 @@ def granule_simulate_noisy(
     dt = 0.1
 
     """CREATE NOISE"""
-    noise = np.random.normal(0, noise_scale, size=(n_granule, int(dur_ms/dt)))
     noise_clamps = []
-    noise_vectors = []
-    time_vectors = []
+    noise_sources = []
     for idx, gc in enumerate(nw.populations[0]):
         ic = h.IClamp(gc.soma(0.5))
         ic.delay = 0.0
         ic.dur = 1e9
-        tvec = h.Vector()
-        vec = h.Vector()
-        vec.from_python(noise[idx])
-        vec.play(ic._ref_amp, dt)
+        if noise_mode == 'numpy':
+            # One cell at a time draws the same numbers as the full
+            # (n_granule, n_steps) matrix, the played vectors still hold
+            # all of them
+            vec = h.Vector(np.random.normal(0, noise_scale,
+                                            size=int(dur_ms / dt)))
+            vec.play(ic._ref_amp, dt)
+            noise_sources.append(vec)
+        elif noise_mode == 'neuron':
+            rng = h.Random()
+            rng.Random123(idx, grid_seed, 0)
+            rng.normal(0, noise_scale ** 2)
+            rng.play(ic._ref_amp)
+            noise_sources.append(rng)
+        else:
+            raise ValueError("noise_mode must be 'numpy' or 'neuron'")
         noise_clamps.append(ic)
-        noise_vectors.append(vec)
-        time_vectors.append(tvec)
-        # pdb.set_trace()
-    nw.populations[0].voltage_recording(range(2000))
 
+    voltage_vectors = []
+    if record_voltage is not None:
+        cells = list(nw.populations[0])
+        for idx in record_voltage:
+            vec = h.Vector()
+            if voltage_dt is None:
+                vec.record(cells[idx].soma(0.5)._ref_v)
+            else:
+                vec.record(cells[idx].soma(0.5)._ref_v, voltage_dt)
+            voltage_vectors.append(vec)
+
+    recorder = SpikeRecorder(nw.populations[:1])
+    configure_threads(nthread)
     neuron_tools.run_neuron_simulator(t_stop=dur_ms, dt_sim=dt)
-    # granule_spikes = [x[0].as_numpy() for x in nw.populations[0].ap_counters]
-    granule_spikes = nw.populations[0].get_timestamps()
-
+    granule_spikes = recorder.population_spikes(0)
 
+    if record_voltage is not None:
+        voltages = np.array([vec.as_numpy() for vec in voltage_vectors])
+        return granule_spikes, voltages
     return granule_spikes
 
 
@@ -353,7 +802,8 @@ def granule_simulate_lec_noise(
     n_basket=24,
     n_hipp=24,
     n_lec=20,
-    n_lec_synapses=100
+    n_lec_synapses=100,
+    nthread=1
 ):
     """
     Simulate biophysically realistic model of the dentate gyrus (pydentate).
@@ -384,11 +834,15 @@ def granule_simulate_lec_noise(
         Number of basket cells. The default is 24.
     n_hipp : int
         Number of Hillar perforant path cells. The default is 24.
+    nthread : int
+        Number of threads NEURON distributes the cells over. Spikes do
+        not depend on it. The default is 1.
 
     Raises
     ------
     ValueError
-        If tuning of network is invalid.
+        If tuning of network is invalid or the population sizes are not
+        the ones of NETWORK_SIZES.
 
     Returns
     -------
@@ -396,42 +850,14 @@ def granule_simulate_lec_noise(
         Granule cell spike times in a list.
 
     """
-    np.random.seed(grid_seed)
-    # Randomly choose target cells for the PP lines
-    gauss_gc = stats.norm(loc=1000, scale=input_scale)
-    gauss_bc = stats.norm(loc=12, scale=(input_scale / float(n_granule)) * 24)
-    pdf_gc = gauss_gc.pdf(np.arange(n_granule))
-    pdf_gc = pdf_gc / pdf_gc.sum()
-    pdf_bc = gauss_bc.pdf(np.arange(n_basket))
-    pdf_bc = pdf_bc / pdf_bc.sum()
-    GC_indices = np.arange(n_granule)
-    start_idc = np.random.randint(0, n_granule - 1, size=n_grid)
-
-    PP_to_GCs = []
-    for x in start_idc:
-        curr_idc = np.concatenate((GC_indices[x:n_granule], GC_indices[0:x]))
-        PP_to_GCs.append(np.random.choice(curr_idc,
-                                          size=100, replace=False, p=pdf_gc))
-
-    PP_to_GCs = np.array(PP_to_GCs)
-    
-    """Create LEC noise inputs.
-    Each LEC cell chooses 100 random GCs"""
-    LEC_to_GCs = []
-    for x in range(n_lec):
-        LEC_to_GCs.append(np.random.choice(range(2000), size=n_lec_synapses, replace=False))
-    LEC_to_GCs = np.array(LEC_to_GCs)
-
-    BC_indices = np.arange(n_basket)
-    start_idc = np.array(((start_idc / float(n_granule)) * 24), dtype=int)
-
-    PP_to_BCs = []
-    for x in start_idc:
-        curr_idc = np.concatenate((BC_indices[x:n_basket], BC_indices[0:x]))
-        PP_to_BCs.append(np.random.choice(curr_idc,
-                                          size=1, replace=False, p=pdf_bc))
-
-    PP_to_BCs = np.array(PP_to_BCs)
+    _check_sizes(n_granule=n_granule, n_mossy=n_mossy, n_basket=n_basket,
+                 n_hipp=n_hipp)
+    # Randomly choose target cells for the PP lines and LEC noise inputs.
+    # Each LEC cell chooses n_lec_synapses random GCs
+    PP_to_GCs, PP_to_BCs, LEC_to_GCs = pp_connectivity(
+        grid_seed, input_scale=input_scale, n_grid=n_grid,
+        n_granule=n_granule, n_basket=n_basket, n_lec=n_lec,
+        n_lec_synapses=n_lec_synapses)
 
     nw = net_tunedrev.TunedNetworkPlusLEC(
         None,
@@ -443,9 +869,9 @@ def granule_simulate_lec_noise(
         network_type=network_type,
         pp_weight=pp_weight,
     )
+    recorder = SpikeRecorder(nw.populations[:1])
+    configure_threads(nthread)
     neuron_tools.run_neuron_simulator(t_stop=dur_ms)
 
-    granule_spikes = nw.populations[0].get_timestamps()
-
-    return granule_spikes
+    return recorder.population_spikes(0)
 
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Content-addressed cache of simulation results.
+
+Every result is stored in its own pickle file named by a hash of the inputs
+that produced it, for example grid seed, trajectory, poisson seed, tuning,
+weights and noise parameters. Files are written atomically, so a sweep that
+is interrupted keeps all finished trials and skips them on restart.
+"""
+
+import hashlib
+import numbers
+import os
+import pickle
+import tempfile
+import numpy as np
+
+
+def _update(hasher, obj):
+    if isinstance(obj, np.generic):
+        obj = obj.item()
+    if isinstance(obj, dict):
+        hasher.update(b'dict%d;' % len(obj))
+        for key in sorted(obj, key=str):
+            _update(hasher, str(key))
+            _update(hasher, obj[key])
+    elif isinstance(obj, np.ndarray) and obj.dtype != object:
+        hasher.update(f'array{obj.dtype.str}{obj.shape};'.encode())
+        hasher.update(np.ascontiguousarray(obj).tobytes())
+    elif isinstance(obj, (list, tuple, np.ndarray)):
+        hasher.update(b'list%d;' % len(obj))
+        for item in obj:
+            _update(hasher, item)
+    elif isinstance(obj, (str, bool)) or obj is None:
+        hasher.update(f'{type(obj).__name__}{obj!r};'.encode())
+    elif isinstance(obj, numbers.Real):
+        # 75 and 75.0 are the same trajectory
+        if float(obj).is_integer():
+            obj = int(obj)
+        hasher.update(f'number{obj!r};'.encode())
+    else:
+        raise TypeError(f"Cannot hash inputs of type {type(obj).__name__}")
+
+
+def input_hash(inputs):
+    """
+    Hash of simulation inputs that does not depend on their container types.
+
+    Parameters
+    ----------
+    inputs : dict
+        Inputs of one simulation. Values can be strings, numbers, None,
+        numpy arrays and nested lists, tuples or dicts of those.
+
+    Returns
+    -------
+    str
+        Hexadecimal sha256 digest.
+    """
+    hasher = hashlib.sha256()
+    _update(hasher, inputs)
+    return hasher.hexdigest()
+
+
+class ResultCache:
+    """
+    Directory of simulation results keyed by the hash of their inputs.
+
+    Parameters
+    ----------
+    cache_dir : str
+        Directory of the cache, created if needed.
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def path(self, key):
+        """File of the result with the given key."""
+        return os.path.join(self.cache_dir, key[:2], key + '.pickle')
+
+    def __contains__(self, inputs):
+        return os.path.isfile(self.path(input_hash(inputs)))
+
+    def load(self, inputs):
+        """
+        Cached result of the inputs.
+
+        Raises
+        ------
+        KeyError
+            If the inputs have not been simulated yet.
+        """
+        try:
+            with open(self.path(input_hash(inputs)), 'rb') as f:
+                return pickle.load(f)['result']
+        except FileNotFoundError:
+            raise KeyError(input_hash(inputs)) from None
+
+    def save(self, inputs, result):
+        """Atomically store the result of the inputs."""
+        path = self.path(input_hash(inputs))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path),
+                                        suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump({'inputs': inputs, 'result': result}, f,
+                            protocol=pickle.HIGHEST_PROTOCOL)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    def get_or_compute(self, inputs, compute):
+        """
+        Load the result of the inputs or compute and store it.
+
+        Parameters
+        ----------
+        inputs : dict
+            Everything the result depends on.
+        compute : callable
+            Called without arguments if the result is not cached.
+
+        Returns
+        -------
+        result
+        """
+        try:
+            return self.load(inputs)
+        except KeyError:
+            pass
+        result = compute()
+        self.save(inputs, result)
+        return result
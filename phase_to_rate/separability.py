@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Closed form linear separability of trajectory pairs.
+
+Deterministic alternatives to perceptron learning speed for the codes of
+neural_coding.rate_n_phase. All measures only need inner products of
+samples, so the Gram matrix of all samples is computed once and every
+trajectory pair is a small [2 * n_samples] problem solved for all pairs
+at once. The cost hardly depends on the number of features.
+"""
+
+import itertools
+import numpy as np
+import scipy.stats
+
+
+def _pair_problems(code, pairs):
+    """Gram matrices of the samples of each pair. [n_pairs, 2n, 2n]"""
+    n_features, n_samples, n_traj = code.shape
+    samples = code.reshape(n_features, n_samples * n_traj)
+    gram = samples.T @ samples
+    gram = gram.reshape(n_samples, n_traj, n_samples, n_traj)
+    idc = np.asarray(pairs)
+    # samples of the first trajectory, then of the second
+    return np.concatenate(
+        [np.concatenate([gram[:, idc[:, a], :, idc[:, b]]
+                         for b in (0, 1)], axis=2)
+         for a in (0, 1)], axis=1)
+
+
+def separability(code, pairs=None, shrinkage=0.1, ridge=0.1):
+    """
+    Separability measures of trajectory pairs in one vectorized pass.
+
+    fisher is the Mahalanobis distance of the class means,
+    sqrt(dmu' (S_w + l I)^-1 dmu), with the pooled within class
+    covariance S_w shrunk by l = shrinkage * trace(S_w) / n_features.
+    margin is the smallest signed distance of a sample from the decision
+    boundary of a ridge least squares classifier with targets +-1,
+    negative if the pair is not separated. d_prime is the discriminability
+    of the projections on the mean difference.
+
+    Parameters
+    ----------
+    code : numpy array
+        Neural code of each sample and trajectory, e.g. the rate, phase
+        or polar code of rate_n_phase. [n_features, n_samples, n_traj]
+    pairs : list
+        Trajectory index pairs. The default is None, all pairs i < j.
+    shrinkage : float
+        Regularization of the within class covariance relative to its
+        mean variance. The default is 0.1.
+    ridge : float
+        Ridge penalty relative to the mean squared norm of the centered
+        samples. The default is 0.1.
+
+    Returns
+    -------
+    dict
+        'pairs' [n_pairs, 2] and the measures 'fisher', 'margin' and
+        'd_prime' of each pair. [n_pairs]
+    """
+    code = np.asarray(code, dtype=float)
+    n_features, n_samples, n_traj = code.shape
+    if pairs is None:
+        pairs = list(itertools.combinations(range(n_traj), 2))
+    pairs = np.asarray(pairs).reshape(-1, 2)
+    gram = _pair_problems(code, pairs)
+    m = 2 * n_samples
+    eye = np.eye(m)
+    labels = np.repeat([1.0, -1.0], n_samples)
+
+    # Mean difference as coefficients of the samples, dmu = X a
+    a = labels / n_samples
+    # Within class centering, X_c = X C
+    within = np.kron(np.eye(2), np.full((n_samples, n_samples),
+                                        1 / n_samples))
+    center = eye - within
+    gram_a = gram @ a
+    dmu_sq = gram_a @ a
+
+    # d' of the projections w'x with w = dmu
+    proj = gram_a
+    mean_diff = (proj[:, :n_samples].mean(axis=1) -
+                 proj[:, n_samples:].mean(axis=1))
+    pooled_var = (proj[:, :n_samples].var(axis=1, ddof=1) +
+                  proj[:, n_samples:].var(axis=1, ddof=1)) / 2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        d_prime = mean_diff / np.sqrt(pooled_var)
+
+    # Fisher with Woodbury, S_w = X_c X_c' / m
+    gram_c = center @ gram @ center
+    lam = shrinkage * np.trace(gram_c, axis1=1, axis2=2) / (m * n_features)
+    centered_a = center @ gram_a[..., None]
+    solved = np.linalg.solve(gram_c + (m * lam)[:, None, None] * eye,
+                             centered_a)
+    quad = (dmu_sq - (centered_a * solved).sum(axis=(1, 2))) / lam
+    fisher = np.sqrt(np.maximum(quad, 0))
+
+    # Ridge classifier on samples centered on the pair mean
+    pair_center = eye - 1 / m
+    gram_p = pair_center @ gram @ pair_center
+    penalty = ridge * np.trace(gram_p, axis1=1, axis2=2) / m
+    alpha = np.linalg.solve(gram_p + penalty[:, None, None] * eye,
+                            np.broadcast_to(labels, (len(pairs), m))[..., None])
+    decision = (gram_p @ alpha)[..., 0]
+    w_norm = np.sqrt((alpha[..., 0] * decision).sum(axis=1))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        margin = (labels * decision).min(axis=1) / w_norm
+
+    return {'pairs': pairs, 'fisher': fisher, 'margin': margin,
+            'd_prime': d_prime}
+
+
+def speed_correlation(measures, speed):
+    """
+    Spearman correlation of separability measures with learning speed.
+
+    Parameters
+    ----------
+    measures : dict
+        Output of separability or arrays of each measure, one value per
+        pair.
+    speed : numpy array
+        Perceptron learning speed 1 / th_cross of the same pairs.
+
+    Returns
+    -------
+    dict
+        (rho, p) of each measure.
+    """
+    speed = np.asarray(speed, dtype=float)
+    result = {}
+    for name, values in measures.items():
+        if name == 'pairs':
+            continue
+        valid = np.isfinite(values) & np.isfinite(speed)
+        result[name] = tuple(scipy.stats.spearmanr(values[valid],
+                                                   speed[valid]))
+    return result
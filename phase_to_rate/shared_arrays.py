@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Read only numpy arrays shared by worker processes without copies.
+
+The main process publishes code tensors or flat spike buffers once with
+SharedArrays, workers attach to them by the picklable spec and get
+read only views of the same memory. Memory use does not grow with the
+number of workers. The publishing process owns the memory and frees it
+when the SharedArrays is closed, at the latest when it exits.
+
+    with SharedArrays({'rate_code': rate_code}) as shared:
+        with multiprocessing.Pool(initializer=init_worker,
+                                  initargs=(shared.spec,)) as pool:
+            ...
+    # in a worker
+    rate_code = attached['rate_code']
+"""
+
+from multiprocessing import resource_tracker, shared_memory
+import sys
+import warnings
+import weakref
+import numpy as np
+
+
+def _unlink(blocks):
+    for block in blocks:
+        try:
+            block.close()
+        except BufferError:
+            # Views are still referenced, the mapping closes with them
+            pass
+        try:
+            block.unlink()
+        except FileNotFoundError:
+            pass
+
+
+class SharedArrays:
+    """
+    Named numpy arrays copied once into shared memory.
+
+    Parameters
+    ----------
+    arrays : dict
+        Arrays by name.
+    """
+
+    def __init__(self, arrays):
+        self._blocks = []
+        self.spec = {}
+        self.arrays = {}
+        for name, array in arrays.items():
+            array = np.ascontiguousarray(array)
+            block = shared_memory.SharedMemory(create=True,
+                                               size=max(array.nbytes, 1))
+            self._blocks.append(block)
+            view = np.ndarray(array.shape, dtype=array.dtype,
+                              buffer=block.buf)
+            view[...] = array
+            view.flags.writeable = False
+            self.arrays[name] = view
+            self.spec[name] = (block.name, array.shape, array.dtype.str)
+        # Frees the memory even if close is never called
+        self._finalizer = weakref.finalize(self, _unlink, self._blocks)
+
+    def __getitem__(self, name):
+        return self.arrays[name]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        """Free the shared memory, views of it become invalid."""
+        self.arrays = {}
+        self._finalizer()
+
+
+def _open(name):
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+    # Only the publishing process may unlink the memory, a tracked block
+    # would be freed by the resource tracker when the worker exits
+    register = resource_tracker.register
+    resource_tracker.register = lambda name, rtype: None
+    try:
+        return shared_memory.SharedMemory(name=name)
+    finally:
+        resource_tracker.register = register
+
+
+attached = {}
+_attached_blocks = []
+
+
+def attach(spec, as_torch=False):
+    """
+    Read only views of arrays published by SharedArrays.
+
+    The views stay valid until detach is called or the owner closes the
+    SharedArrays.
+
+    Parameters
+    ----------
+    spec : dict
+        SharedArrays.spec of the publishing process.
+    as_torch : bool
+        Return torch tensors sharing the memory instead of numpy arrays.
+        They must not be written to. The default is False.
+
+    Returns
+    -------
+    dict
+        Views by name.
+    """
+    views = {}
+    for name, (block_name, shape, dtype) in spec.items():
+        block = _open(block_name)
+        _attached_blocks.append(block)
+        view = np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf)
+        view.flags.writeable = False
+        if as_torch:
+            import torch
+            with warnings.catch_warnings():
+                # torch warns that it cannot protect read only memory
+                warnings.simplefilter('ignore', UserWarning)
+                view = torch.from_numpy(view)
+        views[name] = view
+    return views
+
+
+def init_worker(spec, as_torch=False):
+    """Pool initializer that attaches to spec, the views are in attached."""
+    attached.update(attach(spec, as_torch=as_torch))
+
+
+def detach():
+    """Drop the views of this process and close its handles."""
+    attached.clear()
+    while _attached_blocks:
+        block = _attached_blocks.pop()
+        try:
+            block.close()
+        except BufferError:
+            # A view is still referenced, the handle closes with it
+            pass
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Shared per-spike index of theta cycle, phase and time bin.
+
+SpikeTrains is a list of spike time arrays, one per cell, that builds a flat
+buffer of all its spikes on first use. Theta cycle ids, phases and time bin
+ids of every spike are computed once per period and cached on the object,
+so analyses that share spike data reduce to array lookups and bincounts.
+A period can also be a ThetaReference with variable cycle lengths.
+"""
+
+from phase_to_rate.theta import theta_reference
+import numpy as np
+
+
+def flatten_trains(spike_trains):
+    """
+    Flatten a list of spike trains into a flat spike buffer.
+
+    Parameters
+    ----------
+    spike_trains : list
+        List of spike time arrays.
+
+    Returns
+    -------
+    times : numpy array
+        Spike times of all trains. [n_spikes]
+    trains : numpy array
+        Index of the spike train each spike belongs to. [n_spikes]
+    """
+    lengths = np.array([len(x) for x in spike_trains], dtype=int)
+    if lengths.sum() == 0:
+        return np.empty(0), np.empty(0, dtype=int)
+    times = np.concatenate([np.asarray(x, dtype=float)
+                            for x in spike_trains])
+    trains = np.repeat(np.arange(len(spike_trains)), lengths)
+    return times, trains
+
+
+class SpikeTrains(list):
+    """
+    Spike times of a cell population with a lazily built spike index.
+
+    Behaves like the list of per-cell spike time arrays it wraps. The index
+    is cached on first use and assumes the spike times are not modified
+    afterwards.
+
+    Parameters
+    ----------
+    spike_trains : list
+        Spike time arrays, one per cell.
+    """
+
+    def __init__(self, spike_trains=()):
+        super().__init__(spike_trains)
+        self._flat = None
+        self._cycles = {}
+        self._phases = {}
+
+    def _flatten(self):
+        if self._flat is None:
+            self._flat = flatten_trains(self)
+        return self._flat
+
+    @property
+    def times(self):
+        """Spike times of all cells. [n_spikes]"""
+        return self._flatten()[0]
+
+    @property
+    def cells(self):
+        """Cell index of each spike. [n_spikes]"""
+        return self._flatten()[1]
+
+    def _cycle_fraction(self, period):
+        if period not in self._cycles:
+            self._cycles[period] = theta_reference(period).assign(self.times)
+        return self._cycles[period]
+
+    def cycle(self, period=100):
+        """Index of the cycle each spike falls into, period is a cycle
+        length or a ThetaReference.
+
+        With the time bin size as period these are the time bin ids."""
+        return self._cycle_fraction(period)[0]
+
+    def cycle_fraction(self, period=100):
+        """Position of each spike within its cycle in [0, 1), nan for
+        spikes outside the cycles of a ThetaReference."""
+        return self._cycle_fraction(period)[1]
+
+    def phase(self, period=100):
+        """Phase of each spike within its cycle in radians."""
+        if period not in self._phases:
+            self._phases[period] = self.cycle_fraction(period) * 2 * np.pi
+        return self._phases[period]
+
+    def on_edge(self, period=100):
+        """True for spikes exactly at a cycle start."""
+        return self.cycle_fraction(period) == 0
+
+
+def spike_index(spike_trains):
+    """
+    Return spike_trains as SpikeTrains to share its cached index.
+
+    Parameters
+    ----------
+    spike_trains : list or SpikeTrains
+        Spike time arrays, one per cell.
+
+    Returns
+    -------
+    SpikeTrains
+        The input itself if it already is SpikeTrains.
+    """
+    if isinstance(spike_trains, SpikeTrains):
+        return spike_trains
+    return SpikeTrains(spike_trains)
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Batched surrogate significance testing for information measures.
+
+Spike trains are kept in one flat buffer of spike times with a train id per
+spike. Surrogates are index transforms over this buffer, so a chunk of
+surrogates is a single (n_surrogates, n_spikes) array and the metric
+evaluates all of them at once. Chunks are spread over a process pool.
+"""
+
+from phase_to_rate.spike_index import flatten_trains
+from phase_to_rate.theta import theta_reference
+import multiprocessing
+import numpy as np
+
+
+def circular_shift(times, trains, n_trains, n_surrogates, dur_ms,
+                   random_state):
+    """
+    Circularly shift every spike train by its own random offset.
+
+    Parameters
+    ----------
+    times : numpy array
+        Flat spike times. [n_spikes]
+    trains : numpy array
+        Train index of each spike. [n_spikes]
+    n_trains : int
+        Number of spike trains.
+    n_surrogates : int
+        Number of surrogates to draw.
+    dur_ms : float
+        Duration of the spike trains, the period of the shift.
+    random_state : numpy.random.RandomState
+        Source of the random offsets.
+
+    Returns
+    -------
+    numpy array
+        Surrogate spike times. [n_surrogates, n_spikes]
+    """
+    offsets = random_state.uniform(0, dur_ms, size=(n_surrogates, n_trains))
+    return (times[None, :] + offsets[:, trains]) % dur_ms
+
+
+def phase_shuffle(times, n_surrogates, theta_bin_size, random_state):
+    """
+    Redraw the phase of every spike uniformly within its theta cycle.
+
+    Spike counts per theta cycle are preserved, phase information is not.
+    Spikes outside the cycles of a ThetaReference are left in place.
+
+    Parameters
+    ----------
+    times : numpy array
+        Flat spike times. [n_spikes]
+    n_surrogates : int
+        Number of surrogates to draw.
+    theta_bin_size : float or ThetaReference
+        Theta period in ms or theta reference.
+    random_state : numpy.random.RandomState
+        Source of the random phases.
+
+    Returns
+    -------
+    numpy array
+        Surrogate spike times. [n_surrogates, n_spikes]
+    """
+    theta = theta_reference(theta_bin_size)
+    cycle, fraction = theta.assign(times)
+    phases = random_state.uniform(0, 1, size=(n_surrogates, times.size))
+    shuffled = theta.time(cycle[None, :], phases)
+    return np.where(np.isfinite(fraction)[None, :], shuffled, times[None, :])
+
+
+def _surrogates(method, times, trains, n_trains, n_surrogates, period,
+                random_state):
+    if method == 'shift':
+        return circular_shift(times, trains, n_trains, n_surrogates, period,
+                              random_state)
+    elif method == 'phase':
+        return phase_shuffle(times, n_surrogates, period, random_state)
+    else:
+        raise ValueError("method must be 'shift' or 'phase'")
+
+
+_worker = {}
+
+
+def _init_worker(metric, times, trains, n_trains, method, period):
+    _worker.update(metric=metric, times=times, trains=trains,
+                   n_trains=n_trains, method=method, period=period)
+
+
+def _run_chunk(task):
+    n_surrogates, seed = task
+    random_state = np.random.RandomState(list(seed))
+    surr_times = _surrogates(_worker['method'], _worker['times'],
+                             _worker['trains'], _worker['n_trains'],
+                             n_surrogates, _worker['period'], random_state)
+    return _worker['metric'](surr_times)
+
+
+def surrogate_test(metric, times, trains, n_trains, method='shift',
+                   period=2000, n_surrogates=1000, chunk_size=50,
+                   n_processes=1, seed=0):
+    """
+    Per-cell significance of a metric against a surrogate distribution.
+
+    Parameters
+    ----------
+    metric : callable
+        Picklable function mapping surrogate spike times
+        [n_chunk, n_spikes] to per-cell values [n_chunk, n_cell].
+    times : numpy array
+        Flat spike times. [n_spikes]
+    trains : numpy array
+        Train index of each spike. [n_spikes]
+    n_trains : int
+        Number of spike trains.
+    method : str
+        'shift' for circular shifts of each train by up to period,
+        'phase' for shuffling phases within theta cycles of length period.
+        The default is 'shift'.
+    period : float or ThetaReference
+        Duration of the trains for 'shift' or the theta period or
+        reference for 'phase' in ms. The default is 2000.
+    n_surrogates : int
+        Number of surrogates per cell. The default is 1000.
+    chunk_size : int
+        Surrogates evaluated at once. Memory use scales with
+        chunk_size * n_spikes. The default is 50.
+    n_processes : int
+        Number of worker processes. The default is 1.
+    seed : int
+        Seed of the surrogates, results do not depend on n_processes.
+        The default is 0.
+
+    Returns
+    -------
+    observed : numpy array
+        Metric of the original spike trains. [n_cell]
+    p_values : numpy array
+        Fraction of surrogates reaching the observed value,
+        (1 + n_greater_equal) / (1 + n_surrogates). [n_cell]
+    z_scores : numpy array
+        Observed value in standard deviations of the surrogate
+        distribution, nan where the surrogates have no variance. [n_cell]
+    """
+    times = np.asarray(times, dtype=float)
+    trains = np.asarray(trains, dtype=int)
+    observed = metric(times[None, :])[0]
+
+    n_chunks = int(np.ceil(n_surrogates / chunk_size))
+    sizes = [chunk_size] * (n_chunks - 1)
+    sizes.append(n_surrogates - chunk_size * (n_chunks - 1))
+    tasks = [(size, (seed, idx)) for idx, size in enumerate(sizes)]
+
+    initargs = (metric, times, trains, n_trains, method, period)
+    if n_processes == 1:
+        _init_worker(*initargs)
+        null = [_run_chunk(task) for task in tasks]
+    else:
+        with multiprocessing.Pool(n_processes, initializer=_init_worker,
+                                  initargs=initargs) as pool:
+            null = pool.map(_run_chunk, tasks)
+    null = np.concatenate(null, axis=0)
+
+    p_values = ((null >= observed[None, :]).sum(axis=0) + 1) / (
+        n_surrogates + 1)
+    null_std = null.std(axis=0)
+    z_scores = np.full(observed.shape, np.nan)
+    varies = null_std > 0
+    z_scores[varies] = ((observed[varies] - null.mean(axis=0)[varies]) /
+                        null_std[varies])
+    return observed, p_values, z_scores
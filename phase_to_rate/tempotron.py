@@ -0,0 +1,524 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Event driven tempotrons on flat spike buffers.
+
+The potential of a tempotron is V(t) = V_rest + sum_i w_i sum_spikes
+K(t - t_spike) with the PSP kernel K(t) = V_0 (exp(-t / tau) -
+exp(-t / tau_s)), normalized to a peak of 1. Each sample is a list of
+spike times per afferent, as in 05_tempotron.py, or a flat sorted list of
+(time, afferent) events. The weight independent kernel terms of a sample
+are computed once, potentials, their maxima and the learning rule then
+only involve the spikes of the sample, never the silent afferents.
+Tempotron trains many runs with their own efficacies at once.
+
+Two rules find the time of the maximum. 'package' is the compute_tmax of
+the tempotron package used by 05_tempotron.py: the candidates are the
+stationary points t_k + s_k of the potential after each spike, not
+restricted to the interval before the next spike, or the spike itself if
+there is none, and tmax is the candidate with the highest potential. The
+package sums exp(t / tau_s) over the whole trial, which overflows from
+the first spike after about 709 tau_s ms, 1773 ms for tau_s = 2.5. The
+candidates from there on are infinite or NaN times with the potential
+V_rest, so a maximum later in the trial is missed. 'package' reproduces
+this. 'exact' restricts the stationary points to their interval and
+keeps all of them finite, which gives the true maximum, at least as high
+as that of 'package'.
+"""
+
+import numpy as np
+
+
+def kernel_norm(tau, tau_s):
+    """V_0 that normalizes the peak of the PSP kernel to 1."""
+    t_peak = tau * tau_s * np.log(tau / tau_s) / (tau - tau_s)
+    return 1 / (np.exp(-t_peak / tau) - np.exp(-t_peak / tau_s))
+
+
+def flat_events(spike_times):
+    """
+    Spikes of one sample as a flat list sorted by time.
+
+    Parameters
+    ----------
+    spike_times : list
+        Spike times of each afferent.
+
+    Returns
+    -------
+    times : numpy array
+        Spike times in order of time.
+    afferents : numpy array
+        Afferent of each spike.
+    """
+    counts = [len(x) for x in spike_times]
+    afferents = np.repeat(np.arange(len(spike_times)), counts)
+    times = (np.concatenate([np.asarray(x, dtype=float)
+                             for x in spike_times])
+             if afferents.size else np.zeros(0))
+    order = np.argsort(times, kind='stable')
+    return times[order], afferents[order]
+
+
+_RULES = ('package', 'exact')
+
+# Largest argument of exp in float64, the package sums exp(t / tau_s)
+_EXP_LIMIT = np.log(np.finfo(float).max)
+
+
+def _check_rule(rule):
+    if rule not in _RULES:
+        raise ValueError(f"rule must be one of {_RULES}")
+
+
+# Spikes are grouped into blocks of this many time constants, exponentials
+# of times relative to the start of a block stay finite
+_BLOCK = 300.0
+
+
+class SampleEvents:
+    """
+    Sorted spikes of one sample with their weight independent kernel terms.
+
+    Just after spike k the potential without V_rest is A_k - B_k with
+    A_k = V_0 sum_{j <= k} w_j exp(-(t_k - t_j) / tau) and B_k the same
+    with tau_s. Within a block starting at T, A_k is exp(-(t_k - T) / tau)
+    times the cumulative sum of w_j exp((t_j - T) / tau). The exponentials
+    are computed once, potentials for new efficacies only need a
+    cumulative sum over the spikes.
+
+    Parameters
+    ----------
+    times : numpy array
+        Spike times in order of time.
+    afferents : numpy array
+        Afferent of each spike.
+    tau : float
+        Membrane time constant.
+    tau_s : float
+        Synaptic time constant.
+    """
+
+    def __init__(self, times, afferents, tau, tau_s):
+        self.times = np.asarray(times, dtype=float)
+        self.afferents = np.asarray(afferents, dtype=int)
+        self.tau, self.tau_s = tau, tau_s
+        self.norm = kernel_norm(tau, tau_s)
+        self._taus = np.array([tau, tau_s])[:, None]
+
+        block_len = _BLOCK * min(tau, tau_s)
+        block = np.floor(self.times / block_len)
+        edges = np.flatnonzero(np.diff(block)) + 1
+        bounds = (np.concatenate(([0], edges, [len(self.times)]))
+                  if len(self.times) else np.zeros(1, dtype=int))
+        starts = block[bounds[:-1]] * block_len
+        self._blocks = [(slice(bounds[idx], bounds[idx + 1]), starts[idx])
+                        for idx in range(len(bounds) - 1)]
+        relative = self.times - np.repeat(starts, np.diff(bounds))
+        self._growth = np.exp(relative / self._taus)
+        self._decay = np.exp(-relative / self._taus)
+        self._interval = np.append(np.diff(self.times), np.inf)
+
+    @classmethod
+    def from_spike_times(cls, spike_times, tau, tau_s):
+        """SampleEvents of a list of spike times per afferent."""
+        return cls(*flat_events(spike_times), tau, tau_s)
+
+    def __len__(self):
+        return len(self.times)
+
+    def states(self, weights):
+        """
+        A and B just after every spike.
+
+        Parameters
+        ----------
+        weights : numpy array
+            Efficacies of each run. [n_runs, n_afferents]
+
+        Returns
+        -------
+        numpy array
+            A and B. [2, n_runs, n_spikes]
+        """
+        w = weights[:, self.afferents]
+        state = np.empty((2,) + w.shape)
+        last, last_time = None, None
+        for block, start in self._blocks:
+            total = np.cumsum(w[None, :, block] *
+                              self._growth[:, None, block], axis=2)
+            if last is not None:
+                # Everything before the block, decayed to its start
+                total += (last * np.exp(-(start - last_time) /
+                                        self._taus))[..., None]
+            state[:, :, block] = total * self._decay[:, None, block]
+            last = state[:, :, block.stop - 1]
+            last_time = self.times[block.stop - 1]
+        return self.norm * state
+
+    def maximum(self, weights, rule='package'):
+        """
+        Maximum of the potential without V_rest for each run.
+
+        With 'exact' the maximum is at a spike or at the stationary point
+        of the interval after it. With 'package' the candidates are the
+        stationary points after each spike wherever they lie, see the
+        module docstring.
+
+        Parameters
+        ----------
+        weights : numpy array
+            Efficacies of each run. [n_runs, n_afferents]
+        rule : str
+            'package' or 'exact'. The default is 'package'.
+
+        Returns
+        -------
+        vmax : numpy array
+            Maximum of the summed kernels. [n_runs]
+        tmax : numpy array
+            Time of the maximum. [n_runs]
+        index : numpy array
+            Last spike at or before tmax, -1 if there is none. [n_runs]
+        """
+        _check_rule(rule)
+        n_runs = weights.shape[0]
+        if not len(self.times):
+            return np.zeros(n_runs), np.zeros(n_runs), np.full(n_runs, -1)
+        a, b = self.states(weights)
+        tau, tau_s = self.tau, self.tau_s
+        with np.errstate(divide='ignore', invalid='ignore'):
+            s = (tau * tau_s / (tau - tau_s) *
+                 np.log((b * tau) / (a * tau_s)))
+        runs = np.arange(n_runs)
+        if rule == 'exact':
+            s = np.where(np.isfinite(s) & (s > 0) & (s < self._interval),
+                         s, 0)
+            v = a * np.exp(-s / tau) - b * np.exp(-s / tau_s)
+            index = v.argmax(axis=1)
+            return v[runs, index], self.times[index] + s[runs, index], index
+
+        # Candidates anywhere in time, evaluated with the spikes before
+        # them, a spike at the candidate itself adds K(0) = 0
+        candidates = self.times + np.where(np.isfinite(s), s, 0)
+        before = np.searchsorted(self.times, candidates, side='left') - 1
+        last = np.maximum(before, 0)
+        lag = candidates - self.times[last]
+        v = (np.take_along_axis(a, last, axis=1) * np.exp(-lag / tau) -
+             np.take_along_axis(b, last, axis=1) * np.exp(-lag / tau_s))
+        v = np.where(before >= 0, v, 0)
+        # Candidates of the package from its first overflow on
+        overflow = np.cumsum(self.times / min(tau, tau_s) > _EXP_LIMIT) > 0
+        v[:, overflow] = 0
+        candidates[:, overflow] = np.inf
+        best = v.argmax(axis=1)
+        return (v[runs, best], candidates[runs, best],
+                before[runs, best])
+
+    def kernels_before(self, tmax, index):
+        """
+        Kernel at tmax of every spike up to the last one before it.
+
+        Parameters
+        ----------
+        tmax : numpy array
+            Time of each run. [n_runs]
+        index : numpy array
+            Last spike at or before tmax of each run, see maximum. [n_runs]
+
+        Returns
+        -------
+        numpy array
+            dV(tmax) / dw of each of the first index.max() + 1 spikes,
+            zero after tmax. [n_runs, index.max() + 1]
+        """
+        times = self.times[:index.max() + 1]
+        lag = tmax[:, None] - times[None, :]
+        lag = np.where(np.arange(len(times))[None, :] <= index[:, None],
+                       lag, 0)
+        return self.norm * (np.exp(-lag / self.tau) -
+                            np.exp(-lag / self.tau_s))
+
+
+def _sample_events(sample, tau, tau_s):
+    if isinstance(sample, SampleEvents):
+        return sample
+    if isinstance(sample, tuple) and len(sample) == 2:
+        return SampleEvents(*sample, tau, tau_s)
+    return SampleEvents.from_spike_times(sample, tau, tau_s)
+
+
+def max_potential(samples, efficacies, tau=10.0, tau_s=2.5, V_rest=0.0,
+                  rule='package'):
+    """
+    Maximum of the membrane potential and its time for all samples.
+
+    Between two spikes the potential is A exp(-s / tau) - B exp(-s /
+    tau_s), A and B follow from cumulative sums over the sorted spikes,
+    see SampleEvents. 'package' takes the maximum over the candidates of
+    compute_tmax of the tempotron package, 'exact' the true maximum.
+
+    Parameters
+    ----------
+    samples : list
+        Spike times of each afferent of each sample, (times, afferents)
+        tuples of flat_events or SampleEvents.
+    efficacies : numpy array
+        Synaptic efficacy of each afferent.
+    tau : float
+        Membrane time constant. The default is 10.0.
+    tau_s : float
+        Synaptic time constant. The default is 2.5.
+    V_rest : float
+        Resting potential. The default is 0.0.
+    rule : str
+        'package' or 'exact', see the module docstring. The default is
+        'package'.
+
+    Returns
+    -------
+    vmax : numpy array
+        Maximum potential of each sample. [n_samples]
+    tmax : numpy array
+        Time of the maximum. [n_samples]
+    """
+    weights = np.asarray(efficacies, dtype=float)[None, :]
+    vmax, tmax = np.empty(len(samples)), np.empty(len(samples))
+    for idx, sample in enumerate(samples):
+        sample_vmax, sample_tmax, _ = _sample_events(
+            sample, tau, tau_s).maximum(weights, rule=rule)
+        vmax[idx], tmax[idx] = sample_vmax[0] + V_rest, sample_tmax[0]
+    return vmax, tmax
+
+
+def calibrate_threshold(samples, efficacies, tau=10.0, tau_s=2.5,
+                        V_rest=0.0, rule='package'):
+    """Threshold at the mean maximum potential of the samples."""
+    vmax, _ = max_potential(samples, efficacies, tau=tau, tau_s=tau_s,
+                            V_rest=V_rest, rule=rule)
+    return vmax.mean()
+
+
+def kernel_responses(samples, n_afferents, time_grid, tau=10.0, tau_s=2.5):
+    """
+    PSP kernel response of every afferent on a shared time grid.
+
+    The sorted spikes are added to the first grid point at or after them
+    and both exponentials are propagated from grid point to grid point,
+    which is exact for any grid spacing.
+
+    Parameters
+    ----------
+    samples : list
+        Spike times of each afferent of each sample, (times, afferents)
+        tuples of flat_events or SampleEvents.
+    n_afferents : int
+        Number of afferents.
+    time_grid : numpy array
+        Increasing times to evaluate the responses at.
+    tau : float
+        Membrane time constant. The default is 10.0.
+    tau_s : float
+        Synaptic time constant. The default is 2.5.
+
+    Returns
+    -------
+    numpy array
+        Summed kernels of each afferent. [n_samples, n_times, n_afferents]
+    """
+    time_grid = np.asarray(time_grid, dtype=float)
+    n_times = len(time_grid)
+    arrivals = np.zeros((2, len(samples), n_times, n_afferents))
+    for idx, spike_times in enumerate(samples):
+        events = _sample_events(spike_times, tau, tau_s)
+        times, afferents = events.times, events.afferents
+        step = np.searchsorted(time_grid, times, side='left')
+        keep = step < n_times
+        step, times, afferents = step[keep], times[keep], afferents[keep]
+        lag = time_grid[step] - times
+        np.add.at(arrivals[0, idx], (step, afferents), np.exp(-lag / tau))
+        np.add.at(arrivals[1, idx], (step, afferents), np.exp(-lag / tau_s))
+
+    decay = np.exp(-np.diff(time_grid)[:, None, None] /
+                   np.array([tau, tau_s])[:, None, None, None])
+    state = arrivals
+    for k in range(1, n_times):
+        state[:, :, k] += state[:, :, k - 1] * decay[:, k - 1]
+    return kernel_norm(tau, tau_s) * (state[0] - state[1])
+
+
+def membrane_potentials(responses, efficacies, V_rest=0.0):
+    """
+    Membrane potentials from kernel responses.
+
+    Parameters
+    ----------
+    responses : numpy array
+        Output of kernel_responses. [n_samples, n_times, n_afferents]
+    efficacies : numpy array
+        Synaptic efficacy of each afferent.
+    V_rest : float
+        Resting potential. The default is 0.0.
+
+    Returns
+    -------
+    numpy array
+        Potential of each sample at each time. [n_samples, n_times]
+    """
+    return responses @ np.asarray(efficacies, dtype=float) + V_rest
+
+
+class Tempotron:
+    """
+    Tempotrons of one or many runs trained with the tempotron rule.
+
+    A sample is classified True if the maximum of its potential reaches
+    the threshold. After each misclassified sample the efficacies change
+    by learning_rate * dV(tmax) / dw, positive if the sample is True and
+    negative if it is False. dV(tmax) / dw is nonzero only for afferents
+    that spiked before tmax, only these are updated. Samples are presented
+    one by one in order, the runs in parallel.
+
+    Parameters
+    ----------
+    V_rest : float
+        Resting potential.
+    tau : float
+        Membrane time constant.
+    tau_s : float
+        Synaptic time constant.
+    efficacies : numpy array
+        Synaptic efficacies, one row per run. [n_afferents] or
+        [n_runs, n_afferents]
+    threshold : float or numpy array
+        Firing threshold, one per run or shared.
+    tmax_rule : str
+        Time of the maximum potential, 'package' or 'exact', see the
+        module docstring. The default is 'package'.
+    """
+
+    def __init__(self, V_rest, tau, tau_s, efficacies, threshold,
+                 tmax_rule='package'):
+        _check_rule(tmax_rule)
+        self.V_rest = V_rest
+        self.tau = tau
+        self.tau_s = tau_s
+        self.efficacies = np.array(efficacies, dtype=float)
+        self.threshold = threshold
+        self.tmax_rule = tmax_rule
+
+    def _weights(self):
+        return np.atleast_2d(self.efficacies)
+
+    def _unbatch(self, values):
+        return values[..., 0, :] if self.efficacies.ndim == 1 else values
+
+    def prepare(self, io_pairs):
+        """
+        SampleEvents and labels of the samples.
+
+        Parameters
+        ----------
+        io_pairs : list
+            (sample, label) pairs. A sample is a list of spike times per
+            afferent, (times, afferents) of flat_events or SampleEvents.
+
+        Returns
+        -------
+        samples : list
+            SampleEvents of each sample.
+        labels : numpy array
+            Label of each sample.
+        """
+        samples = [_sample_events(sample, self.tau, self.tau_s)
+                   for sample, _ in io_pairs]
+        labels = np.array([bool(label) for _, label in io_pairs])
+        return samples, labels
+
+    def _cost(self, vmax, label):
+        """Classification and cost |V_thr - V(tmax)| of misclassified."""
+        fired = vmax + self.V_rest >= self.threshold
+        wrong = fired != label
+        return wrong, np.where(wrong, np.abs(self.threshold -
+                                             (vmax + self.V_rest)), 0)
+
+    def _evaluate(self, samples, labels, weights):
+        """Accuracy and summed cost of each run. [2, n_runs]"""
+        result = np.zeros((2, weights.shape[0]))
+        for sample, label in zip(samples, labels):
+            wrong, cost = self._cost(
+                sample.maximum(weights, rule=self.tmax_rule)[0], label)
+            result[0] += ~wrong
+            result[1] += cost
+        result[0] /= len(samples)
+        return result
+
+    def accuracy(self, io_pairs):
+        """Fraction of correctly classified samples of each run."""
+        samples, labels = self.prepare(io_pairs)
+        result = self._evaluate(samples, labels, self._weights())[0]
+        return result[0] if self.efficacies.ndim == 1 else result
+
+    def train(self, io_pairs, epochs, learning_rate=1e-3,
+              curves='presented'):
+        """
+        Train on the samples with the tempotron rule.
+
+        The loss is the summed cost |V_thr - V(tmax)| of the misclassified
+        samples. Whether the train of the tempotron package records its
+        curves as the samples are presented or after each epoch, and with
+        this loss, is not verified. utility/compare_tempotron.py compares
+        both with the package.
+
+        Parameters
+        ----------
+        io_pairs : list
+            (sample, label) pairs, see prepare. Prepare them once to
+            train repeatedly without recomputing the kernel terms.
+        epochs : int
+            Number of passes over the samples.
+        learning_rate : float or numpy array
+            Learning rate, one per run or shared. The default is 1e-3.
+        curves : str
+            'presented' records accuracy and loss of the samples as they
+            are presented, each before its own update. 'epoch' records
+            them for all samples with the efficacies after the epoch,
+            which takes another pass over the samples. The default is
+            'presented'.
+
+        Returns
+        -------
+        numpy array
+            Accuracy and loss of each epoch. [2, epochs] or
+            [2, n_runs, epochs]
+        """
+        if curves not in ('presented', 'epoch'):
+            raise ValueError("curves must be 'presented' or 'epoch'")
+        samples, labels = self.prepare(io_pairs)
+        # A view of the efficacies, updated in place
+        weights = self._weights()
+        n_runs = weights.shape[0]
+        learning_rate = np.broadcast_to(
+            np.asarray(learning_rate, dtype=float), (n_runs,))
+        result = np.zeros((2, n_runs, epochs))
+        for epoch in range(epochs):
+            for sample, label in zip(samples, labels):
+                vmax, tmax, index = sample.maximum(weights,
+                                                   rule=self.tmax_rule)
+                wrong, cost = self._cost(vmax, label)
+                result[0, :, epoch] += ~wrong
+                result[1, :, epoch] += cost
+                runs = np.flatnonzero(wrong & (index >= 0))
+                if not runs.size:
+                    continue
+                kernels = sample.kernels_before(tmax[runs], index[runs])
+                rows, spikes = np.nonzero(kernels)
+                step = learning_rate[runs] * (1 if label else -1)
+                np.add.at(weights, (runs[rows], sample.afferents[spikes]),
+                          step[rows] * kernels[rows, spikes])
+            if curves == 'epoch':
+                result[:, :, epoch] = self._evaluate(samples, labels,
+                                                     weights)
+            else:
+                result[0, :, epoch] /= len(samples)
+        return self._unbatch(result)
@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tempotron runs of many grid seeds, shufflings, trajectories and cell types.
+
+The runs of a sweep are executed on a bounded process pool. Their results
+come back to the main process, the only process that writes to the
+results database. It inserts them in batches with parameterized
+statements, the database is in WAL mode so that it can be read while the
+sweep runs. Learning curves are stored in the same database as arrays
+indexed by the array id of their run, load_learning_curve reads them.
+Runs already in the database are skipped, so an interrupted sweep can be
+restarted.
+
+DEFAULT_PARAMETERS trains on the first 200 cells of each population, as
+05_tempotron.py does. figure4.py reads the runs with n_cells=2000 and
+tempotron seeds 91 and 95 of both networks, pass those parameters to
+produce its data.
+"""
+
+from collections import namedtuple
+import itertools
+import multiprocessing
+import os
+import shelve
+import sqlite3
+import uuid
+import numpy as np
+from phase_to_rate import tempotron as event_tempotron
+
+
+TempotronRun = namedtuple(
+    'TempotronRun',
+    ['grid_seed', 'shuffling', 'trajectory_1', 'trajectory_2', 'cell_type'])
+
+DEFAULT_PARAMETERS = {
+    'seed': 91,
+    'epochs': 200,
+    'total_time': 2000.0,
+    'V_rest': 0.0,
+    'learning_rate': 1e-3,
+    'n_cells': 200,
+    'tau': 10.0,
+    'tau_s': 2.5,
+    'duration': 2000,
+    'network': 'full',
+    # 'package' trains with tempotron.main.Tempotron, 'phase_to_rate' with
+    # the event driven phase_to_rate.tempotron.Tempotron. The tables do not
+    # record the engine, keep the results of each in their own database.
+    'engine': 'package',
+}
+
+_COLUMNS = (
+    'tempotron_seed', 'epochs', 'time', 'Vrest', 'tau', 'tau_s', 'threshold',
+    'learning_rate', 'n_cells', 'trajectory_one', 'trajectory_two',
+    'pre_accuracy', 'trained_accuracy', 'pre_loss', 'trained_loss',
+    'delta_loss', 'distance', 'grid_seed', 'duration', 'shuffling',
+    'network', 'cell_type', 'array_id')
+
+_INSERT_RUN = (f"INSERT INTO tempotron_run VALUES "
+               f"({', '.join('?' * len(_COLUMNS))})")
+
+_INSERT_CURVE = "INSERT INTO learning_curve VALUES (?, ?, ?, ?)"
+
+
+def create_tables(con):
+    """Create the run and learning curve tables if they do not exist."""
+    con.execute('''CREATE TABLE IF NOT EXISTS tempotron_run
+            (tempotron_seed INT, epochs INT, time FLOAT, Vrest FLOAT, tau FLOAT,
+             tau_s FLOAT, threshold FLOAT, learning_rate FLOAT, n_cells INT,
+             trajectory_one FLOAT, trajectory_two, pre_accuracy FLOAT,
+             trained_accuracy FLOAT, pre_loss FLOAT, trained_loss FLOAT,
+             delta_loss FLOAT, distance FLOAT,
+             grid_seed INT, duration FLOAT, shuffling VARCHAR(255),
+             network VARCHAR(255), cell_type VARCHAR(255), array_id VARCHAR(36)
+             )''')
+    con.execute('''CREATE TABLE IF NOT EXISTS learning_curve
+            (array_id VARCHAR(36) PRIMARY KEY, shape VARCHAR(255),
+             dtype VARCHAR(255), data BLOB)''')
+    con.commit()
+
+
+def connect(db_path):
+    """Connection to a results database in WAL mode with the tables."""
+    con = sqlite3.connect(db_path)
+    con.execute('PRAGMA journal_mode=WAL')
+    create_tables(con)
+    return con
+
+
+def load_learning_curve(con, array_id):
+    """
+    Learning curve of a run.
+
+    Parameters
+    ----------
+    con : sqlite3.Connection
+        Connection to the results database.
+    array_id : str
+        array_id of the run.
+
+    Returns
+    -------
+    numpy array
+        Result of Tempotron.train of the run.
+    """
+    row = con.execute(
+        "SELECT shape, dtype, data FROM learning_curve WHERE array_id = ?",
+        (array_id,)).fetchone()
+    if row is None:
+        raise KeyError(array_id)
+    shape, dtype, data = row
+    shape = tuple(int(x) for x in shape.split(',') if x)
+    return np.frombuffer(data, dtype=np.dtype(dtype)).reshape(shape)
+
+
+def sweep_runs(grid_seeds, shufflings=('non-shuffled', 'shuffled'),
+               trajectory_pairs=(('75', '60'),),
+               cell_types=('grid_spikes', 'granule_spikes')):
+    """All combinations of the sweep dimensions as TempotronRuns."""
+    return [TempotronRun(grid_seed, shuffling, traj_1, traj_2, cell_type)
+            for grid_seed, shuffling, (traj_1, traj_2), cell_type
+            in itertools.product(grid_seeds, shufflings, trajectory_pairs,
+                                 cell_types)]
+
+
+def data_path(run, data_dir, parameters):
+    """Shelve of the spikes of a run, as saved by the simulations."""
+    return os.path.join(
+        data_dir, 'tempotron', parameters['network'], 'collective',
+        f"grid-seed_duration_shuffling_tuning_trajs_{run.grid_seed}_"
+        f"{parameters['duration']}_{run.shuffling}_{parameters['network']}_"
+        f"{run.trajectory_1}-{run.trajectory_2}")
+
+
+def _labeled_spikes(run, data_dir, parameters):
+    n_cells = parameters['n_cells']
+    with shelve.open(data_path(run, data_dir, parameters)) as data:
+        spikes = [
+            (np.array(data[traj][run.cell_type][x][:n_cells], dtype=object),
+             label)
+            for traj, label in ((run.trajectory_1, False),
+                                (run.trajectory_2, True))
+            for x in data[traj][run.cell_type]]
+    return np.array(spikes, dtype=object)
+
+
+def _train_package(all_spikes, efficacies, parameters):
+    from tempotron.main import Tempotron
+    tempotron = Tempotron(parameters['V_rest'], parameters['tau'],
+                          parameters['tau_s'], efficacies,
+                          parameters['total_time'], 15, jit_mode=True,
+                          verbose=False)
+
+    # The threshold is the mean maximum potential of the samples
+    tmax = [tempotron.compute_tmax(sts[0]) for sts in all_spikes]
+    vmax = [tempotron.compute_membrane_potential(tmax[idx], sts[0])
+            for idx, sts in enumerate(all_spikes)]
+    tempotron.threshold = np.array(vmax).mean()
+
+    pre_accuracy = tempotron.accuracy(all_spikes)
+    training_result = np.array(tempotron.train(
+        all_spikes, parameters['epochs'],
+        learning_rate=parameters['learning_rate']))
+    trained_accuracy = tempotron.accuracy(all_spikes)
+    return (tempotron.threshold, pre_accuracy, training_result,
+            trained_accuracy)
+
+
+def _train_events(all_spikes, efficacies, parameters):
+    tempotron = event_tempotron.Tempotron(
+        parameters['V_rest'], parameters['tau'], parameters['tau_s'],
+        efficacies, 15)
+    # The kernel terms of the samples are computed once for all epochs
+    samples, labels = tempotron.prepare(all_spikes)
+    io_pairs = list(zip(samples, labels))
+
+    # The threshold is the mean maximum potential of the samples
+    tempotron.threshold = event_tempotron.calibrate_threshold(
+        samples, efficacies, tau=parameters['tau'],
+        tau_s=parameters['tau_s'], V_rest=parameters['V_rest'])
+
+    pre_accuracy = tempotron.accuracy(io_pairs)
+    training_result = tempotron.train(
+        io_pairs, parameters['epochs'],
+        learning_rate=parameters['learning_rate'])
+    trained_accuracy = tempotron.accuracy(io_pairs)
+    return (tempotron.threshold, pre_accuracy, training_result,
+            trained_accuracy)
+
+
+_ENGINES = {'package': _train_package, 'phase_to_rate': _train_events}
+
+
+def _run(run, data_dir, parameters):
+    """Calibrate and train the tempotron of one run."""
+    all_spikes = _labeled_spikes(run, data_dir, parameters)
+
+    np.random.seed(parameters['seed'])
+    efficacies = np.random.rand(parameters['n_cells'])
+    train = _ENGINES[parameters['engine']]
+    threshold, pre_accuracy, training_result, trained_accuracy = train(
+        all_spikes, efficacies, parameters)
+    pre_loss = training_result[1][0]
+    trained_loss = training_result[1][-1]
+
+    array_id = str(uuid.uuid4())
+    row = (parameters['seed'], parameters['epochs'],
+           parameters['total_time'], parameters['V_rest'], parameters['tau'],
+           parameters['tau_s'], threshold,
+           parameters['learning_rate'], parameters['n_cells'],
+           float(run.trajectory_1), float(run.trajectory_2), pre_accuracy,
+           trained_accuracy, pre_loss, trained_loss, pre_loss - trained_loss,
+           float(run.trajectory_1) - float(run.trajectory_2), run.grid_seed,
+           parameters['duration'], run.shuffling, parameters['network'],
+           run.cell_type, array_id)
+    # numpy scalars cannot be bound as SQL parameters
+    row = tuple(x.item() if isinstance(x, np.generic) else x for x in row)
+    return row, training_result
+
+
+def _run_star(args):
+    return _run(*args)
+
+
+def _done(con, parameters):
+    """Runs with the given parameters that are already in the database."""
+    rows = con.execute(
+        "SELECT grid_seed, shuffling, trajectory_one, trajectory_two, "
+        "cell_type FROM tempotron_run WHERE tempotron_seed = ? AND "
+        "epochs = ? AND learning_rate = ? AND n_cells = ? AND tau = ? AND "
+        "tau_s = ? AND network = ?",
+        (parameters['seed'], parameters['epochs'],
+         parameters['learning_rate'], parameters['n_cells'],
+         parameters['tau'], parameters['tau_s'], parameters['network']))
+    return {(grid_seed, shuffling, float(traj_1), float(traj_2), cell_type)
+            for grid_seed, shuffling, traj_1, traj_2, cell_type in rows}
+
+
+def _write(con, results):
+    with con:
+        con.executemany(_INSERT_RUN, [row for row, _ in results])
+        con.executemany(
+            _INSERT_CURVE,
+            [(row[-1], ','.join(str(x) for x in curve.shape),
+              curve.dtype.str, curve.tobytes())
+             for row, curve in results])
+
+
+def run_sweep(runs, db_path, data_dir, parameters=None, n_processes=None,
+              batch_size=20):
+    """
+    Train the tempotrons of all runs in parallel and store the results.
+
+    Parameters
+    ----------
+    runs : list
+        TempotronRun or tuples (grid_seed, shuffling, trajectory_1,
+        trajectory_2, cell_type), see sweep_runs.
+    db_path : str
+        Results database, created if it does not exist.
+    data_dir : str
+        Directory with the 'tempotron' spike shelves.
+    parameters : dict
+        Tempotron parameters, missing ones are taken from
+        DEFAULT_PARAMETERS. The default is None.
+    n_processes : int
+        Number of worker processes. The default is None, one per core.
+    batch_size : int
+        Number of runs inserted per transaction. The default is 20.
+
+    Raises
+    ------
+    ValueError
+        If parameters['engine'] is unknown.
+
+    Returns
+    -------
+    int
+        Number of new runs.
+    """
+    parameters = dict(DEFAULT_PARAMETERS, **(parameters or {}))
+    if parameters['engine'] not in _ENGINES:
+        raise ValueError(f"engine must be one of {sorted(_ENGINES)}")
+    runs = [TempotronRun(*run) for run in runs]
+    con = connect(db_path)
+    try:
+        done = _done(con, parameters)
+        missing = [run for run in dict.fromkeys(runs)
+                   if (run.grid_seed, run.shuffling, float(run.trajectory_1),
+                       float(run.trajectory_2), run.cell_type) not in done]
+        if not missing:
+            return 0
+        if n_processes is None:
+            n_processes = os.cpu_count() or 1
+        n_processes = max(1, min(n_processes, len(missing)))
+
+        batch = []
+        context = multiprocessing.get_context('spawn')
+        try:
+            with context.Pool(n_processes) as pool:
+                tasks = [(run, data_dir, parameters) for run in missing]
+                for result in pool.imap_unordered(_run_star, tasks):
+                    batch.append(result)
+                    if len(batch) >= batch_size:
+                        _write(con, batch)
+                        batch = []
+        finally:
+            # Keep the finished runs if a run fails
+            if batch:
+                _write(con, batch)
+    finally:
+        con.close()
+    return len(missing)
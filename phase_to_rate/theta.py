@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Theta references that assign theta cycles and phases to spikes.
+
+A theta reference is either a fixed period or an array of cycle start
+times, for example extracted from an LFP with ThetaReference.from_lfp.
+Functions that take a theta period also accept a ThetaReference.
+"""
+
+import numpy as np
+import scipy.signal
+
+
+class ThetaReference:
+    """
+    Theta cycles of fixed length or with arbitrary start times.
+
+    Parameters
+    ----------
+    period : float
+        Length of each theta cycle, used if cycle_starts is None.
+        The default is 100.
+    cycle_starts : numpy array
+        Sorted start times of consecutive theta cycles. The last entry
+        only closes the last cycle. The default is None.
+    """
+
+    def __init__(self, period=100, cycle_starts=None):
+        if cycle_starts is None:
+            self.period = period
+            self.cycle_starts = None
+        else:
+            cycle_starts = np.asarray(cycle_starts, dtype=float)
+            if cycle_starts.ndim != 1 or cycle_starts.size < 2:
+                raise ValueError("cycle_starts needs at least two times")
+            if np.any(np.diff(cycle_starts) <= 0):
+                raise ValueError("cycle_starts must be strictly increasing")
+            self.period = None
+            self.cycle_starts = cycle_starts
+
+    @classmethod
+    def from_lfp(cls, lfp, sampling_rate, band=(6, 10), order=3,
+                 t_start_ms=0):
+        """
+        Theta cycles starting at the peaks of the band-passed LFP.
+
+        Peaks are the upward zero crossings of the Hilbert phase,
+        interpolated between samples.
+
+        Parameters
+        ----------
+        lfp : numpy array
+            Single channel LFP.
+        sampling_rate : float
+            Sampling rate of the LFP in Hz.
+        band : tuple
+            Theta band in Hz. The default is (6, 10).
+        order : int
+            Order of the Butterworth band-pass. The default is 3.
+        t_start_ms : float
+            Time of the first sample in ms. The default is 0.
+
+        Returns
+        -------
+        ThetaReference
+        """
+        b, a = scipy.signal.butter(order, band, btype='bandpass',
+                                   fs=sampling_rate)
+        filtered = scipy.signal.filtfilt(b, a, np.asarray(lfp, dtype=float))
+        phase = np.angle(scipy.signal.hilbert(filtered))
+        return cls(cycle_starts=t_start_ms + phase_crossings(phase) /
+                   sampling_rate * 1000)
+
+    def __eq__(self, other):
+        if not isinstance(other, ThetaReference):
+            return NotImplemented
+        if self.cycle_starts is None or other.cycle_starts is None:
+            return (self.cycle_starts is None and other.cycle_starts is None
+                    and self.period == other.period)
+        return self is other
+
+    def __hash__(self):
+        if self.cycle_starts is None:
+            return hash(self.period)
+        return id(self)
+
+    def assign(self, times):
+        """
+        Theta cycle and position within the cycle of each spike.
+
+        Parameters
+        ----------
+        times : numpy array
+            Spike times of any shape.
+
+        Returns
+        -------
+        cycle : numpy array
+            Cycle index of each spike, -1 before the first cycle and
+            n_cycles after the last one.
+        fraction : numpy array
+            Position within the cycle in [0, 1), nan outside the cycles.
+        """
+        times = np.asarray(times, dtype=float)
+        if self.cycle_starts is None:
+            return (np.floor(times / self.period).astype(int),
+                    times % self.period / self.period)
+        starts = self.cycle_starts
+        cycle = np.searchsorted(starts, times, side='right') - 1
+        inside = (cycle >= 0) & (cycle < starts.size - 1)
+        safe = np.clip(cycle, 0, starts.size - 2)
+        fraction = (times - starts[safe]) / (starts[safe + 1] - starts[safe])
+        fraction = np.where(inside, fraction, np.nan)
+        return cycle, fraction
+
+    def phase(self, times):
+        """Theta phase of each spike in radians, nan outside the cycles."""
+        return self.assign(times)[1] * 2 * np.pi
+
+    def time(self, cycle, fraction):
+        """Times at the given positions within the given cycles."""
+        if self.cycle_starts is None:
+            return (cycle + fraction) * self.period
+        starts = self.cycle_starts
+        cycle = np.clip(cycle, 0, starts.size - 2)
+        return starts[cycle] + fraction * (starts[cycle + 1] - starts[cycle])
+
+
+def phase_crossings(phase):
+    """Fractional sample indices where phase crosses zero upwards."""
+    idx = np.flatnonzero((phase[:-1] < 0) & (phase[1:] >= 0))
+    return idx + -phase[idx] / (phase[idx + 1] - phase[idx])
+
+
+def theta_reference(theta):
+    """
+    Return theta as ThetaReference.
+
+    Parameters
+    ----------
+    theta : float or ThetaReference
+        Theta period or reference.
+
+    Returns
+    -------
+    ThetaReference
+    """
+    if isinstance(theta, ThetaReference):
+        return theta
+    return ThetaReference(period=theta)
@@ -0,0 +1,386 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Long lived worker that keeps NEURON, the mechanisms and imports warm.
+
+The daemon listens on a local UNIX socket and runs jobs one at a time. A
+job is a function given as 'module:function' with its arguments, so any
+simulation or analysis function of the repository can run in the daemon
+without paying the imports again. simulate_trial keeps the DentateSession
+of the last network, so trials of one grid seed do not rebuild it. Any
+other job may build networks of its own, NEURON would simulate them
+together with the warm one. The warm network is therefore freed before
+and after every other job.
+
+The socket lies in XDG_RUNTIME_DIR, or in the temporary directory with
+the user id in its name. Clients authenticate with a key the daemon
+generates and writes next to the socket, readable only by its user.
+
+Start the daemon with
+    python -m phase_to_rate.worker_daemon
+and submit jobs with DaemonClient:
+    with DaemonClient() as client:
+        spikes = client.call('phase_to_rate.worker_daemon:simulate_trial',
+                             grid_spikes, grid_seed=1)
+"""
+
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener
+import argparse
+import gc
+import importlib
+import multiprocessing
+import os
+import socket
+import tempfile
+import time
+import traceback
+
+DEFAULT_ADDRESS = (
+    os.path.join(os.environ['XDG_RUNTIME_DIR'], 'phase_to_rate_worker.sock')
+    if os.environ.get('XDG_RUNTIME_DIR') else
+    os.path.join(tempfile.gettempdir(),
+                 f'phase_to_rate_worker_{os.getuid()}.sock'))
+
+DEFAULT_WARM = (
+    'neuron',
+    'phase_to_rate.pydentate_integrate',
+    'phase_to_rate.grid_model',
+    'phase_to_rate.neural_coding',
+    'phase_to_rate.perceptron',
+)
+
+
+class JobError(Exception):
+    """A job raised in the daemon, the message is its traceback."""
+
+
+_state = {'session': None, 'session_key': None}
+
+
+def simulate_trial(grid_spikes, grid_seed=1, network_type='full',
+                   pp_weight=9e-4, dur_ms=2000, nthread=1, flat=False):
+    """
+    Simulate one trial on the warm network of the daemon.
+
+    The network of the previous call is reused if grid_seed, network_type
+    and pp_weight match, otherwise it is freed and a new one is built.
+
+    Parameters
+    ----------
+    grid_spikes : list
+        Spike times of grid cell population.
+    grid_seed : int
+        Seed for the grid cell population
+        also seeds the dentate gyrus model.
+    network_type : str
+        Tuning of the network.
+    pp_weight : int
+        Connection weight from perforant path
+        from grid cell to dentate gyrus cells.
+    dur_ms : int
+        Duration of the simulation.
+    nthread : int
+        Number of NEURON threads. The default is 1.
+    flat : bool
+        Return the spikes of all populations as flat times and gids
+        instead of the granule spikes per cell. The default is False.
+
+    Returns
+    -------
+    list or tuple
+        Granule cell spike times in a list, or copies of (times, gids)
+        from DentateSession.run if flat.
+    """
+    from phase_to_rate.pydentate_integrate import DentateSession
+    key = (grid_seed, network_type, pp_weight)
+    if _state['session_key'] != key:
+        # Free the old network first, NEURON would simulate both
+        _state['session'] = None
+        _state['session'] = DentateSession(grid_seed=grid_seed,
+                                           network_type=network_type,
+                                           pp_weight=pp_weight)
+        _state['session_key'] = key
+    session = _state['session']
+    session.nthread = nthread
+    if flat:
+        return tuple(x.copy() for x in session.run(grid_spikes,
+                                                   dur_ms=dur_ms))
+    return session.simulate(grid_spikes, dur_ms=dur_ms)
+
+
+def _resolve(target):
+    module, _, name = target.partition(':')
+    return getattr(importlib.import_module(module), name)
+
+
+def _drop_session():
+    # The state of the imported module, also when the daemon runs as
+    # __main__
+    state = importlib.import_module('phase_to_rate.worker_daemon')._state
+    if state['session'] is not None:
+        state.update(session=None, session_key=None)
+    # pydentate networks hold reference cycles
+    gc.collect()
+
+
+def _run_job(target, args, kwargs):
+    function = _resolve(target)
+    if target == 'phase_to_rate.worker_daemon:simulate_trial':
+        return function(*args, **kwargs)
+    _drop_session()
+    try:
+        return function(*args, **kwargs)
+    finally:
+        _drop_session()
+
+
+def _warm_up(warm, load_mechanisms):
+    for module in warm:
+        importlib.import_module(module)
+    if load_mechanisms:
+        from pydentate import neuron_tools
+        neuron_tools.load_compiled_mechanisms()
+
+
+def key_path(address):
+    """Path of the file with the authentication key of a daemon."""
+    return address + '.key'
+
+
+def _is_live(address):
+    """True if something accepts connections on the socket."""
+    probe = socket.socket(socket.AF_UNIX)
+    try:
+        probe.connect(address)
+    except OSError:
+        return False
+    finally:
+        probe.close()
+    return True
+
+
+def _claim(address):
+    """Remove a stale socket, raise if a daemon listens on it."""
+    if not os.path.exists(address):
+        return
+    if _is_live(address):
+        raise RuntimeError(f"A worker daemon already listens on {address}")
+    os.remove(address)
+
+
+def _write_key(address, authkey):
+    path = key_path(address)
+    if os.path.exists(path):
+        os.remove(path)
+    # Created readable by the user only, the key is never world readable
+    descriptor = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(descriptor, 'wb') as key_file:
+        key_file.write(authkey)
+
+
+def _handle(connection):
+    """Run the jobs of one client, False if it asked for a shutdown."""
+    while True:
+        try:
+            message = connection.recv()
+        except EOFError:
+            return True
+        if message[0] == 'shutdown':
+            connection.send(('ok', None))
+            return False
+        _, target, args, kwargs = message
+        try:
+            result = ('ok', _run_job(target, args, kwargs))
+        except Exception:
+            result = ('error', traceback.format_exc())
+        connection.send(result)
+
+
+def serve(address=DEFAULT_ADDRESS, authkey=None, warm=DEFAULT_WARM,
+          load_mechanisms=True):
+    """
+    Warm up and run jobs of clients until one sends a shutdown.
+
+    Clients are served one after the other, jobs run in the daemon
+    process in order of arrival.
+
+    Parameters
+    ----------
+    address : str
+        Path of the UNIX socket. A stale socket file is replaced.
+        The default is DEFAULT_ADDRESS.
+    authkey : bytes
+        Key clients need to connect, written to key_path(address).
+        The default is None, a random key.
+    warm : tuple
+        Modules imported before the first job. The default is
+        DEFAULT_WARM.
+    load_mechanisms : bool
+        Load pydentate's compiled mechanisms. The default is True.
+
+    Raises
+    ------
+    RuntimeError
+        If a daemon already listens on address.
+    """
+    _claim(address)
+    _warm_up(warm, load_mechanisms)
+    # Checked again, another daemon may have started during the warm up
+    _claim(address)
+    if authkey is None:
+        authkey = os.urandom(32)
+    _write_key(address, authkey)
+    try:
+        with Listener(address, family='AF_UNIX',
+                      authkey=authkey) as listener:
+            running = True
+            while running:
+                try:
+                    connection = listener.accept()
+                except (AuthenticationError, EOFError, OSError):
+                    # A client without the key, or a probe of _is_live
+                    continue
+                with connection:
+                    running = _handle(connection)
+    finally:
+        os.remove(key_path(address))
+
+
+def start(address=DEFAULT_ADDRESS, authkey=None, timeout=120, **kwargs):
+    """
+    Start serve in a background process and wait until it listens.
+
+    Parameters
+    ----------
+    address : str
+        Path of the UNIX socket. The default is DEFAULT_ADDRESS.
+    authkey : bytes
+        Key clients need to connect. The default is None, a random key
+        that DaemonClient reads from key_path(address).
+    timeout : float
+        Seconds to wait for the warm up. The default is 120.
+    **kwargs
+        Passed on to serve.
+
+    Returns
+    -------
+    multiprocessing.Process
+        The daemon process.
+
+    Raises
+    ------
+    RuntimeError
+        If a daemon already listens on address, or the new one exited
+        during the warm up.
+    """
+    _claim(address)
+    # spawn instead of fork so that the daemon has a clean NEURON
+    context = multiprocessing.get_context('spawn')
+    process = context.Process(target=serve, args=(address, authkey),
+                              kwargs=kwargs, daemon=True)
+    process.start()
+    deadline = time.monotonic() + timeout
+    while not os.path.exists(address):
+        if not process.is_alive():
+            raise RuntimeError("The worker daemon exited during warm up")
+        if time.monotonic() > deadline:
+            process.terminate()
+            raise TimeoutError("The worker daemon did not start listening")
+        time.sleep(0.05)
+    return process
+
+
+class DaemonClient:
+    """
+    Thin client that submits jobs to a running daemon.
+
+    Parameters
+    ----------
+    address : str
+        Path of the UNIX socket. The default is DEFAULT_ADDRESS.
+    authkey : bytes
+        Key of the daemon. The default is None, read from
+        key_path(address).
+    """
+
+    def __init__(self, address=DEFAULT_ADDRESS, authkey=None):
+        if authkey is None:
+            with open(key_path(address), 'rb') as key_file:
+                authkey = key_file.read()
+        self.connection = Client(address, family='AF_UNIX', authkey=authkey)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        """Disconnect, the daemon keeps running."""
+        self.connection.close()
+
+    def call(self, target, *args, **kwargs):
+        """
+        Run target(*args, **kwargs) in the daemon and return the result.
+
+        Parameters
+        ----------
+        target : str
+            Function as 'module:function'.
+
+        Raises
+        ------
+        JobError
+            If the job raised, with the traceback from the daemon.
+        """
+        self.connection.send(('job', target, args, kwargs))
+        status, result = self.connection.recv()
+        if status == 'error':
+            raise JobError(result)
+        return result
+
+    def map(self, target, jobs):
+        """
+        Run target for many jobs one after the other.
+
+        Each job is sent once the result of the previous one arrived, the
+        results are yielded as they arrive.
+
+        Parameters
+        ----------
+        target : str
+            Function as 'module:function'.
+        jobs : iterable
+            (args, kwargs) of each job.
+
+        Yields
+        ------
+        object
+            Result of each job, in order of jobs.
+        """
+        for args, kwargs in jobs:
+            yield self.call(target, *args, **kwargs)
+
+    def shutdown(self):
+        """Stop the daemon after the current job."""
+        self.connection.send(('shutdown',))
+        self.connection.recv()
+        self.close()
+
+
+if __name__ == '__main__':
+    pr = argparse.ArgumentParser(description='Warm simulation worker')
+    pr.add_argument('-address',
+                    type=str,
+                    help='Path of the UNIX socket',
+                    default=DEFAULT_ADDRESS,
+                    dest='address')
+    pr.add_argument('-no_mechanisms',
+                    action='store_true',
+                    help='Do not load the compiled pydentate mechanisms',
+                    dest='no_mechanisms')
+    args = pr.parse_args()
+    # The jobs of simulate_trial use the state of the imported module
+    daemon = importlib.import_module('phase_to_rate.worker_daemon')
+    daemon.serve(args.address, load_mechanisms=not args.no_mechanisms)
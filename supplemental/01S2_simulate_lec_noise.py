@@ -14,6 +14,7 @@ import os
 from pydentate import neuron_tools
 from phase_to_rate import grid_model
 from phase_to_rate import pydentate_integrate
+from phase_to_rate.result_cache import ResultCache
 import sys
 import argparse
 import scipy
@@ -99,6 +100,8 @@ dirname = os.path.dirname(__file__)
 results_dir = os.path.join(dirname, 'data')
 if not os.path.isdir(results_dir):
     os.mkdir(results_dir)
+# Every finished trial is cached here, reruns skip them
+cache = ResultCache(os.path.join(results_dir, 'cache'))
 
 neuron_tools.load_compiled_mechanisms()
 
@@ -147,15 +150,36 @@ for grid_seed in grid_seeds:
         granule_spikes[traj] = {}
         for idx, poisson_seed in enumerate(poisson_seeds):
             granule_spikes[traj][poisson_seed] = {}
-            granule_spikes_poiss = pydentate_integrate.granule_simulate_lec_noise(
-                grid_spikes[traj][poisson_seed],
-                lec_spikes[idx],
-                dur_ms=parameters['dur_ms'],
-                network_type=network_type,
-                grid_seed=grid_seed,
-                pp_weight=parameters['pp_weight'],
-                n_lec_synapses=parameters['noise_scale'],
+            trial_inputs = {
+                "simulator": "granule_simulate_lec_noise",
+                "result": "grid_and_granule_spikes",
+                "grid_seed": grid_seed,
+                "trajectory": traj,
+                "poisson_seed": poisson_seed,
+                "shuffling": shuffling,
+                "network_type": network_type,
+                "lec_spikes": lec_spikes[idx],
+                **{key: value for key, value in parameters.items()
+                   if key != "poisson_seeds"},
+            }
+            # Shuffled grid spikes are not seeded, the cache keeps them
+            # with the spikes simulated from them
+            grid_spikes_poiss, granule_spikes_poiss = cache.get_or_compute(
+                trial_inputs,
+                lambda: (
+                    grid_spikes[traj][poisson_seed],
+                    pydentate_integrate.granule_simulate_lec_noise(
+                        grid_spikes[traj][poisson_seed],
+                        lec_spikes[idx],
+                        dur_ms=parameters['dur_ms'],
+                        network_type=network_type,
+                        grid_seed=grid_seed,
+                        pp_weight=parameters['pp_weight'],
+                        n_lec_synapses=parameters['noise_scale'],
+                    )
+                )
             )
+            grid_spikes[traj][poisson_seed] = grid_spikes_poiss
             granule_spikes[traj][poisson_seed] = granule_spikes_poiss
             
     storage = shelve.open(file_path, writeback=True)
@@ -14,6 +14,7 @@ import os
 from pydentate import neuron_tools
 from phase_to_rate import grid_model
 from phase_to_rate import pydentate_integrate
+from phase_to_rate.result_cache import ResultCache
 import sys
 import argparse
 import pdb
@@ -36,6 +37,8 @@ dirname = os.path.dirname(__file__)
 results_dir = os.path.join(dirname, 'data')
 if not os.path.isdir(results_dir):
     os.mkdir(results_dir)
+# Every finished trial is cached here, reruns skip them
+cache = ResultCache(os.path.join(results_dir, 'cache'))
 
 neuron_tools.load_compiled_mechanisms()
 
@@ -92,13 +95,33 @@ for grid_seed in grid_seeds:
         all_spikes[traj] = {}
         for poisson_seed in poisson_seeds:
             all_spikes[traj][poisson_seed] = {}
-            all_spikes_poiss = pydentate_integrate.granule_simulate_all_cell_types(
-                grid_spikes[traj][poisson_seed],
-                dur_ms=parameters['dur_ms'],
-                network_type=network_type,
-                grid_seed=grid_seed,
-                pp_weight=parameters['pp_weight']
+            trial_inputs = {
+                "simulator": "granule_simulate_all_cell_types",
+                "result": "grid_and_granule_spikes",
+                "grid_seed": grid_seed,
+                "trajectory": traj,
+                "poisson_seed": poisson_seed,
+                "shuffling": shuffling,
+                "network_type": network_type,
+                **{key: value for key, value in parameters.items()
+                   if key != "poisson_seeds"},
+            }
+            # Shuffled grid spikes are not seeded, the cache keeps them
+            # with the spikes simulated from them
+            grid_spikes_poiss, all_spikes_poiss = cache.get_or_compute(
+                trial_inputs,
+                lambda: (
+                    grid_spikes[traj][poisson_seed],
+                    pydentate_integrate.granule_simulate_all_cell_types(
+                        grid_spikes[traj][poisson_seed],
+                        dur_ms=parameters['dur_ms'],
+                        network_type=network_type,
+                        grid_seed=grid_seed,
+                        pp_weight=parameters['pp_weight']
+                    )
+                )
             )
+            grid_spikes[traj][poisson_seed] = grid_spikes_poiss
             all_spikes[traj][poisson_seed] = all_spikes_poiss
             print(f'pseed {poisson_seed} done.')
 
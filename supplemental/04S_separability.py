@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""
+Closed form separability of trajectory pairs versus perceptron speed.
+
+Computes Fisher discriminability, ridge classifier margin and d' of the
+pairs of 75 cm with every other trajectory for the codes that
+04_perceptron.py trains on, and correlates them with the perceptron
+learning speed of the same pairs.
+"""
+
+from phase_to_rate.neural_coding import load_spikes, rate_n_phase
+from phase_to_rate.separability import separability, speed_correlation
+import numpy as np
+import pandas as pd
+import pickle
+import os
+
+dirname = os.path.dirname(__file__)
+results_dir = os.path.join(dirname, '..', 'data')
+
+trajectories = [75, 74.5, 74, 73.5, 73, 72.5, 72,
+                71, 70, 69, 68, 67, 66, 65, 60, 30, 15]
+n_samples = 20
+grid_seeds = np.arange(1, 11, 1)
+tuning = 'full'
+pairs = [(0, traj_idx) for traj_idx in range(1, len(trajectories))]
+
+rows = []
+for grid_seed in grid_seeds:
+    path = "/home/baris/results/"+str(tuning)+"/collective/grid-seed_duration_shuffling_tuning_"
+    for shuffling in ['non-shuffled', 'shuffled']:
+        file_path = (path + str(grid_seed) + "_2000_" + shuffling + "_" +
+                     str(tuning))
+        for cell in ['grid', 'granule']:
+            spikes = load_spikes(file_path, cell, trajectories, n_samples)
+            _, _, rate_code, phase_code, polar_code = rate_n_phase(
+                spikes, trajectories, n_samples)
+            for code, code_array in (('rate', rate_code),
+                                     ('phase', phase_code),
+                                     ('polar', polar_code)):
+                measures = separability(code_array, pairs=pairs)
+                for idx, (_, traj_idx) in enumerate(pairs):
+                    rows.append([75 - trajectories[traj_idx], grid_seed,
+                                 shuffling, cell, code,
+                                 measures['fisher'][idx],
+                                 measures['margin'][idx],
+                                 measures['d_prime'][idx]])
+        print(grid_seed, shuffling)
+
+separability_df = pd.DataFrame(rows, columns=['distance', 'grid_seed',
+                                              'shuffling', 'cell', 'code',
+                                              'fisher', 'margin', 'd_prime'])
+
+fname = os.path.join(results_dir, 'pickled', '75-15_full_perceptron_speed.pkl')
+with open(fname, 'rb') as f:
+    perceptron_df = pd.DataFrame(pickle.load(f),
+                                 columns=['distance', 'speed', 'th_cross',
+                                          'trajectories', 'grid_seed',
+                                          'shuffling', 'cell', 'code',
+                                          'learning_rate'])
+
+merged = separability_df.merge(
+    perceptron_df, on=['distance', 'grid_seed', 'shuffling', 'cell', 'code'])
+
+report = []
+for (cell, code), group in merged.groupby(['cell', 'code']):
+    correlation = speed_correlation(
+        {name: group[name].to_numpy()
+         for name in ('fisher', 'margin', 'd_prime')},
+        group['speed'].to_numpy())
+    for name, (rho, p) in correlation.items():
+        report.append([cell, code, name, rho, p, len(group)])
+report = pd.DataFrame(report, columns=['cell', 'code', 'measure',
+                                       'spearman_rho', 'p', 'n_pairs'])
+print(report)
+
+with pd.ExcelWriter('separability_vs_perceptron_speed.xlsx') as writer:
+    report.to_excel(writer, sheet_name='Correlation')
+    merged.to_excel(writer, sheet_name='Pairs')
@@ -10,6 +10,7 @@ import numpy as np
 # import seaborn as sns
 import pandas as pd
 from phase_to_rate import grid_model
+from phase_to_rate.spike_index import spike_index
 from phase_to_rate.figure_functions import (_make_cmap, _precession_spikes,
                               _adjust_box_widths)
 import matplotlib.pyplot as plt
@@ -63,36 +64,22 @@ for f in all_files:
     tuning = split[13]
     all_spikes[tuning][shuffling][grid_seed] = dict(curr_file)
 
-all_phases = deepcopy(all_spikes)
-
-# Calculate phases
-for t in tunings:
-    for s in shufflings:
-        for g in grid_seeds:
-            for ps in poisson_seeds:
-                all_phases[t][s][g]['grid_spikes'][75][ps] = [((spikes % 100) / 100) * (np.pi * 2) for spikes in all_spikes[t][s][g]['grid_spikes'][75][ps]]
-                
-                all_phases[t][s][g]['all_spikes'][75][ps] = list(all_phases[t][s][g]['all_spikes'][75][ps])
-                for ct in cell_types:
-                    all_phases[t][s][g]['all_spikes'][75][ps][ct] = [((spikes % 100) / 100) * (np.pi * 2) for spikes in all_spikes[t][s][g]['all_spikes'][75][ps][ct]]
-
-all_phases_flattened = {}
-for t in tunings:
-    all_phases_flattened[t] = {}
-    for s in shufflings:
-        all_phases_flattened[t][s] = {}
-        for ct in ['grid', 'granule', 'mossy', 'basket', 'hipp']:
-            all_phases_flattened[t][s][ct] = np.array([])
-
-for t in tunings:
-    for s in shufflings:
-        for g in grid_seeds:
-            for ps in poisson_seeds:
-                for cell in all_phases[t][s][g]['grid_spikes'][75][ps]:
-                    all_phases_flattened[t][s]['grid'] = np.concatenate((all_phases_flattened[t][s]['grid'], cell))
-                for ct_idx, ct in enumerate(['granule', 'mossy', 'basket', 'hipp']):
-                    for cell in all_phases[t][s][g]['all_spikes'][75][ps][ct_idx]:
-                        all_phases_flattened[t][s][ct] = np.concatenate((all_phases_flattened[t][s][ct], cell))
+# Calculate phases from the cached spike index of each poisson seed
+def flatten_phases(all_spikes):
+    all_phases_flattened = {}
+    for t in tunings:
+        all_phases_flattened[t] = {}
+        for s in shufflings:
+            phases = {ct: [] for ct in ['grid', 'granule', 'mossy', 'basket', 'hipp']}
+            for g in grid_seeds:
+                for ps in poisson_seeds:
+                    phases['grid'].append(spike_index(all_spikes[t][s][g]['grid_spikes'][75][ps]).phase(100))
+                    for ct_idx, ct in enumerate(['granule', 'mossy', 'basket', 'hipp']):
+                        phases[ct].append(spike_index(all_spikes[t][s][g]['all_spikes'][75][ps][ct_idx]).phase(100))
+            all_phases_flattened[t][s] = {ct: np.concatenate(phases[ct]) for ct in phases}
+    return all_phases_flattened
+
+all_phases_flattened = flatten_phases(all_spikes)
 
 all_phases_flattened_adjusted = deepcopy(all_phases_flattened)
 
@@ -192,36 +179,7 @@ for f in all_files:
     tuning = split[13]
     all_spikes[tuning][shuffling][grid_seed] = dict(curr_file)
 
-all_phases = deepcopy(all_spikes)
-
-# Calculate phases
-for t in tunings:
-    for s in shufflings:
-        for g in grid_seeds:
-            for ps in poisson_seeds:
-                all_phases[t][s][g]['grid_spikes'][75][ps] = [((spikes % 100) / 100) * (np.pi * 2) for spikes in all_spikes[t][s][g]['grid_spikes'][75][ps]]
-                
-                all_phases[t][s][g]['all_spikes'][75][ps] = list(all_phases[t][s][g]['all_spikes'][75][ps])
-                for ct in cell_types:
-                    all_phases[t][s][g]['all_spikes'][75][ps][ct] = [((spikes % 100) / 100) * (np.pi * 2) for spikes in all_spikes[t][s][g]['all_spikes'][75][ps][ct]]
-
-all_phases_flattened = {}
-for t in tunings:
-    all_phases_flattened[t] = {} 
-    for s in shufflings:
-        all_phases_flattened[t][s] = {}
-        for ct in ['grid', 'granule', 'mossy', 'basket', 'hipp']:
-            all_phases_flattened[t][s][ct] = np.array([])
-
-for t in tunings:
-    for s in shufflings:
-        for g in grid_seeds:
-            for ps in poisson_seeds:
-                for cell in all_phases[t][s][g]['grid_spikes'][75][ps]:
-                    all_phases_flattened[t][s]['grid'] = np.concatenate((all_phases_flattened[t][s]['grid'], cell))
-                for ct_idx, ct in enumerate(['granule', 'mossy', 'basket', 'hipp']):
-                    for cell in all_phases[t][s][g]['all_spikes'][75][ps][ct_idx]:
-                        all_phases_flattened[t][s][ct] = np.concatenate((all_phases_flattened[t][s][ct], cell))
+all_phases_flattened = flatten_phases(all_spikes)
 
 all_phases_flattened_nonadjusted = deepcopy(all_phases_flattened)
 
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+"""
+Time per epoch of run_perceptron with dense and sparse granule codes.
+
+Random codes with the size of granule rate codes (2000 cells x 40 bins,
+20 poisson seeds per trajectory) in which a fraction of the cells is
+active are trained with a dense numpy input and a scipy.sparse input.
+Prints the time per epoch, the largest loss difference and whether both
+give the same threshold crossing.
+"""
+
+import contextlib
+import io
+import time
+import numpy as np
+import scipy.sparse
+from phase_to_rate.perceptron import run_perceptron
+
+n_granule = 2000
+n_bins = 40
+n_samples = 40
+n_iter = 200
+threshold = 0.45
+active_fractions = [0.02, 0.05, 0.1, 0.2]
+# Probability that a bin of an active cell has spikes in a sample
+bin_probability = 0.25
+
+rng = np.random.default_rng(1)
+
+
+def train(neural_code):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return run_perceptron(neural_code, grid_seed=1, learning_rate=1e-3,
+                              n_iter=n_iter, threshold=threshold)
+
+
+# The first run pays for the torch warm up
+train(np.zeros((n_granule * n_bins, n_samples)))
+
+print("active cells  nonzero  dense (ms/epoch)  sparse (ms/epoch)  speedup"
+      "  max loss diff  same th_cross")
+for active_fraction in active_fractions:
+    active = rng.random(n_granule) < active_fraction
+    mask = (np.repeat(active, n_bins)[:, None] &
+            (rng.random((n_granule * n_bins, n_samples)) < bin_probability))
+    code = np.where(mask, rng.random(mask.shape), 0).astype(np.float32)
+    results, wall_times = [], []
+    for neural_code in (code, scipy.sparse.csr_matrix(code)):
+        start = time.perf_counter()
+        results.append(train(neural_code))
+        wall_times.append((time.perf_counter() - start) / n_iter * 1000)
+    loss_diff = np.max(np.abs(np.subtract(results[0][1], results[1][1])))
+    print(f"{active_fraction:12.2f}  {mask.mean():7.4f}  "
+          f"{wall_times[0]:16.2f}  {wall_times[1]:17.2f}  "
+          f"{wall_times[0] / wall_times[1]:7.1f}  {loss_diff:13.1e}  "
+          f"{results[0][0] == results[1][0]}")
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+"""
+Wall time of granule_simulate versus the number of NEURON threads.
+
+Simulates the same trial with every thread count and checks that the
+granule cell rasters match the single threaded run exactly.
+"""
+
+import os
+import time
+import numpy as np
+from pydentate import neuron_tools
+from phase_to_rate import grid_model
+from phase_to_rate import pydentate_integrate
+
+neuron_tools.load_compiled_mechanisms()
+
+grid_seed = 1
+trajectory = 75
+poisson_seed = 100
+network_type = "full"
+dur_ms = 2000
+n_repeats = 3
+
+n_cores = os.cpu_count() or 1
+thread_counts = [1] + [2 ** x for x in range(1, 8) if 2 ** x <= n_cores]
+
+grid_spikes, _ = grid_model.grid_simulate(
+    trajs=[trajectory],
+    dur_ms=dur_ms,
+    grid_seed=grid_seed,
+    poiss_seeds=[poisson_seed],
+    shuffle="shuffled",
+)
+grid_spikes = grid_spikes[trajectory][poisson_seed]
+
+session = pydentate_integrate.DentateSession(grid_seed=grid_seed,
+                                             network_type=network_type)
+reference = None
+print("nthread  wall time (s)  speedup  identical spikes")
+for nthread in thread_counts:
+    session.nthread = nthread
+    wall_times = []
+    for _ in range(n_repeats):
+        start = time.perf_counter()
+        granule_spikes = session.simulate(grid_spikes, dur_ms=dur_ms)
+        wall_times.append(time.perf_counter() - start)
+    wall_time = min(wall_times)
+    if reference is None:
+        reference = granule_spikes
+        reference_time = wall_time
+    identical = (len(granule_spikes) == len(reference) and
+                 all(np.array_equal(x, y)
+                     for x, y in zip(granule_spikes, reference)))
+    print(f"{nthread:7d}  {wall_time:13.2f}  {reference_time / wall_time:7.2f}"
+          f"  {identical}")
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""
+Learning curves of phase_to_rate.tempotron against the tempotron package.
+
+Trains both implementations on the 75 vs 60 cm example of 05_tempotron.py
+with the same efficacies and threshold and prints the largest difference
+of the maximum potentials of the samples and of the calibrated
+thresholds, the largest difference of their accuracy and loss curves and
+of the trained efficacies, and the time each takes. The curves of the
+in-package tempotron are recorded both as the samples are presented and
+after each epoch, the package's definition is the one without a
+difference. Without the tempotron
+package only the in-package tempotron is trained. The package stays the
+default engine of 05_tempotron.py and tempotron_sweep, and of the
+threshold of 05S_tempotron_metric.py, until this shows equal maxima and
+curves.
+"""
+
+import os
+import shelve
+import time
+import numpy as np
+from phase_to_rate.tempotron import Tempotron, max_potential
+
+grid_seed = 11
+shuffling = 'non-shuffled'
+cell_type = 'granule_spikes'
+n_cells = 200
+epochs = 200
+total_time = 2000.0
+V_rest = 0.0
+learning_rate = 1e-3
+tau = 10.0
+tau_s = tau / 4.0
+trajectory_1 = '75'
+trajectory_2 = '60'
+
+dirname = os.path.dirname(__file__)
+example_data = os.path.join(
+    dirname, '..', 'data', 'tempotron', 'full', 'collective',
+    f'grid-seed_duration_shuffling_tuning_trajs_{grid_seed}_2000_'
+    f'{shuffling}_full_{trajectory_1}-{trajectory_2}')
+with shelve.open(example_data) as data:
+    all_spikes = np.array(
+        [(np.array(data[traj][cell_type][x][:n_cells], dtype=object), label)
+         for traj, label in ((trajectory_1, False), (trajectory_2, True))
+         for x in data[traj][cell_type]], dtype=object)
+
+np.random.seed(91)
+efficacies = np.random.rand(n_cells)
+vmax, tmax = max_potential(all_spikes[:, 0], efficacies, tau=tau,
+                           tau_s=tau_s, V_rest=V_rest)
+threshold = vmax.mean()
+
+results = {}
+for curves in ('presented', 'epoch'):
+    tempotron = Tempotron(V_rest, tau, tau_s, efficacies, threshold)
+    start = time.perf_counter()
+    samples, labels = tempotron.prepare(all_spikes)
+    result = tempotron.train(list(zip(samples, labels)), epochs,
+                             learning_rate=learning_rate, curves=curves)
+    results[curves] = result
+    print(f"phase_to_rate.tempotron, curves {curves}: "
+          f"{time.perf_counter() - start:.2f} s, "
+          f"accuracy {result[0][0]:.3f} -> {result[0][-1]:.3f}, "
+          f"loss {result[1][0]:.4g} -> {result[1][-1]:.4g}")
+
+try:
+    from tempotron.main import Tempotron as PackageTempotron
+except ImportError:
+    print("The tempotron package is not installed, nothing to compare")
+else:
+    package = PackageTempotron(V_rest, tau, tau_s, efficacies.copy(),
+                               total_time, threshold, jit_mode=True,
+                               verbose=False)
+    package_tmax = [package.compute_tmax(sts[0]) for sts in all_spikes]
+    package_vmax = np.array(
+        [package.compute_membrane_potential(package_tmax[idx], sts[0])
+         for idx, sts in enumerate(all_spikes)])
+    print("largest vmax difference", np.abs(package_vmax - vmax).max())
+    print("threshold difference", package_vmax.mean() - threshold)
+    start = time.perf_counter()
+    package_result = np.array(package.train(all_spikes, epochs,
+                                            learning_rate=learning_rate))
+    print(f"tempotron package: {time.perf_counter() - start:.2f} s")
+    for curves, result in results.items():
+        print(f"curves {curves}, largest accuracy difference",
+              np.abs(package_result[0] - result[0]).max())
+        print(f"curves {curves}, largest loss difference",
+              np.abs(package_result[1] - result[1]).max())
+    # The efficacies do not depend on how the curves are recorded
+    print("largest efficacy difference",
+          np.abs(package.efficacies - tempotron.efficacies).max())
@@ -3,14 +3,162 @@
 Created on Fri Oct 21 14:59:42 2022
 
 @author: Daniel
+
+Readers for raw binary LFP recordings such as the mizuseki .eeg files.
+BinaryLFP memory-maps the file instead of loading it, so theta references
+of hour-long recordings are extracted chunk by chunk in constant memory.
 """
 
+from phase_to_rate.theta import ThetaReference, phase_crossings
 import numpy as np
+import scipy.signal
 import os
 
+
 def read_binary(file_path, input_type=np.int16):
     return np.fromfile(file_path, dtype=input_type)
-    
+
+
+class BinaryLFP:
+    """
+    Memory-mapped multichannel LFP stored as interleaved samples.
+
+    Parameters
+    ----------
+    file_path : str
+        Path of the binary file.
+    n_channels : int
+        Number of channels interleaved in the file.
+    sampling_rate : float
+        Sampling rate in Hz. The default is 1250.
+    input_type : numpy dtype
+        Data type of the samples. The default is np.int16.
+    """
+
+    def __init__(self, file_path, n_channels, sampling_rate=1250,
+                 input_type=np.int16):
+        raw = np.memmap(file_path, dtype=input_type, mode='r')
+        self.n_channels = n_channels
+        self.n_samples = raw.size // n_channels
+        self.sampling_rate = sampling_rate
+        # trailing samples of an incomplete frame are ignored
+        self.data = raw[:self.n_samples * n_channels].reshape(
+            self.n_samples, n_channels)
+
+    @property
+    def duration_ms(self):
+        return self.n_samples / self.sampling_rate * 1000
+
+    def chunks(self, chunk_size, overlap=0, channels=None, decimation=1):
+        """
+        Iterate over the recording in chunks with overlapping margins.
+
+        Each chunk is read from the memory map as float and optionally
+        decimated. The margins absorb edge effects of filters applied to
+        the chunk and are discarded by slicing with core.
+
+        Parameters
+        ----------
+        chunk_size : int
+            Samples per chunk after decimation.
+        overlap : int
+            Samples of margin before and after each chunk after
+            decimation. The default is 0.
+        channels : int, list or slice
+            Channels to read. The default is None, all channels.
+        decimation : int
+            Downsampling factor, the anti-aliasing filter is applied to
+            each chunk. The default is 1.
+
+        Yields
+        ------
+        start : int
+            Index of the first core sample in the decimated recording.
+        segment : numpy array
+            Chunk including margins. [n_segment, n_channels]
+        core : slice
+            Samples of segment that belong to the chunk itself.
+        """
+        if channels is None:
+            channels = slice(None)
+        n_out = -(-self.n_samples // decimation)
+        for start in range(0, n_out, chunk_size):
+            stop = min(start + chunk_size, n_out)
+            seg_start = max(start - overlap, 0)
+            seg_stop = min(stop + overlap, n_out)
+            segment = np.asarray(
+                self.data[seg_start * decimation:seg_stop * decimation,
+                          channels], dtype=float)
+            if decimation > 1:
+                segment = scipy.signal.decimate(segment, decimation, axis=0)
+            yield start, segment, slice(start - seg_start, stop - seg_start)
+
+    def theta_phase(self, channel, band=(6, 10), order=3, chunk_size=2 ** 18,
+                    overlap=None, decimation=1):
+        """
+        Stream the theta phase of one channel chunk by chunk.
+
+        Parameters
+        ----------
+        channel : int
+            Channel to filter.
+        band : tuple
+            Theta band in Hz. The default is (6, 10).
+        order : int
+            Order of the Butterworth band-pass. The default is 3.
+        chunk_size : int
+            Samples per chunk after decimation. The default is 2 ** 18.
+        overlap : int
+            Margin of each chunk after decimation. The default is None,
+            two seconds.
+        decimation : int
+            Downsampling factor before filtering. The default is 1.
+
+        Yields
+        ------
+        start : int
+            Index of the first sample in the decimated recording.
+        phase : numpy array
+            Hilbert phase in radians of the chunk plus the first sample of
+            the next chunk, if any.
+        """
+        rate = self.sampling_rate / decimation
+        if overlap is None:
+            overlap = int(2 * rate)
+        overlap = max(overlap, 1)
+        b, a = scipy.signal.butter(order, band, btype='bandpass', fs=rate)
+        for start, segment, core in self.chunks(chunk_size, overlap, channel,
+                                                decimation):
+            filtered = scipy.signal.filtfilt(b, a, segment)
+            phase = np.angle(scipy.signal.hilbert(filtered))
+            yield start, phase[core.start:core.stop + 1]
+
+    def theta_reference(self, channel, t_start_ms=0, **kwargs):
+        """
+        Theta cycles starting at the peaks of the band-passed LFP.
+
+        Streaming version of ThetaReference.from_lfp. Keyword arguments are
+        passed on to theta_phase.
+
+        Parameters
+        ----------
+        channel : int
+            Channel to extract theta from.
+        t_start_ms : float
+            Time of the first sample in ms. The default is 0.
+
+        Returns
+        -------
+        ThetaReference
+        """
+        rate = self.sampling_rate / kwargs.get('decimation', 1)
+        cycle_starts = [start + phase_crossings(phase)
+                        for start, phase in self.theta_phase(channel,
+                                                             **kwargs)]
+        return ThetaReference(cycle_starts=t_start_ms +
+                              np.concatenate(cycle_starts) / rate * 1000)
+
+
 if __name__ == '__main__':
     example_file = r'D:\mizuseki\extracted\ec016.665.tar\ec016.665\ec016.41\ec016.665\ec016.665.eeg'
-    test = read_binary(example_file)
\ No newline at end of file
+    test = read_binary(example_file)
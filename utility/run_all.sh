@@ -1,3 +1,2 @@
-for i in {1..30}
-	do python tempotron_script_gc_merge.py -grid_seed $i -shuffling shuffled &
-done
+# All grid seeds and shufflings on one bounded process pool
+python run_tempotron_sweep.py
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+"""
+Tempotron runs of all grid seeds and shufflings on one process pool.
+
+Replaces starting one 05_tempotron.py per grid seed in the background.
+Results go to data/tempotron_thresholds_mean.db, rerunning the script only
+trains the runs that are not in the database yet. n_cells defaults to 200
+as in 05_tempotron.py, figure4.py uses the runs of
+    -n_cells 2000 -seed 91 and -seed 95
+with -network full and -network no-feedback-adjusted.
+"""
+
+import argparse
+import os
+from phase_to_rate import tempotron_sweep
+
+pr = argparse.ArgumentParser(description='Tempotron sweep')
+pr.add_argument('-engine',
+                type=str,
+                help='Tempotron implementation, package or phase_to_rate',
+                default='package',
+                dest='engine')
+pr.add_argument('-n_cells',
+                type=int,
+                help='Number of cells of each population',
+                default=200,
+                dest='n_cells')
+pr.add_argument('-seed',
+                type=int,
+                help='Seed of the tempotron efficacies',
+                default=91,
+                dest='seed')
+pr.add_argument('-network',
+                type=str,
+                help='Tuning of the network',
+                default='full',
+                dest='network')
+args = pr.parse_args()
+
+dirname = os.path.dirname(__file__)
+data_dir = os.path.join(dirname, '..', 'data')
+# The tables do not record the engine, each has its own database
+db_names = {'package': 'tempotron_thresholds_mean.db',
+            'phase_to_rate': 'tempotron_thresholds_mean_events.db'}
+db_path = os.path.join(data_dir, db_names[args.engine])
+
+grid_seeds = range(1, 31)
+shufflings = ['non-shuffled', 'shuffled']
+trajectory_pairs = [('75', '60')]
+cell_types = ['grid_spikes', 'granule_spikes']
+
+if __name__ == '__main__':
+    runs = tempotron_sweep.sweep_runs(grid_seeds, shufflings,
+                                      trajectory_pairs, cell_types)
+    n_new = tempotron_sweep.run_sweep(runs, db_path, data_dir,
+                                      parameters={'engine': args.engine,
+                                                  'n_cells': args.n_cells,
+                                                  'seed': args.seed,
+                                                  'network': args.network},
+                                      n_processes=None)
+    print(f"{n_new} new runs, {len(runs) - n_new} already in {db_path}")